@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Local benchmark of end-to-end secret delivery latency.
+
+Simulates many nodes bootstrapping at once. Each node runs a secret receiver and
+waits for its secrets. A stand-in for the provider Lambda, with a limited number of
+concurrent executions and a fixed delay in place of the DescribeClusterNode and
+GetSecretValue calls, posts the secrets back with send_secret(). Latency is measured
+from the Lambda invocation until the node has received all of its secrets.
+
+Example:
+    python3 benchmark_secret_delivery.py --num-nodes 64 --secrets-per-node 4
+"""
+import math
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from secret_receiver import SecretCallbackServer, SecretCallbackHandler
+from secret_provider_lambda import send_secret, callback_path
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values)-1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def stand_in_lambda(args, port, secret_names):
+    """Like provide_secrets() of the provider Lambda, without AWS calls"""
+    url = f"http://127.0.0.1:{port}{callback_path}"
+    for secret_name in secret_names:
+        time.sleep(args.lambda_delay_ms / 1000)
+        send_secret(url, secret_name, {"password": "x" * args.secret_size})
+
+
+def run_node(args, port, lambda_executor, latencies, lock):
+
+    http_server = SecretCallbackServer(("127.0.0.1", port), SecretCallbackHandler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    secret_names = [ f"secret-{i}" for i in range(args.secrets_per_node) ]
+
+    try:
+        t0 = time.perf_counter()
+        invocation = lambda_executor.submit(stand_in_lambda, args, port, secret_names)
+
+        deadline = time.monotonic() + args.timeout
+        for secret_name in secret_names:
+            http_server.wait_secret(secret_name, max(0, deadline - time.monotonic()))
+        latency = time.perf_counter() - t0
+
+        invocation.result()
+        with lock:
+            latencies.append(latency)
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Local benchmark of end-to-end secret delivery latency")
+    argparser.add_argument('--num-nodes', action="store", type=int, default=64, help='Number of nodes bootstrapping at once')
+    argparser.add_argument('--secrets-per-node', action="store", type=int, default=4, help='Number of secrets each node waits for')
+    argparser.add_argument('--lambda-concurrency', action="store", type=int, default=16, help='Concurrent executions of the stand-in Lambda')
+    argparser.add_argument('--lambda-delay-ms', action="store", type=float, default=20, help='Delay per secret in the stand-in Lambda, in place of AWS API calls')
+    argparser.add_argument('--secret-size', action="store", type=int, default=1024, help='Size of each secret value in bytes')
+    argparser.add_argument('--base-port', action="store", type=int, default=18180, help='Port of the first node, the others use the following ports')
+    argparser.add_argument('--timeout', action="store", type=float, default=60, help='How long each node waits for its secrets, in seconds')
+    args = argparser.parse_args()
+
+    latencies = []
+    lock = threading.Lock()
+    errors = []
+
+    print(f"{args.num_nodes} nodes x {args.secrets_per_node} secrets, {args.lambda_concurrency} concurrent Lambda executions, {args.lambda_delay_ms:.0f} ms per secret")
+
+    with ThreadPoolExecutor(max_workers=args.lambda_concurrency) as lambda_executor:
+        with ThreadPoolExecutor(max_workers=args.num_nodes) as node_executor:
+            futures = [ node_executor.submit(run_node, args, args.base_port + i, lambda_executor, latencies, lock) for i in range(args.num_nodes) ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+
+    # Latency of the last node if delivery were limited only by the Lambda delay and concurrency
+    lower_bound = math.ceil(args.num_nodes / args.lambda_concurrency) * args.secrets_per_node * args.lambda_delay_ms / 1000
+
+    latencies.sort()
+    print(f"Completed: {len(latencies)} nodes, {len(errors)} errors. Lower bound of max latency: {lower_bound*1000:.1f} ms")
+    for e in errors[:5]:
+        print(f"  {type(e).__name__}: {e}")
+    print(f"Delivery latency per node   p50={percentile(latencies, 50)*1000:7.1f} ms  p90={percentile(latencies, 90)*1000:7.1f} ms  "
+          f"p99={percentile(latencies, 99)*1000:7.1f} ms  max={latencies[-1]*1000 if latencies else float('nan'):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,51 @@ import os
 import json
 import pprint
 import argparse
-import urllib
+import urllib.request
 
 import boto3
 
 
 callback_port = 8080
 callback_path = "/secret"
+callback_timeout = 10
 
 # FIXME: for testing
 skip_node_status_check = True
 
 
-def provide_secret(cluster_name, node_id, secret_name):
+def send_secret(url, secret_name, secret):
+    """Post a secret to the callback server of the lifecycle script, and return the response"""
+
+    data = {
+        "secret_name": secret_name,
+        "secret": secret
+    }
+
+    # Convert data to JSON string and encode as bytes
+    data_bytes = json.dumps(data).encode('utf-8')
+
+    # Create request object with headers
+    headers = {
+        'Content-Type': 'application/json',
+    }
+
+    # Create the request
+    req = urllib.request.Request(
+        url=url,
+        data=data_bytes,
+        headers=headers,
+        method='POST'
+    )
+
+    # Send the request and get the response
+    with urllib.request.urlopen(req, timeout=callback_timeout) as response:
+        return response.read().decode('utf-8')
+
+
+def provide_secrets(cluster_name, node_id, secret_names):
     
-    print(cluster_name, node_id, secret_name)
+    print(cluster_name, node_id, secret_names)
 
     region_name = os.environ['AWS_REGION']
 
@@ -44,52 +74,42 @@ def provide_secret(cluster_name, node_id, secret_name):
 
     # TODO: Validate providing only one time
 
-    # ----------
-    # Getting secret
+    url = f"http://{node_ipaddr}:{callback_port}{callback_path}"
 
     secretsmanager_client = boto3.client("secretsmanager", region_name=region_name)
-    response = secretsmanager_client.get_secret_value(SecretId=secret_name)
-    secret = json.loads(response["SecretString"])
-    pprint.pprint(secret)
 
-    # ----------
-    # Callback to lifecycle script
+    failed_secret_names = []
 
-    url = f"http://{node_ipaddr}:{callback_port}{callback_path}"
+    for secret_name in secret_names:
 
-    data = {
-        "secret": secret
-    }
+        # ----------
+        # Getting secret
 
-    # Convert data to JSON string and encode as bytes
-    data_bytes = json.dumps(data).encode('utf-8')
-
-    # Create request object with headers
-    headers = {
-        'Content-Type': 'application/json',
-    }
+        response = secretsmanager_client.get_secret_value(SecretId=secret_name)
+        secret = json.loads(response["SecretString"])
 
-    # Create the request
-    req = urllib.request.Request(
-        url=url,
-        data=data_bytes,
-        headers=headers,
-        method='POST'
-    )
+        # ----------
+        # Callback to lifecycle script
 
-    try:
-        # Send the request and get the response
-        with urllib.request.urlopen(req) as response:
-            response_data = response.read().decode('utf-8')
+        try:
+            response_data = send_secret(url, secret_name, secret)
             print(f"Response: {response_data}")
-    except urllib.error.URLError as e:
-        print(f"Error: {e.reason}")
+        except OSError as e:
+            # URLError, and timeouts or connection resets while reading the response
+            print(f"Error: failed to send {secret_name}: {e}")
+            failed_secret_names.append(secret_name)
 
+    # Fail the invocation, so the receiver gets FunctionError right away instead of waiting for its deadline
+    if failed_secret_names:
+        raise RuntimeError(f"Failed to send secrets to {url}: {failed_secret_names}")
 
 
 def lambda_handler(event, context):
 
-    provide_secret(event["cluster_name"], event["node_id"], event["secret_name"])
+    # "secret_name" is accepted for receivers that ask for a single secret
+    secret_names = event.get("secret_names") or [event["secret_name"]]
+
+    provide_secrets(event["cluster_name"], event["node_id"], secret_names)
 
     return {
         'statusCode': 200,
@@ -105,7 +125,7 @@ if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description="Lambda function to get secret value and call back to lifecycle script")
     argparser.add_argument('--cluster-name', action="store", required=True, help='Cluster name')
     argparser.add_argument('--node-id', action="store", required=True, help='Instance ID to callback')
-    argparser.add_argument('--secret-name', action="store", required=True, help='Secret name')
+    argparser.add_argument('--secret-name', action="append", required=True, help='Secret name, repeated for multiple secrets')
     args = argparser.parse_args()
 
-    provide_secret(args.cluster_name, args.node_id, args.secret_name)
+    provide_secrets(args.cluster_name, args.node_id, args.secret_name)
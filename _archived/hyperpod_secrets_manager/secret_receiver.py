@@ -2,28 +2,60 @@ import os
 import time
 import json
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 
 import boto3
 
 
-class SecretCallbackServer(HTTPServer):
+# Name of secrets posted without "secret_name", by older versions of the provider Lambda
+default_secret_name = "default"
+
+# How long to wait for all secrets to arrive, in seconds
+default_wait_timeout = 300
+
+
+class SecretCallbackServer(ThreadingHTTPServer):
+    """Receives secrets posted by the provider Lambda, for any number of named secrets.
+
+    Callbacks are handled concurrently. Threads waiting for a secret are woken by an
+    Event as soon as it arrives, instead of polling.
+    """
+
+    daemon_threads = True
+
     def __init__(self, server_address, RequestHandlerClass):
         super().__init__(server_address, RequestHandlerClass)
-        self.secret = None
+        self.lock = threading.Lock()
+        self.secrets = {}
+        self.events = {}
 
+    def _get_event(self, secret_name):
+        with self.lock:
+            return self.events.setdefault(secret_name, threading.Event())
+
+    def put_secret(self, secret_name, secret):
+        with self.lock:
+            self.secrets[secret_name] = secret
+        self._get_event(secret_name).set()
+
+    def wait_secret(self, secret_name, timeout):
+        """Return the secret once it is received. Raise TimeoutError if it doesn't arrive in time."""
+        if not self._get_event(secret_name).wait(timeout):
+            raise TimeoutError(f"Secret {secret_name} was not received in time")
+        with self.lock:
+            return self.secrets[secret_name]
 
-class SecretCallbackHandler(BaseHTTPRequestHandler):
 
-    def __init__(self, request, client_address, server):
-        super().__init__(request, client_address, server)
+class SecretCallbackHandler(BaseHTTPRequestHandler):
 
-    def _send_response(self, data):
-        self.send_response(200)
+    def _send_response(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
 
     def _read_post_data(self):
         content_length = int(self.headers['Content-Length'])
@@ -42,32 +74,31 @@ class SecretCallbackHandler(BaseHTTPRequestHandler):
                 # print("PostData:")
                 # print(json.dumps(post_data, indent=2))
 
-                self.server.secret = post_data["secret"]
-
-                response = {
-                }
+                self.server.put_secret(post_data.get("secret_name", default_secret_name), post_data["secret"])
 
-                self._send_response(response)
+                self._send_response(200, {})
 
-            except json.JSONDecodeError as e:
+            except (json.JSONDecodeError, KeyError, AttributeError) as e:
 
                 print("Error:", e)
 
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                self._send_response(400, {
                     'error': 'Invalid JSON data',
                     'status': 'error'
-                }).encode())
+                })
         else:
             print(f"Error: unknown API path {api_path}")
 
             self.send_response(404)
+            self.send_header('Content-Length', '0')
             self.end_headers()
 
+    def log_message(self, format, *args):
+        return  # Suppress logs
+
 
-def get_secret(host='0.0.0.0', port=8080):
+def get_secrets(secret_names, host='0.0.0.0', port=8080, timeout=default_wait_timeout):
+    """Ask the provider Lambda for the secrets, and return them as a dict by name once all of them are received."""
 
     region_name = os.environ['AWS_REGION']
 
@@ -77,34 +108,46 @@ def get_secret(host='0.0.0.0', port=8080):
     server_address = (host, port)
     http_server = SecretCallbackServer(server_address, SecretCallbackHandler)
 
-    thread = threading.Thread(target=http_server.handle_request, args=())
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
     thread.start()
 
-    # --------------------
-    # Invoke Lambda
+    # One deadline for the Lambda invocation and all secrets
+    deadline = time.monotonic() + timeout
 
-    # FIXME: Should automatically get from resource_config.json
-    lambda_payload = {
-        "cluster_name": "slurm-1",
-        "node_id": "i-04e74d163c94af4a0",
-        "secret_name": "hyperpod-lifecycle-secret-test1"
-    }    
+    try:
+        # --------------------
+        # Invoke Lambda
 
-    lambda_client = boto3.client('lambda', region_name=region_name)
+        # FIXME: Should automatically get from resource_config.json
+        lambda_payload = {
+            "cluster_name": "slurm-1",
+            "node_id": "i-04e74d163c94af4a0",
+            "secret_names": secret_names,
+        }
 
-    # FIXME: should handle errors and do retries
-    response = lambda_client.invoke(
-        FunctionName='scret_provider', # FIXME: typo in the function name
-        InvocationType='RequestResponse',
-        Payload=json.dumps(lambda_payload)
-    )
+        lambda_client = boto3.client('lambda', region_name=region_name)
 
-    # --------------------
-    # Get received secret
+        # FIXME: should do retries
+        response = lambda_client.invoke(
+            FunctionName='scret_provider', # FIXME: typo in the function name
+            InvocationType='RequestResponse',
+            Payload=json.dumps(lambda_payload)
+        )
+        if "FunctionError" in response:
+            raise RuntimeError(f"Secret provider failed: {response['Payload'].read().decode()}")
 
-    thread.join()
+        # --------------------
+        # Get received secrets
 
-    return http_server.secret
+        return { secret_name: http_server.wait_secret(secret_name, max(0, deadline - time.monotonic())) for secret_name in secret_names }
+
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def get_secret(secret_name="hyperpod-lifecycle-secret-test1", **kwargs):
+    return get_secrets([secret_name], **kwargs)[secret_name]
 
 
 if __name__ == '__main__':
@@ -113,4 +156,3 @@ if __name__ == '__main__':
 
     secret = get_secret()
     print(secret)
-
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Latency test of the IMDS proxy against a local fake IMDS.
+
+Starts a fake IMDS (IMDSv2 tokens, a configurable response delay, and a large
+user-data sent with chunked encoding), starts imds-proxy-server.py in front of it,
+and sends requests from concurrent keep-alive clients, like SDKs polling IMDS on a
+busy node. The same clients are run against the fake IMDS directly as a baseline.
+
+The credentials path needs STS, so it is not part of this test.
+
+Example:
+    python3 imds-proxy-latency-test.py --concurrency 16 --duration 10
+"""
+import sys
+import math
+import time
+import uuid
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+USER_DATA = b"#!/bin/bash\n" + b"# padding\n" * (256 * 1024 // 10)
+
+METADATA = {
+    "/latest/meta-data/instance-id": b"i-0123456789abcdef0",
+    "/latest/meta-data/placement/availability-zone": b"us-west-2a",
+    "/latest/meta-data/local-ipv4": b"10.1.2.3",
+}
+
+# Requests of one client iteration. The token and user-data are fetched every 10th iteration.
+REQUESTS = [
+    ("GET", "/latest/meta-data/instance-id"),
+    ("GET", "/latest/meta-data/placement/availability-zone"),
+    ("GET", "/latest/meta-data/local-ipv4"),
+]
+PERIODIC_REQUESTS = [
+    ("PUT", "/latest/api/token"),
+    ("GET", "/latest/user-data"),
+]
+
+# Starts the proxy with REAL_IMDS pointing at the fake IMDS. The script name has hyphens, so it's loaded by path.
+PROXY_BOOTSTRAP = """
+import sys, importlib.util
+spec = importlib.util.spec_from_file_location("imds_proxy_server", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+module.REAL_IMDS = sys.argv[2]
+module.run(port=int(sys.argv[3]))
+"""
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values)-1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class FakeIMDSHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    tokens = set()
+    delay = 0.0
+    num_token_requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        return  # Suppress logs
+
+    def send_body(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        time.sleep(self.delay)
+        if self.path != "/latest/api/token" or "X-aws-ec2-metadata-token-ttl-seconds" not in self.headers:
+            self.send_body(400, b"")
+            return
+        token = uuid.uuid4().hex.encode()
+        self.tokens.add(token.decode())
+        with self.lock:
+            FakeIMDSHandler.num_token_requests += 1
+        self.send_body(200, token)
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        if self.headers.get("X-aws-ec2-metadata-token") not in self.tokens:
+            self.send_body(401, b"")
+        elif self.path in METADATA:
+            self.send_body(200, METADATA[self.path])
+        elif self.path == "/latest/user-data":
+            # Chunked, to test streaming passthrough without a Content-Length
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(USER_DATA), 16 * 1024):
+                chunk = USER_DATA[i:i + 16 * 1024]
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_body(404, b"")
+
+
+class Client(threading.Thread):
+
+    def __init__(self, port, stop_event, measure_event):
+        super().__init__(daemon=True)
+        self.port = port
+        self.stop_event = stop_event
+        self.measure_event = measure_event
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        self.token = None
+        self.results = []
+        self.num_errors = 0
+
+    def send(self, method, path):
+
+        headers = {}
+        if method == "PUT":
+            headers["X-aws-ec2-metadata-token-ttl-seconds"] = "21600"
+        else:
+            headers["X-aws-ec2-metadata-token"] = self.token
+
+        t0 = time.perf_counter()
+        try:
+            self.connection.request(method, path, headers=headers)
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.num_errors += self.measure_event.is_set()
+            return
+        latency = time.perf_counter() - t0
+
+        expected = USER_DATA if path == "/latest/user-data" else METADATA.get(path)
+        ok = response.status == 200 and (expected is None or body == expected)
+
+        if method == "PUT" and ok:
+            self.token = body.decode()
+
+        if self.measure_event.is_set():
+            if ok:
+                self.results.append((path, latency))
+            else:
+                self.num_errors += 1
+
+    def run(self):
+        i = 0
+        while not self.stop_event.is_set():
+            if i % 10 == 0:
+                for method, path in PERIODIC_REQUESTS:
+                    self.send(method, path)
+            for method, path in REQUESTS:
+                self.send(method, path)
+            i += 1
+
+
+def run_clients(port, concurrency, warmup, duration):
+
+    stop_event = threading.Event()
+    measure_event = threading.Event()
+
+    clients = [ Client(port, stop_event, measure_event) for _ in range(concurrency) ]
+    for client in clients:
+        client.start()
+
+    time.sleep(warmup)
+    measure_event.set()
+    time.sleep(duration)
+    measure_event.clear()
+    stop_event.set()
+    for client in clients:
+        client.join(15)
+
+    by_path = {}
+    for client in clients:
+        for path, latency in client.results:
+            by_path.setdefault(path, []).append(latency)
+
+    num_requests = sum( len(values) for values in by_path.values() )
+    num_errors = sum( client.num_errors for client in clients )
+    return num_requests, num_errors, { path: sorted(values) for path, values in by_path.items() }
+
+
+def print_results(name, duration, num_requests, num_errors, by_path, num_token_requests):
+    print(f"{name}: {num_requests/duration:,.0f} requests/sec, {num_errors} errors, {num_token_requests} token requests to the fake IMDS")
+    for method, path in PERIODIC_REQUESTS + REQUESTS:
+        values = by_path.get(path, [])
+        print(f"  {method:<4} {path:<48} p50={percentile(values, 50)*1000:7.2f} ms  p99={percentile(values, 99)*1000:7.2f} ms  n={len(values)}")
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Latency test of the IMDS proxy against a local fake IMDS")
+    argparser.add_argument('--proxy-script', action="store", default="imds-proxy-server.py", help='Proxy server script to test')
+    argparser.add_argument('--proxy-port', action="store", type=int, default=18080, help='Port of the proxy')
+    argparser.add_argument('--imds-port', action="store", type=int, default=18081, help='Port of the fake IMDS')
+    argparser.add_argument('--imds-delay-ms', action="store", type=float, default=1.0, help='Response delay of the fake IMDS in milliseconds')
+    argparser.add_argument('--concurrency', action="store", type=int, default=16, help='Number of concurrent clients')
+    argparser.add_argument('--duration', action="store", type=float, default=10, help='Measured duration in seconds')
+    argparser.add_argument('--warmup', action="store", type=float, default=1, help='Unmeasured warmup in seconds')
+    args = argparser.parse_args()
+
+    FakeIMDSHandler.delay = args.imds_delay_ms / 1000
+    imds_server = ThreadingHTTPServer(("127.0.0.1", args.imds_port), FakeIMDSHandler)
+    threading.Thread(target=imds_server.serve_forever, daemon=True).start()
+
+    print(f"Fake IMDS at http://127.0.0.1:{args.imds_port}, {args.imds_delay_ms} ms delay. {args.concurrency} clients, {args.duration:.0f} sec", flush=True)
+
+    FakeIMDSHandler.num_token_requests = 0
+    print_results("Fake IMDS (direct)", args.duration, *run_clients(args.imds_port, args.concurrency, args.warmup, args.duration), FakeIMDSHandler.num_token_requests)
+
+    proxy = subprocess.Popen([sys.executable, "-c", PROXY_BOOTSTRAP, args.proxy_script, f"http://127.0.0.1:{args.imds_port}", str(args.proxy_port)], stdout=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(args.proxy_port, timeout=15):
+            raise RuntimeError(f"Proxy didn't start listening on port {args.proxy_port}")
+        FakeIMDSHandler.num_token_requests = 0
+        print_results(f"Proxy ({args.proxy_script})", args.duration, *run_clients(args.proxy_port, args.concurrency, args.warmup, args.duration), FakeIMDSHandler.num_token_requests)
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+if __name__ == "__main__":
+    main()
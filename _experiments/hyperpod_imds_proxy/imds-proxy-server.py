@@ -1,6 +1,13 @@
 import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
 import json
+import time
+import base64
+import struct
+import hashlib
+import secrets
+import threading
 import requests
 import boto3
 import sys
@@ -9,129 +16,455 @@ REAL_IMDS = "http://169.254.169.254"
 ROLE_NAME = "ImdsProxyRole"  # The role you want to substitute
 ASSUME_ROLE_ARN =  "arn:aws:iam::842413447717:role/ImdsProxyTestRole"
 SESSION_NAME = "test-session"
+DURATION_SECONDS = 3600  # max 3600 for assume_role
+
+# Credentials are refreshed in the background this long before Expiration.
+# Longer than the 15 minutes before Expiration when SDKs start fetching new credentials,
+# so SDKs always get the next credentials, not the ones about to expire.
+REFRESH_BEFORE_EXPIRATION = datetime.timedelta(minutes=20)
+
+# Requests wait for a refresh only when the cached credentials expire sooner than this
+MIN_REMAINING_VALIDITY = datetime.timedelta(minutes=5)
+
+# Interval of retries when a background refresh fails
+REFRESH_RETRY_SECONDS = 30
+
+# After a failed STS call, requests don't call STS again for this many seconds, and get the same failure
+REFRESH_FAILURE_BACKOFF_SECONDS = 5
+
+# Timeout of requests to the real IMDS, in seconds
+PROXY_TIMEOUT = 2
+
+# Number of connections to the real IMDS kept alive for reuse
+PROXY_POOL_SIZE = 32
+
+# Idle keep-alive connections from clients are closed after this many seconds
+CLIENT_IDLE_TIMEOUT = 60
+
+# Metadata that doesn't change during the life of an instance, cached for IMMUTABLE_TTL_SECONDS
+IMMUTABLE_PATHS = {
+    "/latest/meta-data/instance-id",
+    "/latest/meta-data/instance-type",
+    "/latest/meta-data/ami-id",
+    "/latest/dynamic/instance-identity/document",
+}
+IMMUTABLE_PATH_PREFIXES = ("/latest/meta-data/placement/",)
+IMMUTABLE_TTL_SECONDS = 300
+
+# Headers of a single connection, which a proxy doesn't forward (RFC 7230). Content-Length is set per message.
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade", "host", "content-length"}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+TOKEN_PATH = "/latest/api/token"
+TOKEN_HEADER = "X-aws-ec2-metadata-token"
+TOKEN_TTL_HEADER = "X-aws-ec2-metadata-token-ttl-seconds"
+
+# Longest session token TTL accepted by IMDS, in seconds
+MAX_TOKEN_TTL_SECONDS = 21600
+
+# The upstream token is requested with the maximum TTL, and renewed when it expires sooner than this
+UPSTREAM_TOKEN_RENEW_SECONDS = 600
+
+
+class CredentialCache:
+    """Credentials of the assumed role, kept in memory as the serialized IMDS response.
+
+    A background thread refreshes them before Expiration, so requests are served from
+    memory without calling STS. Only one assume_role call is in flight at a time;
+    requests arriving during a refresh wait for it and share its result. A failure
+    is shared too, for REFRESH_FAILURE_BACKOFF_SECONDS, and cached credentials are
+    served until they actually expire.
+    """
+
+    def __init__(self, role_arn, session_name, duration_seconds):
+        self.role_arn = role_arn
+        self.session_name = session_name
+        self.duration_seconds = duration_seconds
+        self.sts = boto3.client("sts")
+        self.lock = threading.Lock()
+
+        # (response body, expiration), replaced as a whole
+        self.cached = None
+
+        # (time.monotonic, error) of the last failed STS call, None after a success
+        self.last_failure = None
+
+    def refresh(self, min_remaining):
+        """Call STS, unless the cached credentials are valid for min_remaining, e.g. refreshed by another thread while this one waited."""
+
+        with self.lock:
+            if self.cached and self.cached[1] - datetime.datetime.now(datetime.timezone.utc) > min_remaining:
+                return
+
+            if self.last_failure and time.monotonic() - self.last_failure[0] < REFRESH_FAILURE_BACKOFF_SECONDS:
+                raise RuntimeError(f"assume_role failed {time.monotonic() - self.last_failure[0]:.1f}s ago: {self.last_failure[1]}")
+
+            try:
+                response = self.sts.assume_role(
+                    RoleArn=self.role_arn,
+                    RoleSessionName=self.session_name,
+                    DurationSeconds=self.duration_seconds,
+                )
+            except Exception as e:
+                print(f"Failed to assume the role: {e}")
+                self.last_failure = (time.monotonic(), e)
+                raise
+            self.last_failure = None
+
+            creds = response["Credentials"]
+
+            imds_response = {
+                "Code": "Success",
+                "LastUpdated": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "Type": "AWS-HMAC",
+                "AccessKeyId": creds["AccessKeyId"],
+                "SecretAccessKey": creds["SecretAccessKey"],
+                "Token": creds["SessionToken"],
+                "Expiration": creds["Expiration"].strftime("%Y-%m-%dT%H:%M:%SZ")
+            }
+
+            self.cached = (json.dumps(imds_response).encode(), creds["Expiration"])
+            print(f"Refreshed credentials for the role, expiring at {imds_response['Expiration']}")
+
+    def get(self):
+        """Return the IMDS response body of valid credentials"""
+        cached = self.cached
+        if cached is None or cached[1] - datetime.datetime.now(datetime.timezone.utc) <= MIN_REMAINING_VALIDITY:
+            try:
+                self.refresh(MIN_REMAINING_VALIDITY)
+            except Exception:
+                # Credentials about to expire are still better than an error, e.g. while STS throttles
+                cached = self.cached
+                if cached is None or cached[1] <= datetime.datetime.now(datetime.timezone.utc):
+                    raise
+            cached = self.cached
+        return cached[0]
+
+    def run(self):
+        while True:
+            try:
+                self.refresh(REFRESH_BEFORE_EXPIRATION)
+                wait_seconds = (self.cached[1] - REFRESH_BEFORE_EXPIRATION - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            except Exception as e:
+                print(f"Failed to refresh credentials: {e}")
+                wait_seconds = REFRESH_RETRY_SECONDS
+            time.sleep(max(wait_seconds, 1))
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+credential_cache = None
+
+
+def create_session():
+    """Session with a pool of keep-alive connections to the real IMDS, shared by all handler threads"""
+    session = requests.Session()
+    # Forward only the client's headers, not the requests defaults (User-Agent, Accept-Encoding, ...)
+    session.headers.clear()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=PROXY_POOL_SIZE))
+    return session
+
+
+session = create_session()
+
+
+def is_immutable_path(path):
+    return path in IMMUTABLE_PATHS or path.startswith(IMMUTABLE_PATH_PREFIXES)
+
+
+class ResponseCache:
+    """Responses of immutable metadata paths, kept for a short TTL"""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1], entry[2]
+
+    def put(self, path, headers, body):
+        self.entries[path] = (time.monotonic() + self.ttl_seconds, headers, body)
+
+
+response_cache = ResponseCache(IMMUTABLE_TTL_SECONDS)
+
+
+class TokenSigner:
+    """IMDSv2 session tokens issued by the proxy to clients, with their TTLs.
+
+    Clients get tokens from the proxy instead of the real IMDS, so a token PUT doesn't
+    cost an upstream round-trip. Requests with a valid token are forwarded with the
+    proxy's own upstream token.
+
+    A token is its expiration, signed with an HMAC key of this process, so nothing is
+    stored per token. Tokens are invalidated when the proxy restarts, like IMDS tokens
+    when IMDS restarts.
+    """
+
+    def __init__(self):
+        self.key = secrets.token_bytes(32)
+
+    def sign(self, payload):
+        return hmac.new(self.key, payload, hashlib.sha256).digest()
+
+    def issue(self, ttl_seconds):
+        # Expiration in milliseconds of time.monotonic, which is only meaningful within this process
+        payload = struct.pack(">Q", int((time.monotonic() + ttl_seconds) * 1000))
+        return base64.urlsafe_b64encode(payload + self.sign(payload)).decode()
+
+    def is_valid(self, token):
+        try:
+            data = base64.b64decode(token, altchars="-_", validate=True)
+        except ValueError:
+            return False
+        payload, signature = data[:8], data[8:]
+        if len(payload) != 8 or not hmac.compare_digest(signature, self.sign(payload)):
+            return False
+        return struct.unpack(">Q", payload)[0] > time.monotonic() * 1000
+
+
+class UpstreamToken:
+    """One long-lived IMDSv2 token of the real IMDS, shared by all forwarded requests"""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+
+        # (token, expiration), replaced as a whole
+        self.cached = None
+
+    def get(self, renew=False):
+        """Return a token valid for UPSTREAM_TOKEN_RENEW_SECONDS. With renew=True, replace the cached token, e.g. after IMDS rejected it."""
+
+        cached = self.cached
+        if not renew and cached and cached[1] - time.monotonic() > UPSTREAM_TOKEN_RENEW_SECONDS:
+            return cached[0]
+
+        with self.lock:
+            # Another thread may have renewed the token while this one waited
+            if self.cached is not cached and self.cached[1] - time.monotonic() > UPSTREAM_TOKEN_RENEW_SECONDS:
+                return self.cached[0]
+
+            t0 = time.monotonic()
+            response = session.put(REAL_IMDS + TOKEN_PATH, headers={TOKEN_TTL_HEADER: str(self.ttl_seconds)}, timeout=PROXY_TIMEOUT)
+            response.raise_for_status()
+            self.cached = (response.text, t0 + self.ttl_seconds)
+            return self.cached[0]
+
+
+token_signer = TokenSigner()
+upstream_token = UpstreamToken(MAX_TOKEN_TTL_SECONDS)
+
 
 class IMDSMockHandler(BaseHTTPRequestHandler):
-    
+
+    # Keep connections from SDKs alive. Every response has a Content-Length or chunked encoding.
+    protocol_version = "HTTP/1.1"
+    timeout = CLIENT_IDLE_TIMEOUT
+
+    # Headers and body are separate writes. Without this, Nagle's algorithm and delayed ACK add ~40ms on keep-alive connections.
+    disable_nagle_algorithm = True
+
     def do_GET(self):
+        if self.reject_invalid_token():
+            return
+
         if self.path == "/latest/meta-data/iam/security-credentials/":
             # Return the spoofed role name
+            body = ROLE_NAME.encode()
             self.send_response(200)
             self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(ROLE_NAME.encode())
+            self.wfile.write(body)
 
         elif self.path == f"/latest/meta-data/iam/security-credentials/{ROLE_NAME}":
-            # Return substituted credentials
+            # Return substituted credentials, from the cache
             try:
-                print("Posting credentials for the role")
-                sts = boto3.client("sts")
-
-                try:
-                    response = sts.assume_role(
-                        RoleArn=ASSUME_ROLE_ARN,
-                        RoleSessionName=SESSION_NAME,
-                        DurationSeconds=3600  # max 3600 for assume_role
-                    )
-
-                    creds = response["Credentials"]
-
-                    imds_response = {
-                        "Code": "Success",
-                        "LastUpdated": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                        "Type": "AWS-HMAC",
-                        "AccessKeyId": creds["AccessKeyId"],
-                        "SecretAccessKey": creds["SecretAccessKey"],
-                        "Token": creds["SessionToken"],
-                        "Expiration": creds["Expiration"].strftime("%Y-%m-%dT%H:%M:%SZ")
-                    }
-
-                    # send response
-                    self.send_response(200)
-                    self.send_header("Content-Type", "application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps(imds_response).encode())
-
-                except Exception as e:
-                    print(e)
-                    self.send_error(500, f"Failed to assume role: {e}")
-
+                body = credential_cache.get()
             except Exception as e:
-                self.send_error(500, f"Failed to get credentials: {e}")
+                print(e)
+                self.send_error(500, f"Failed to assume role: {e}")
+                return
+
+            # send response
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
         else:
             # Proxy all other IMDS requests to the real IMDS
-            try:
-                proxied = requests.get(REAL_IMDS + self.path, headers=self.headers, timeout=2)
-                self.send_response(proxied.status_code)
-                for key, value in proxied.headers.items():
-                    self.send_header(key, value)
-                self.end_headers()
-                self.wfile.write(proxied.content)
-            except Exception as e:
-                self.send_error(500, f"Proxy failed: {e}")
-
+            self.proxy("GET")
 
     def do_HEAD(self):
+        if self.reject_invalid_token():
+            return
+        self.proxy("HEAD")
+
+    def do_PUT(self):
+        if self.path == TOKEN_PATH:
+            self.issue_token()
+        else:
+            if self.reject_invalid_token():
+                return
+            self.proxy("PUT")
+
+    def reject_invalid_token(self):
+        """Like IMDS, reject a request with an invalid or expired token. Requests without a token (IMDSv1) are served as before."""
+        token = self.headers.get(TOKEN_HEADER)
+        if token is not None and not token_signer.is_valid(token):
+            if self.discard_body():
+                self.send_empty(401)
+            return True
+        return False
+
+    def issue_token(self):
+        """Issue a session token of the proxy, without calling the real IMDS"""
+
+        # Read the request body, if any, so it isn't parsed as the next request of the keep-alive connection
+        if not self.discard_body():
+            return
+
+        # Like IMDS, reject token requests that went through another proxy
+        if "X-Forwarded-For" in self.headers:
+            self.send_empty(403)
+            return
+
         try:
-            # Forward the original headers
-            headers = {key: val for key, val in self.headers.items()}
-            
-            # Send HEAD request to target server using requests
-            response = requests.head(REAL_IMDS + self.path, headers=headers, timeout=2)
-            
-            # Send response status code
-            self.send_response(response.status_code)
-            
-            # Forward response headers
-            for header, value in response.headers.items():
-                self.send_header(header, value)
+            ttl_seconds = int(self.headers.get(TOKEN_TTL_HEADER, ""))
+        except ValueError:
+            ttl_seconds = 0
+        if not 1 <= ttl_seconds <= MAX_TOKEN_TTL_SECONDS:
+            self.send_empty(400)
+            return
+
+        body = token_signer.issue(ttl_seconds).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header(TOKEN_TTL_HEADER, str(ttl_seconds))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def discard_body(self):
+        """Read and drop the request body. Return False, after answering 400, if its length is unknown."""
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0 or "Transfer-Encoding" in self.headers:
+            self.send_response(400)
+            self.send_header("Connection", "close")
+            self.send_header("Content-Length", "0")
             self.end_headers()
-            
+            return False
+        self.rfile.read(content_length)
+        return True
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_cached(self, headers, body):
+        self.send_response(200)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def proxy(self, method):
+        """Forward the request to the real IMDS over a pooled connection, and stream the response back"""
+
+        # Tokens of all requests are already validated by reject_invalid_token(), and are replaced with the upstream token
+        has_token = TOKEN_HEADER in self.headers
+
+        # Immutable metadata is served from the cache. Like IMDS with IMDSv2 required, only to requests with a token.
+        cacheable = method == "GET" and is_immutable_path(self.path) and has_token
+        if cacheable:
+            cached = response_cache.get(self.path)
+            if cached:
+                self.send_cached(*cached)
+                return
+
+        # Get the content length from headers, and read the request body
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length) if content_length > 0 else None
+
+        # Forward the original headers, except for the ones of this connection
+        headers = { key: value for key, value in self.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS }
+
+        try:
+            if has_token:
+                headers = { key: value for key, value in headers.items() if key.lower() != TOKEN_HEADER.lower() }
+                headers[TOKEN_HEADER] = upstream_token.get()
+            response = session.request(method, REAL_IMDS + self.path, data=body, headers=headers, stream=True, timeout=PROXY_TIMEOUT, allow_redirects=False)
+            if has_token and response.status_code == 401:
+                # The upstream token was rejected before its expiration, e.g. IMDS restarted. Retry once with a new one.
+                response.close()
+                headers[TOKEN_HEADER] = upstream_token.get(renew=True)
+                response = session.request(method, REAL_IMDS + self.path, data=body, headers=headers, stream=True, timeout=PROXY_TIMEOUT, allow_redirects=False)
         except requests.exceptions.RequestException as e:
             self.send_error(500, f"Proxy failed: {e}")
+            return
 
+        with response:
 
-    def do_PUT(self):
-        try:
-            # Get the content length from headers
-            content_length = int(self.headers.get('Content-Length', 0))
-            
-            # Read the request body
-            body = self.rfile.read(content_length) if content_length > 0 else None
-            
-            # Forward all headers from the original request
-            headers = dict(self.headers)
-            
-            # Forward the PUT request to the target server
-            # Replace 'target_url' with your actual target URL
-            target_url = REAL_IMDS + self.path
-            
-            response = requests.put(
-                target_url,
-                data=body,
-                headers=headers,
-                stream=True
-            )
-            
-            # Send response status code
+            response_headers = [ (key, value) for key, value in response.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS ]
+
+            if cacheable and response.status_code == 200:
+                response_body = response.raw.read(decode_content=False)
+                response_cache.put(self.path, response_headers, response_body)
+                self.send_cached(response_headers, response_body)
+                return
+
+            # Send response status code, and forward response headers
             self.send_response(response.status_code)
-            
-            # Forward response headers
-            for key, value in response.headers.items():
+            for key, value in response_headers:
                 self.send_header(key, value)
+
+            upstream_content_length = response.headers.get("Content-Length")
+
+            if method == "HEAD" or response.status_code in (204, 304):
+                if upstream_content_length is not None:
+                    self.send_header("Content-Length", upstream_content_length)
+                self.end_headers()
+                return
+
+            # Stream the body as it arrives. Without a length from the real IMDS, use chunked encoding.
+            chunked = upstream_content_length is None
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            else:
+                self.send_header("Content-Length", upstream_content_length)
             self.end_headers()
-            
-            # Send response body
-            self.wfile.write(response.content)
-            
-        except Exception as e:
-            self.send_error(500, f"Proxy failed: {e}")
+
+            try:
+                for chunk in response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                    if chunked:
+                        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    else:
+                        self.wfile.write(chunk)
+                if chunked:
+                    self.wfile.write(b"0\r\n\r\n")
+            except Exception as e:
+                # Headers are already sent, so the only way to report the failure is to close the connection
+                print(f"Proxy failed while streaming {self.path}: {e}")
+                self.close_connection = True
 
     def log_message(self, format, *args):
         return  # Suppress logs
 
 
-def run(server_class=HTTPServer, handler_class=IMDSMockHandler, port=8080):
+def run(server_class=ThreadingHTTPServer, handler_class=IMDSMockHandler, port=8080):
     server_address = ("127.0.0.1", port)
     httpd = server_class(server_address, handler_class)
     print(f"Mock IMDS proxy running at http://127.0.0.1:{port}")
@@ -142,12 +475,10 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         ROLE_NAME = sys.argv[1]
 
-    # Make sure early that the instance execution role has permission to assume the role
-    sts = boto3.client("sts")
-    response = sts.assume_role(
-        RoleArn=ASSUME_ROLE_ARN,
-        RoleSessionName=SESSION_NAME,
-        DurationSeconds=3600  # max 3600 for assume_role
-    )
+    # Make sure early that the instance execution role has permission to assume the role.
+    # This also fills the cache, so the first requests don't wait for STS.
+    credential_cache = CredentialCache(ASSUME_ROLE_ARN, SESSION_NAME, DURATION_SECONDS)
+    credential_cache.refresh(REFRESH_BEFORE_EXPIRATION)
+    credential_cache.start()
 
     run()
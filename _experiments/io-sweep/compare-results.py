@@ -0,0 +1,185 @@
+"""
+Throughput regression detector for fio / IOR benchmark results
+
+Loads a baseline and a candidate set of result CSVs (as written by fio-test.py,
+ior-test.py, or "io-sweep.py export-csv"), matches cells by their configuration
+columns, and reports the percent change of read/write bandwidth with a bootstrap
+confidence interval. A cell is flagged as a regression when the whole interval is
+below -threshold.
+
+Repeat runs of the same matrix ("io-sweep.py run --repeats N"), or one row per
+IOR iteration ("io-sweep.py export-csv --per-iteration"), give each cell several
+samples. With a single sample on either side there is no interval, and the change
+itself is compared with the threshold.
+
+Examples:
+    python3 compare-results.py --baseline result-20250118-*.csv --candidate result-20250201-*.csv
+    python3 compare-results.py --baseline old.csv --candidate new.csv --threshold 10 --output-csv diff.csv
+"""
+
+import sys
+import csv
+import random
+import argparse
+import statistics
+import collections
+
+
+metric_columns = ["read_bw_mean", "write_bw_mean"]
+
+
+def load_results(filenames):
+    """Load CSVs into {cell_key: {metric: [samples]}}
+
+    The cell key is every non-metric column, so fio and IOR CSVs can be compared
+    with the same code and never match each other.
+    """
+
+    results = collections.defaultdict(lambda: collections.defaultdict(list))
+    key_columns = None
+
+    for filename in filenames:
+        with open(filename, newline="") as fd:
+            reader = csv.DictReader(fd)
+
+            columns = [ column for column in reader.fieldnames if column not in metric_columns ]
+            if key_columns is None:
+                key_columns = columns
+            elif columns != key_columns:
+                raise ValueError(f"{filename} has columns {columns}, expected {key_columns}")
+
+            for row in reader:
+                key = tuple( row[column] for column in key_columns )
+                for metric in metric_columns:
+                    value = row.get(metric)
+                    if value in (None, ""):
+                        continue
+                    results[key][metric].append(float(value))
+
+    return key_columns, results
+
+
+def percent_change(baseline, candidate):
+    base_mean = statistics.fmean(baseline)
+    if base_mean==0:
+        return float("nan")
+    return (statistics.fmean(candidate) / base_mean - 1.0) * 100.0
+
+
+def bootstrap_ci(baseline, candidate, num_resamples, confidence, rng):
+    """Percentile bootstrap interval of the percent change of the means"""
+
+    changes = []
+    for _ in range(num_resamples):
+        b = rng.choices(baseline, k=len(baseline))
+        c = rng.choices(candidate, k=len(candidate))
+        change = percent_change(b, c)
+        if change==change:
+            changes.append(change)
+
+    if not changes:
+        return float("nan"), float("nan")
+
+    changes.sort()
+    alpha = (1.0 - confidence) / 2.0
+    lo = changes[int(alpha * (len(changes)-1))]
+    hi = changes[int((1.0-alpha) * (len(changes)-1))]
+    return lo, hi
+
+
+def compare(baseline_results, candidate_results, args):
+
+    rng = random.Random(args.seed)
+    rows = []
+
+    for key in sorted(set(baseline_results) & set(candidate_results)):
+        for metric in metric_columns:
+
+            baseline = baseline_results[key][metric]
+            candidate = candidate_results[key][metric]
+            if not baseline or not candidate:
+                continue
+
+            change = percent_change(baseline, candidate)
+
+            if len(baseline) < 2 or len(candidate) < 2:
+                # No interval from a single sample, so the point change alone decides
+                lo, hi = change, change
+            else:
+                lo, hi = bootstrap_ci(baseline, candidate, args.num_resamples, args.confidence, rng)
+
+            if hi < -args.threshold:
+                verdict = "REGRESSION"
+            elif lo > args.threshold:
+                verdict = "improvement"
+            else:
+                verdict = "ok"
+
+            rows.append({
+                "key": key,
+                "metric": metric,
+                "baseline_mean": statistics.fmean(baseline),
+                "candidate_mean": statistics.fmean(candidate),
+                "num_baseline": len(baseline),
+                "num_candidate": len(candidate),
+                "change_pct": change,
+                "ci_lo_pct": lo,
+                "ci_hi_pct": hi,
+                "verdict": verdict,
+            })
+
+    return rows
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Compare two sets of fio / IOR result CSVs and flag throughput regressions")
+    argparser.add_argument("--baseline", action="store", nargs="+", required=True, help="Baseline result CSVs")
+    argparser.add_argument("--candidate", action="store", nargs="+", required=True, help="Candidate result CSVs")
+    argparser.add_argument("--threshold", action="store", type=float, default=5.0, help="Minimum change in percent to flag, on top of statistical significance")
+    argparser.add_argument("--confidence", action="store", type=float, default=0.95, help="Confidence level of the bootstrap interval")
+    argparser.add_argument("--num-resamples", action="store", type=int, default=2000, help="Number of bootstrap resamples")
+    argparser.add_argument("--seed", action="store", type=int, default=0, help="Random seed, for reproducible intervals")
+    argparser.add_argument("--only-regressions", action="store_true", help="Print only regressed cells")
+    argparser.add_argument("--output-csv", action="store", default=None, help="Write the full comparison to a CSV file")
+    args = argparser.parse_args()
+
+    baseline_columns, baseline_results = load_results(args.baseline)
+    candidate_columns, candidate_results = load_results(args.candidate)
+    if baseline_columns != candidate_columns:
+        argparser.error(f"Baseline columns {baseline_columns} don't match candidate columns {candidate_columns}")
+
+    unmatched = set(baseline_results) ^ set(candidate_results)
+    if unmatched:
+        print(f"{len(unmatched)} cells exist only on one side and are ignored")
+
+    rows = compare(baseline_results, candidate_results, args)
+
+    key_label = "/".join(baseline_columns)
+    print(f"{key_label:<50} {'metric':<14} {'baseline':>12} {'candidate':>12} {'change':>9} {'CI':>20}  verdict")
+    for row in rows:
+        if args.only_regressions and row["verdict"]!="REGRESSION":
+            continue
+        key = "/".join(row["key"])
+        if row["num_baseline"] < 2 or row["num_candidate"] < 2:
+            ci = "single sample"
+        else:
+            ci = f"[{row['ci_lo_pct']:+.1f}, {row['ci_hi_pct']:+.1f}]"
+        print(f"{key:<50} {row['metric']:<14} {row['baseline_mean']:>12.1f} {row['candidate_mean']:>12.1f} {row['change_pct']:>+8.1f}% {ci:>20}  {row['verdict']}")
+
+    if args.output_csv:
+        with open(args.output_csv, "w", newline="") as fd:
+            csv_writer = csv.writer(fd)
+            csv_writer.writerow(baseline_columns + ["metric", "baseline_mean", "candidate_mean", "num_baseline", "num_candidate", "change_pct", "ci_lo_pct", "ci_hi_pct", "verdict"])
+            for row in rows:
+                csv_writer.writerow(list(row["key"]) + [ row[column] for column in ["metric", "baseline_mean", "candidate_mean", "num_baseline", "num_candidate", "change_pct", "ci_lo_pct", "ci_hi_pct", "verdict"] ])
+
+    num_regressions = sum( 1 for row in rows if row["verdict"]=="REGRESSION" )
+    print(f"{len(rows)} comparisons, {num_regressions} regressions")
+
+    # Non-zero exit code so this can gate a pipeline
+    return 1 if num_regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
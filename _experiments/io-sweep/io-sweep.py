@@ -0,0 +1,650 @@
+"""
+fio / IOR sweep orchestrator
+
+Runs every cell of a fio or IOR test matrix and stores the results in a SQLite
+database keyed by a hash of the cell configuration and a repeat index. Re-running
+the same sweep skips cells that are already complete, so a crash in the middle of
+a long sweep only costs the cell that was running. --repeats N runs the whole
+matrix N times, so each cell gets N samples for compare-results.py.
+
+Examples:
+    python3 io-sweep.py run --tool fio --db sweep.db --nodes-file hosts.txt
+    python3 io-sweep.py run --tool ior --db sweep.db --nodes-file hosts.txt --matrix my-matrix.json
+    python3 io-sweep.py run --tool fio --db sweep.db --nodes-file hosts.txt --repeats 3
+    python3 io-sweep.py status --db sweep.db
+    python3 io-sweep.py export-csv --db sweep.db --tool fio --output result-fio.csv
+    python3 io-sweep.py export-csv --db sweep.db --tool ior --output result-ior.csv --per-iteration
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import collections
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+
+# Default test matrices. Same cells as fio-test.py and ior-test.py.
+# Override with --matrix <json file> using the same structure.
+default_matrices = {
+    "fio": {
+        "filesystems": {
+            "fsx": "/fsx2/fio-data/",
+            "weka": "/mnt/weka/fio-data/",
+        },
+        "sizes": [
+            ["2G", "4K"],
+            ["2G", "64K"],
+            ["2G", "1M"],
+            ["2G", "16M"],
+            ["2G", "256M"],
+        ],
+        "scales": [
+            [1, 1], [2, 1], [4, 1], [8, 1], [16, 1],
+            [16, 2], [16, 4], [16, 8], [16, 16], [16, 32],
+        ],
+        "options": {
+            "runtime": 60,
+            "ioengine": "libaio",
+            "iodepth": 1,
+            "direct": 0,
+            "readwrite": "randrw",
+        },
+    },
+    "ior": {
+        "filesystems": {
+            "fsx": "/fsx2/ior-data/",
+            "weka": "/mnt/weka/ior-data/",
+        },
+        "sizes": [
+            ["16M", "4K"],
+            ["32M", "64K"],
+            ["64M", "1M"],
+            ["128M", "16M"],
+            ["256M", "256M"],
+        ],
+        "scales": [
+            [1, 1], [2, 2], [4, 4], [8, 8], [16, 16],
+            [16, 32], [16, 64], [16, 128], [16, 256], [16, 512],
+        ],
+        "options": {
+            "api": "POSIX",
+            "direct": 0,
+            "repetitions": 3,
+            "args": ["-F", "-g", "-w", "-r", "-e", "-C", "-D", "0", "-d", "1"],
+        },
+    },
+}
+
+
+# CSV columns written by fio-test.py / ior-test.py. export-csv keeps them as-is,
+# so the existing visualize.ipynb notebooks can read sweep results.
+csv_columns = {
+    "fio": ["filesystem_type", "file_size", "transfer_size", "num_nodes", "num_jobs", "read_bw_mean", "write_bw_mean"],
+    "ior": ["filesystem_type", "block_size", "transfer_size", "num_nodes", "num_processes", "read_bw_mean", "write_bw_mean"],
+}
+
+
+def run_subprocess_wrap(cmd, print_output=True, to_file=None, raise_non_zero_retcode=True):
+
+    print(f"Running {cmd}")
+
+    captured_stdout = io.StringIO()
+
+    p = subprocess.Popen( cmd, bufsize=1, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+    for line in iter(p.stdout.readline, ""):
+        captured_stdout.write(line)
+        if print_output:
+            print( line, end="", flush=True )
+    p.wait()
+
+    if to_file:
+        with open(to_file,"w") as fd:
+            fd.write(captured_stdout.getvalue())
+
+    if raise_non_zero_retcode and p.returncode != 0:
+        raise ChildProcessError(f"Subprocess {cmd} returned non-zero exit code {p.returncode}.")
+
+    return captured_stdout.getvalue()
+
+
+# -----
+# Test cells
+
+def build_cells(tool, matrix):
+
+    cells = []
+
+    for filesystem_type, datadir in matrix["filesystems"].items():
+        for size, transfer_size in matrix["sizes"]:
+            for num_nodes, num_per_node in matrix["scales"]:
+
+                cell = {
+                    "tool": tool,
+                    "filesystem_type": filesystem_type,
+                    "datadir": datadir,
+                    "transfer_size": transfer_size,
+                    "num_nodes": num_nodes,
+                    "options": matrix.get("options", {}),
+                }
+
+                if tool=="fio":
+                    cell["file_size"] = size
+                    cell["num_jobs"] = num_per_node
+                elif tool=="ior":
+                    cell["block_size"] = size
+                    cell["num_processes"] = num_per_node
+                else:
+                    assert False, f"Unknown tool {tool}"
+
+                cells.append(cell)
+
+    return cells
+
+
+def get_cell_hash(cell):
+    s = json.dumps(cell, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:16]
+
+
+def get_cell_name(cell):
+    if cell["tool"]=="fio":
+        return f"fio-{cell['filesystem_type']}-{cell['file_size']}-{cell['transfer_size']}-{cell['num_nodes']}-{cell['num_jobs']}"
+    else:
+        return f"ior-{cell['filesystem_type']}-{cell['block_size']}-{cell['transfer_size']}-{cell['num_nodes']}-{cell['num_processes']}"
+
+
+# -----
+# Result store
+
+class ResultStore:
+
+    def __init__(self, filename):
+        self.conn = sqlite3.connect(filename)
+        self.conn.row_factory = sqlite3.Row
+
+        # Databases written before repeat_index was added have one row per cell_hash, which becomes repeat 0
+        columns = [ row["name"] for row in self.conn.execute("PRAGMA table_info(cells)") ]
+        if columns and "repeat_index" not in columns:
+            self.conn.execute("ALTER TABLE cells RENAME TO cells_v1")
+            self._create_table()
+            self.conn.execute(f"INSERT INTO cells ({','.join(columns)}, repeat_index) SELECT {','.join(columns)}, 0 FROM cells_v1")
+            self.conn.execute("DROP TABLE cells_v1")
+        else:
+            self._create_table()
+        self.conn.commit()
+
+    def _create_table(self):
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cells (
+                cell_hash TEXT NOT NULL,
+                repeat_index INTEGER NOT NULL DEFAULT 0,
+                tool TEXT NOT NULL,
+                name TEXT NOT NULL,
+                config TEXT NOT NULL,
+                status TEXT NOT NULL,
+                hosts TEXT,
+                started_at TEXT,
+                finished_at TEXT,
+                read_bw_mean REAL,
+                write_bw_mean REAL,
+                summary TEXT,
+                raw_output TEXT,
+                error TEXT,
+                PRIMARY KEY (cell_hash, repeat_index)
+            )
+            """
+        )
+
+    def get_status(self, cell_hash, repeat_index):
+        row = self.conn.execute("SELECT status FROM cells WHERE cell_hash=? AND repeat_index=?", (cell_hash, repeat_index)).fetchone()
+        return row["status"] if row else None
+
+    def mark_running(self, cell_hash, repeat_index, cell, hosts):
+        now = datetime.datetime.now().isoformat()
+        self.conn.execute(
+            """
+            INSERT INTO cells (cell_hash, repeat_index, tool, name, config, status, hosts, started_at)
+            VALUES (?, ?, ?, ?, ?, 'running', ?, ?)
+            ON CONFLICT(cell_hash, repeat_index) DO UPDATE SET
+                status='running', hosts=excluded.hosts, started_at=excluded.started_at,
+                finished_at=NULL, error=NULL
+            """,
+            (cell_hash, repeat_index, cell["tool"], get_cell_name(cell), json.dumps(cell, sort_keys=True), ",".join(hosts), now)
+        )
+        self.conn.commit()
+
+    def mark_complete(self, cell_hash, repeat_index, result):
+        now = datetime.datetime.now().isoformat()
+        self.conn.execute(
+            """
+            UPDATE cells SET status='complete', finished_at=?, read_bw_mean=?, write_bw_mean=?, summary=?, raw_output=?
+            WHERE cell_hash=? AND repeat_index=?
+            """,
+            (now, result["read_bw_mean"], result["write_bw_mean"], json.dumps(result["summary"]), result["raw_output"], cell_hash, repeat_index)
+        )
+        self.conn.commit()
+
+    def mark_failed(self, cell_hash, repeat_index, error, raw_output=None):
+        now = datetime.datetime.now().isoformat()
+        self.conn.execute(
+            "UPDATE cells SET status='failed', finished_at=?, error=?, raw_output=? WHERE cell_hash=? AND repeat_index=?",
+            (now, error, raw_output, cell_hash, repeat_index)
+        )
+        self.conn.commit()
+
+    def list_cells(self, tool=None):
+        if tool:
+            return self.conn.execute("SELECT * FROM cells WHERE tool=? ORDER BY started_at", (tool,)).fetchall()
+        return self.conn.execute("SELECT * FROM cells ORDER BY started_at").fetchall()
+
+
+# -----
+# fio
+
+def run_fio_cell(cell, hosts, workdir):
+
+    name = get_cell_name(cell)
+    options = cell["options"]
+
+    hosts_filename = os.path.join(workdir, f"hosts-{name}.txt")
+    config_filename = os.path.join(workdir, f"config-{name}.txt")
+
+    with open(hosts_filename, "w") as fd:
+        fd.write("\n".join(hosts))
+
+    with open(config_filename, "w") as fd:
+        d = [
+            f"[global]",
+            f"time_based=1",
+            f"runtime={options.get('runtime', 60)}",
+            f"startdelay=5",
+            f"exitall_on_error=1",
+            f"group_reporting",
+            f"clocksource=gettimeofday",
+            f"disk_util=0",
+            f"ioengine={options.get('ioengine', 'libaio')}",
+            f"iodepth={options.get('iodepth', 1)}",
+            f"direct={options.get('direct', 0)}",
+            f"stonewall",
+            f"filesize={cell['file_size']}",
+            f"blocksize={cell['transfer_size']}",
+            f"directory={cell['datadir']}",
+
+            f"[test1]",
+            f"readwrite={options.get('readwrite', 'randrw')}",
+            f"numjobs={cell['num_jobs']}",
+        ]
+        fd.write("\n".join(d))
+
+    cmd = [
+        "fio",
+        f"--client={hosts_filename}",
+        "--output-format=json",
+        config_filename,
+    ]
+
+    output = run_subprocess_wrap(cmd, print_output=True, raise_non_zero_retcode=True)
+
+    return parse_fio_output(output)
+
+
+def parse_fio_output(output):
+
+    # fio in client mode may print non-JSON lines (e.g. "hostname: connected") before the JSON document
+    result = json.loads(output[output.index("{"):])
+
+    if len(result["client_stats"])==1:
+        stats = result["client_stats"][0]
+    else:
+        stats = result["client_stats"][-1]
+        assert stats["jobname"] == "All clients"
+
+    return {
+        # KiB/s, same as fio-test.py
+        "read_bw_mean": stats["read"]["bw"],
+        "write_bw_mean": stats["write"]["bw"],
+        "summary": result,
+        "raw_output": output,
+    }
+
+
+# -----
+# IOR
+
+def run_ior_cell(cell, hosts, workdir):
+
+    name = get_cell_name(cell)
+    options = cell["options"]
+
+    # IOR rank 0 writes the summary file on hosts[0], so it goes to the shared file system under the datadir
+    summary_filename = os.path.join(cell["datadir"], f"io-sweep-summary-{name}-{os.getpid()}.json")
+
+    cmd = [
+        "mpirun", "--oversubscribe", "-np", str(cell["num_processes"]),
+        "--host", ",".join(hosts),
+        "ior",
+        "-a", options.get("api", "POSIX"),
+        "-t", cell["transfer_size"],
+        "-b", cell["block_size"],
+        "-i", str(options.get("repetitions", 3)),
+        "-O", "summaryFormat=JSON",
+        "-O", f"summaryFile={summary_filename}",
+    ]
+    if options.get("direct", 0):
+        cmd += ["-O", "useO_DIRECT=1"]
+    cmd += list(options.get("args", []))
+    cmd += ["-o", cell["datadir"]]
+
+    output = run_subprocess_wrap(cmd, print_output=True, raise_non_zero_retcode=True)
+
+    if os.path.exists(summary_filename):
+        with open(summary_filename) as fd:
+            summary = parse_ior_json_summary(fd.read())
+        os.remove(summary_filename)
+    elif "Summary of all tests:" in output:
+        # Older IOR versions ignore summaryFormat and print the text summary to stdout
+        summary = parse_ior_text_summary(output)
+    else:
+        # IOR versions that ignore summaryFile print the JSON summary to stdout
+        summary = parse_ior_json_summary(output[output.index("{"):])
+
+    return {
+        # MiB/s, same as ior-test.py
+        "read_bw_mean": summary["read"]["bw_mean"] if "read" in summary else None,
+        "write_bw_mean": summary["write"]["bw_mean"] if "write" in summary else None,
+        "summary": summary,
+        "raw_output": output,
+    }
+
+
+def parse_ior_json_summary(text):
+    """Parse the document written with -O summaryFormat=JSON into {operation: stats}"""
+
+    d = json.loads(text)
+
+    summary = {}
+    for entry in d.get("summary", []):
+        summary[entry["operation"]] = {
+            "bw_max": entry["bwMaxMIB"],
+            "bw_min": entry["bwMinMIB"],
+            "bw_mean": entry["bwMeanMIB"],
+            "bw_std": entry["bwStdMIB"],
+            "ops_mean": entry.get("OPsMean"),
+            "time_mean": entry.get("MeanTime"),
+            "raw": entry,
+        }
+
+    if not summary:
+        raise ValueError("IOR JSON summary has no operations")
+
+    for operation, values in get_ior_json_iterations(d).items():
+        if operation in summary:
+            summary[operation]["bw_iterations"] = values
+
+    return summary
+
+
+def get_ior_json_iterations(d):
+    """Bandwidth of each iteration (-i N) from the "tests" section, as {operation: [MiB/s, ...]}"""
+
+    iterations = collections.defaultdict(list)
+
+    # Results is a list of iterations, each a list of one entry per access type
+    def walk(results):
+        for entry in results:
+            if isinstance(entry, list):
+                walk(entry)
+            elif "access" in entry and "bwMiB" in entry:
+                iterations[entry["access"]].append(entry["bwMiB"])
+
+    for test in d.get("tests", []):
+        walk(test.get("Results", []))
+
+    return iterations
+
+
+def get_ior_text_iterations(output):
+    """Bandwidth of each iteration (-i N) from the text "Results:" table, as {operation: [MiB/s, ...]}"""
+
+    iterations = collections.defaultdict(list)
+
+    in_results = False
+    for line in output.splitlines():
+        fields = line.split()
+        if fields[:2]==["access", "bw(MiB/s)"]:
+            in_results = True
+        elif line.strip()=="Summary of all tests:":
+            break
+        elif in_results and len(fields)>=2 and fields[0] in ("write", "read"):
+            try:
+                iterations[fields[0]].append(float(fields[1]))
+            except ValueError:
+                pass
+
+    return iterations
+
+
+# Column names in the text "Summary of all tests:" table, mapped to the keys used in the JSON summary
+_ior_text_columns = {
+    "Max(MiB)": "bw_max",
+    "Min(MiB)": "bw_min",
+    "Mean(MiB)": "bw_mean",
+    "Mean(OPs)": "ops_mean",
+    "Mean(s)": "time_mean",
+}
+
+
+def parse_ior_text_summary(output):
+    """Parse the text "Summary of all tests:" table into {operation: stats}
+
+    The table is parsed by its header row rather than by column position, so
+    the extra Stonewall columns in newer IOR versions don't shift the values.
+    """
+
+    lines = output.splitlines()
+    try:
+        start = next( i for i, line in enumerate(lines) if line.strip()=="Summary of all tests:" )
+    except StopIteration:
+        raise ValueError("IOR output has no 'Summary of all tests:' section")
+
+    header = lines[start+1].split()
+    if not header or header[0]!="Operation":
+        raise ValueError(f"Unexpected IOR summary header: {lines[start+1]!r}")
+
+    # "StdDev" appears twice (MiB and OPs), so name it after the preceding column
+    columns = []
+    for column in header:
+        if column=="StdDev":
+            column = "StdDev(OPs)" if "Max(OPs)" in columns else "StdDev(MiB)"
+        columns.append(column)
+
+    summary = {}
+    for line in lines[start+2:]:
+        # The table ends at the first line that doesn't have one field per column
+        fields = line.split()
+        if len(fields)!=len(columns):
+            break
+
+        row = dict(zip(columns, fields))
+        stats = { key: float(row[column]) for column, key in _ior_text_columns.items() if column in row }
+        stats["bw_std"] = float(row["StdDev(MiB)"])
+        stats["raw"] = row
+        summary[row["Operation"]] = stats
+
+    if not summary:
+        raise ValueError("IOR summary table is empty")
+
+    for operation, values in get_ior_text_iterations(output).items():
+        if operation in summary:
+            summary[operation]["bw_iterations"] = values
+
+    return summary
+
+
+# -----
+# Commands
+
+def load_nodes(args):
+    if args.nodes_file:
+        with open(args.nodes_file) as fd:
+            return [ line.strip() for line in fd if line.strip() and not line.startswith("#") ]
+    return [ node.strip() for node in args.nodes.split(",") if node.strip() ]
+
+
+def cmd_run(args):
+
+    if args.matrix:
+        with open(args.matrix) as fd:
+            matrix = json.load(fd)
+    else:
+        matrix = default_matrices[args.tool]
+
+    nodes = load_nodes(args)
+    cells = build_cells(args.tool, matrix)
+    store = ResultStore(args.db)
+
+    run_cell = run_fio_cell if args.tool=="fio" else run_ior_cell
+
+    num_skipped = 0
+    num_failed = 0
+
+    # Whole matrix per repeat, so slow drift of the file system spreads over all cells
+    runs = [ (repeat_index, cell) for repeat_index in range(args.repeats) for cell in cells ]
+
+    with tempfile.TemporaryDirectory(prefix="io-sweep-") as workdir:
+
+        for i, (repeat_index, cell) in enumerate(runs):
+
+            cell_hash = get_cell_hash(cell)
+            name = f"{get_cell_name(cell)} #{repeat_index}"
+            status = store.get_status(cell_hash, repeat_index)
+
+            if status=="complete" or (status=="failed" and not args.retry_failed):
+                print(f"[{i+1}/{len(runs)}] Skipping {name} ({cell_hash}) - {status}")
+                num_skipped += 1
+                continue
+
+            if cell["num_nodes"] > len(nodes):
+                print(f"[{i+1}/{len(runs)}] Skipping {name} - needs {cell['num_nodes']} nodes, {len(nodes)} available")
+                num_skipped += 1
+                continue
+
+            hosts = nodes[:cell["num_nodes"]]
+
+            print(f"[{i+1}/{len(runs)}] Running {name} ({cell_hash})")
+
+            if args.dry_run:
+                continue
+
+            store.mark_running(cell_hash, repeat_index, cell, hosts)
+
+            try:
+                result = run_cell(cell, hosts, workdir)
+            except (ChildProcessError, ValueError, KeyError) as e:
+                print(f"Test {name} failed: {e}")
+                store.mark_failed(cell_hash, repeat_index, str(e))
+                num_failed += 1
+                continue
+
+            store.mark_complete(cell_hash, repeat_index, result)
+
+            time.sleep(1)
+
+    print(f"Done. {len(runs)} runs, {num_skipped} skipped, {num_failed} failed")
+
+
+def cmd_status(args):
+
+    store = ResultStore(args.db)
+
+    for row in store.list_cells(args.tool):
+        print(f"{row['cell_hash']}  #{row['repeat_index']:<3} {row['status']:<8}  {row['name']:<40}  read={row['read_bw_mean']}  write={row['write_bw_mean']}")
+
+
+def get_iteration_samples(summary):
+    """(read, write) bandwidth of each IOR iteration, or [] when the summary has none (fio, or an IOR output without them)"""
+
+    def get_values(operation):
+        stats = summary.get(operation)
+        return stats.get("bw_iterations", []) if isinstance(stats, dict) else []
+
+    read_values = get_values("read")
+    write_values = get_values("write")
+
+    num_iterations = max(len(read_values), len(write_values))
+    return [
+        (read_values[i] if i < len(read_values) else None, write_values[i] if i < len(write_values) else None)
+        for i in range(num_iterations)
+    ]
+
+
+def cmd_export_csv(args):
+
+    store = ResultStore(args.db)
+    columns = csv_columns[args.tool]
+
+    with open(args.output, "w", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(columns)
+
+        for row in store.list_cells(args.tool):
+            if row["status"]!="complete":
+                continue
+            cell = json.loads(row["config"])
+
+            samples = [ (row["read_bw_mean"], row["write_bw_mean"]) ]
+            if args.per_iteration:
+                samples = get_iteration_samples(json.loads(row["summary"])) or samples
+
+            for read_bw, write_bw in samples:
+                cell["read_bw_mean"] = read_bw
+                cell["write_bw_mean"] = write_bw
+                csv_writer.writerow([ cell[column] for column in columns ])
+
+    print(f"Wrote {args.output}")
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Run fio / IOR test matrices with resume, and store results in SQLite")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run all incomplete cells of a test matrix")
+    run_parser.add_argument("--tool", action="store", choices=["fio", "ior"], required=True, help="Benchmark tool")
+    run_parser.add_argument("--db", action="store", default="sweep.db", help="SQLite result database")
+    run_parser.add_argument("--matrix", action="store", default=None, help="JSON file with the test matrix (defaults to the built-in matrix for the tool)")
+    nodes_group = run_parser.add_mutually_exclusive_group(required=True)
+    nodes_group.add_argument("--nodes-file", action="store", help="File with one hostname per line")
+    nodes_group.add_argument("--nodes", action="store", help="Comma separated hostnames")
+    run_parser.add_argument("--repeats", action="store", type=int, default=1, help="Number of times to run each cell. Each repeat is stored as a separate sample")
+    run_parser.add_argument("--retry-failed", action="store_true", help="Re-run cells that failed previously")
+    run_parser.add_argument("--dry-run", action="store_true", help="Only print which cells would run")
+    run_parser.set_defaults(func=cmd_run)
+
+    status_parser = subparsers.add_parser("status", help="List cells in the result database")
+    status_parser.add_argument("--db", action="store", default="sweep.db", help="SQLite result database")
+    status_parser.add_argument("--tool", action="store", choices=["fio", "ior"], default=None, help="Filter by tool")
+    status_parser.set_defaults(func=cmd_status)
+
+    export_parser = subparsers.add_parser("export-csv", help="Export complete cells in the fio-test.py / ior-test.py CSV format, one row per repeat")
+    export_parser.add_argument("--db", action="store", default="sweep.db", help="SQLite result database")
+    export_parser.add_argument("--tool", action="store", choices=["fio", "ior"], required=True, help="Benchmark tool")
+    export_parser.add_argument("--output", action="store", required=True, help="Output CSV filename")
+    export_parser.add_argument("--per-iteration", action="store_true", help="One row per IOR iteration (-i N) instead of the mean, as samples for compare-results.py")
+    export_parser.set_defaults(func=cmd_export_csv)
+
+    args = argparser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
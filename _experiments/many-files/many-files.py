@@ -1,139 +1,307 @@
+"""
+Metadata-heavy file system benchmark
+
+Creates, lists, stats, reads and deletes many small files, and reports ops/sec
+and per-operation latency percentiles for each phase.
+
+Examples:
+    # FSx for Lustre, 1M files, hashed sub-directories, 1024 threads
+    python3 many-files.py --dir /fsx2/many-files --num-files 1000000 --num-workers 1024 --layout hashed
+
+    # Local smoke test against tmpfs
+    python3 many-files.py --dir /dev/shm/many-files --num-files 10000 --num-workers 16
+"""
+
 import os
+import sys
+import json
 import time
 import glob
+import math
+import zlib
+import argparse
 import concurrent.futures
 
-if 0:
-    pool_executor = concurrent.futures.ThreadPoolExecutor
-else:
-    pool_executor = concurrent.futures.ProcessPoolExecutor
 
-if 0:
-    dir = "/fsx2/many-files"
-    src = "./dataset.json"
-    dst_pattern = "dataset_%08d.json"
-    dst_glob_pattern = "dataset_*.json"
-    num_dup = 1000 * 1000
-    num_workers = 1024
+ALL_PHASES = ["create", "list", "stat", "read", "delete"]
 
-if 1:
-    dir = "/mnt/weka/many-files"
-    src = "./dataset.json"
-    dst_pattern = "dataset_%08d.json"
-    dst_glob_pattern = "dataset_*.json"
-    num_dup = 1000 * 1000
-    num_workers = 1024
+dst_pattern = "dataset_%08d.json"
+dst_glob_pattern = "dataset_*.json"
 
 
+class Config:
+    dir = None
+    layout = "flat"
+    fanout = 256
+    list_method = "scandir"
 
-with open( os.path.join(src), "rb" ) as fd:
-    d = fd.read()
 
+# File content to write. Set in each worker process by init_worker().
+_content = None
 
-class TimeMeasure:
-    def __init__(self, name):
-        self.name = name
-        print(f"Starting {self.name}")
-        self.t0 = time.time()
 
-    def end(self):
-        self.t1 = time.time()
-        print(f"Ended {self.name}")
+def init_worker(content, config):
+    global _content
+    _content = content
+    Config.dir = config["dir"]
+    Config.layout = config["layout"]
+    Config.fanout = config["fanout"]
+    Config.list_method = config["list_method"]
 
-    def print_elapsed_time(self):
-        print(f"Elapsed time {self.name}: {self.t1 - self.t0}")
 
+def get_subdir(i):
+    if Config.layout=="flat":
+        return Config.dir
+    elif Config.layout=="hashed":
+        h = zlib.crc32((dst_pattern % i).encode("utf-8")) % Config.fanout
+        return os.path.join(Config.dir, f"{h:04x}")
+    else:
+        assert False, f"Unknown layout {Config.layout}"
+
+
+def get_all_subdirs():
+    if Config.layout=="flat":
+        return [Config.dir]
+    return [ os.path.join(Config.dir, f"{h:04x}") for h in range(Config.fanout) ]
 
-def trace(s):
-    #print(s)
-    pass
+
+def get_path(i):
+    return os.path.join(get_subdir(i), dst_pattern % i)
 
 
 # -----
+# Single operations. Each returns its latency in seconds, so they can run on
+# any of the executors (including processes).
 
-thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+def create_file(i):
+    dst = get_path(i)
+    t0 = time.perf_counter()
+    with open( dst, "wb" ) as fd:
+        fd.write(_content)
+    return time.perf_counter() - t0
 
-def warmup(i):
-    trace(f"Warming up {i}")
 
-for result in thread_pool.map(warmup, range(num_dup)):
-    pass
+def list_dir(dirname):
+    t0 = time.perf_counter()
+    if Config.list_method=="scandir":
+        with os.scandir(dirname) as it:
+            filenames = [ entry.path for entry in it if entry.name.startswith("dataset_") ]
+    elif Config.list_method=="glob":
+        filenames = glob.glob( os.path.join(dirname, dst_glob_pattern) )
+    else:
+        assert False, f"Unknown list method {Config.list_method}"
+    return time.perf_counter() - t0, filenames
 
 
-# -----
+def stat_file(filename):
+    t0 = time.perf_counter()
+    os.stat(filename)
+    return time.perf_counter() - t0
 
-t_create = TimeMeasure("Creating many files")
 
-def create_dst_file(i):
-    dst = os.path.join(dir, dst_pattern % i)
-    trace(f"Writing {dst}")
-    with open( dst, "wb" ) as fd:
-        fd.write(d)
+def read_file(filename):
+    t0 = time.perf_counter()
+    with open(filename, "rb") as fd:
+        fd.read()
+    return time.perf_counter() - t0
 
-for result in thread_pool.map(create_dst_file, range(num_dup)):
-    pass
 
-t_create.end()
+def delete_file(filename):
+    t0 = time.perf_counter()
+    os.unlink(filename)
+    return time.perf_counter() - t0
 
 
 # -----
 
-t_list = TimeMeasure("Listing all files")
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values)-1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
 
-filenames = glob.glob( os.path.join(dir, dst_glob_pattern))
 
-t_list.end()
+class PhaseResult:
 
+    def __init__(self, name, latencies, elapsed):
+        self.name = name
+        self.num_ops = len(latencies)
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
 
-# -----
+    def to_dict(self):
+        return {
+            "phase": self.name,
+            "ops": self.num_ops,
+            "elapsed_sec": self.elapsed,
+            "ops_per_sec": self.num_ops / self.elapsed if self.elapsed > 0 else 0.0,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p90_ms": percentile(self.latencies, 90) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "max_ms": (self.latencies[-1] if self.latencies else 0.0) * 1000,
+        }
 
-t_stat = TimeMeasure("Getting stats of all files")
 
-def get_stat(filename):
-    st = os.stat(filename)
-    trace(f"Timestamp of {filename}: {st.st_mtime}")
+class Benchmark:
 
-for result in thread_pool.map(get_stat, filenames):
-    pass
+    def __init__(self, args):
 
-t_stat.end()
+        self.args = args
 
+        Config.dir = args.dir
+        Config.layout = args.layout
+        Config.fanout = args.fanout
+        Config.list_method = args.list_method
 
-# -----
+        if args.src:
+            with open( args.src, "rb" ) as fd:
+                self.content = fd.read()
+        else:
+            self.content = os.urandom(args.file_size)
 
-t_read = TimeMeasure("Reading all files")
+        self.filenames = []
 
-def read_file(filename):
-    with open(filename) as fd:
-        d = fd.read()
-        trace(f"Length of {filename}: {len(d)}")
+    def _initargs(self):
+        config = {
+            "dir": Config.dir,
+            "layout": Config.layout,
+            "fanout": Config.fanout,
+            "list_method": Config.list_method,
+        }
+        return (self.content, config)
 
-for result in thread_pool.map(read_file, filenames):
-    pass
+    def __enter__(self):
 
-t_read.end()
+        if self.args.executor=="process":
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.args.num_workers, initializer=init_worker, initargs=self._initargs())
+        else:
+            init_worker(*self._initargs())
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.args.num_workers)
 
+        # Spin up all the workers before measuring anything
+        list(self.pool.map(_warmup, range(self.args.num_workers * 4)))
 
-# -----
+        return self
 
-t_delete = TimeMeasure("Deleting all files")
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.shutdown()
 
-def delete_file(i):
-    dst = os.path.join(dir, dst_pattern % i)
-    if os.path.exists(dst):
-        trace(f"Deleting {dst}")
-        os.unlink(dst)
+    def map(self, func, items):
 
-for result in thread_pool.map(delete_file, range(num_dup)):
-    pass
+        chunksize = 1
+        if self.args.executor=="process":
+            chunksize = max(1, len(items) // (self.args.num_workers * 16))
 
-t_delete.end()
+        return list(self.pool.map(func, items, chunksize=chunksize))
 
+    def run_phase(self, name, func, items):
+
+        print(f"Starting {name} ({len(items)} ops)")
+        t0 = time.perf_counter()
+        latencies = self.map(func, items)
+        elapsed = time.perf_counter() - t0
+        print(f"Ended {name}")
+
+        return PhaseResult(name, latencies, elapsed)
+
+    def run(self):
+
+        results = []
+        phases = self.args.phases
+
+        os.makedirs(Config.dir, exist_ok=True)
+        for subdir in get_all_subdirs():
+            os.makedirs(subdir, exist_ok=True)
+
+        if "create" in phases:
+            results.append( self.run_phase("create", create_file, list(range(self.args.num_files))) )
+
+        if "list" in phases or not self.filenames:
+            print(f"Starting list ({Config.list_method})")
+            t0 = time.perf_counter()
+            list_results = self.map(list_dir, get_all_subdirs())
+            elapsed = time.perf_counter() - t0
+            print("Ended list")
+
+            self.filenames = [ filename for _, filenames in list_results for filename in filenames ]
+            if "list" in phases:
+                # One op per listed file, so ops/sec is comparable across layouts
+                result = PhaseResult("list", [ latency for latency, _ in list_results ], elapsed)
+                result.num_ops = len(self.filenames)
+                results.append(result)
+
+        if "stat" in phases:
+            results.append( self.run_phase("stat", stat_file, self.filenames) )
+
+        if "read" in phases:
+            results.append( self.run_phase("read", read_file, self.filenames) )
+
+        if "delete" in phases:
+            results.append( self.run_phase("delete", delete_file, self.filenames) )
+            if Config.layout=="hashed":
+                for subdir in get_all_subdirs():
+                    os.rmdir(subdir)
+
+        return results
+
+
+def _warmup(i):
+    pass
 
-# -----
 
-t_create.print_elapsed_time()
-t_list.print_elapsed_time()
-t_stat.print_elapsed_time()
-t_read.print_elapsed_time()
-t_delete.print_elapsed_time()
+def print_results(results):
+
+    print()
+    print(f"{'phase':<8} {'ops':>10} {'elapsed[s]':>11} {'ops/sec':>12} {'p50[ms]':>9} {'p90[ms]':>9} {'p99[ms]':>9} {'max[ms]':>9}")
+    for result in results:
+        d = result.to_dict()
+        print(f"{d['phase']:<8} {d['ops']:>10} {d['elapsed_sec']:>11.3f} {d['ops_per_sec']:>12.1f} {d['p50_ms']:>9.3f} {d['p90_ms']:>9.3f} {d['p99_ms']:>9.3f} {d['max_ms']:>9.3f}")
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Metadata-heavy file system benchmark (create / list / stat / read / delete)")
+    argparser.add_argument("--dir", action="store", required=True, help="Directory to create files in")
+    argparser.add_argument("--num-files", action="store", type=int, default=10000, help="Number of files")
+    argparser.add_argument("--num-workers", action="store", type=int, default=64, help="Number of concurrent workers")
+    argparser.add_argument("--executor", action="store", choices=["thread", "process"], default="thread", help="How to run operations concurrently")
+    argparser.add_argument("--layout", action="store", choices=["flat", "hashed"], default="flat", help="Put all files in one directory, or spread them across hashed sub-directories")
+    argparser.add_argument("--fanout", action="store", type=int, default=256, help="Number of sub-directories for --layout hashed")
+    argparser.add_argument("--list-method", action="store", choices=["scandir", "glob"], default="scandir", help="How to list files")
+    argparser.add_argument("--src", action="store", default=None, help="File to use as content of each file. Random bytes of --file-size are used if not specified")
+    argparser.add_argument("--file-size", action="store", type=int, default=4096, help="Size of each file in bytes, when --src is not specified")
+    argparser.add_argument("--phases", action="store", default=",".join(ALL_PHASES), help=f"Comma separated phases to run ({','.join(ALL_PHASES)})")
+    argparser.add_argument("--output-json", action="store", default=None, help="Write results to a JSON file")
+    args = argparser.parse_args()
+
+    args.phases = [ phase.strip() for phase in args.phases.split(",") if phase.strip() ]
+    for phase in args.phases:
+        if phase not in ALL_PHASES:
+            argparser.error(f"Unknown phase {phase}")
+
+    with Benchmark(args) as benchmark:
+        results = benchmark.run()
+
+    print_results(results)
+
+    if args.output_json:
+        with open(args.output_json, "w") as fd:
+            d = {
+                "config": {
+                    "dir": args.dir,
+                    "num_files": args.num_files,
+                    "num_workers": args.num_workers,
+                    "executor": args.executor,
+                    "layout": args.layout,
+                    "fanout": args.fanout,
+                    "list_method": args.list_method,
+                    "file_size": len(benchmark.content),
+                },
+                "results": [ result.to_dict() for result in results ],
+            }
+            fd.write(json.dumps(d, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
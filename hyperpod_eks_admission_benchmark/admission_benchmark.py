@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency benchmark of admission webhooks.
+
+Sends AdmissionReview requests over TLS from a fixed number of concurrent
+connections (closed loop: each connection sends the next request as soon as the
+previous response arrives), and reports requests/sec with p50/p99/p99.9 latency.
+
+Payloads are synthetic Pod, Node and Deployment requests in CREATE, UPDATE and
+DELETE, padded to the given sizes, or recorded AdmissionReview JSON files.
+
+With --server, each server command is started, benchmarked and stopped in turn,
+and the results are printed side by side.
+
+Examples:
+    # Benchmark a running webhook
+    python3 admission_benchmark.py --url https://localhost:8443/mutate --concurrency 16
+
+    # Compare two servers
+    python3 admission_benchmark.py \\
+        --server dynamic-admission https://localhost:8443/validate "python3 ../hyperpod_eks_dynamic_admission/webhook.py" \\
+        --server auto-node-taints https://localhost:8443/mutate "python3 ../hyperpod_eks_auto_node_taints/webhook.py"
+"""
+import os
+import ssl
+import sys
+import copy
+import json
+import math
+import time
+import uuid
+import shlex
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlparse
+
+
+kinds = ["Pod", "Node", "Deployment"]
+operations = ["CREATE", "UPDATE", "DELETE"]
+
+uid_placeholder = "00000000-0000-0000-0000-000000000000"
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values)-1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def make_object(kind, index):
+    """Minimal object of a kind. Padding is added by pad_object()."""
+
+    if kind == "Pod":
+        return {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {
+                "name": f"training-job-worker-{index}",
+                "namespace": "default",
+                "labels": {"app": "training-job", "dynamic-admission-owner": "user1"},
+            },
+            "spec": {
+                "containers": [
+                    {"name": "worker", "image": "public.ecr.aws/docker/library/python:3", "command": ["python3", "train.py"], "env": []},
+                ],
+            },
+        }
+
+    if kind == "Node":
+        return {
+            "apiVersion": "v1",
+            "kind": "Node",
+            "metadata": {
+                "name": f"hyperpod-i-{index:017x}",
+                "labels": {"node.kubernetes.io/instance-type": "ml.p5.48xlarge", "sagemaker.amazonaws.com/node-health-status": "Schedulable"},
+            },
+            "spec": {"providerID": f"aws:///us-west-2a/i-{index:017x}"},
+            "status": {"images": []},
+        }
+
+    if kind == "Deployment":
+        return {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {
+                "name": f"inference-server-{index}",
+                "namespace": "default",
+                "labels": {"app": "inference-server", "dynamic-admission-owner": "user1"},
+            },
+            "spec": {
+                "replicas": 2,
+                "selector": {"matchLabels": {"app": "inference-server"}},
+                "template": {
+                    "metadata": {"labels": {"app": "inference-server"}},
+                    "spec": {
+                        "containers": [
+                            {"name": "server", "image": "public.ecr.aws/docker/library/python:3", "env": []},
+                        ],
+                    },
+                },
+            },
+        }
+
+    raise ValueError(f"Unknown kind: {kind}")
+
+
+def pad_object(obj, size):
+    """Grow the object like real large objects grow: env vars for Pods / Deployments, image lists for Nodes."""
+
+    if obj["kind"] == "Node":
+        items = obj["status"]["images"]
+        make_item = lambda i: {"names": [f"registry.example.com/images/image-{i}@sha256:{i:064x}"], "sizeBytes": 1000000 + i}
+    elif obj["kind"] == "Pod":
+        items = obj["spec"]["containers"][0]["env"]
+        make_item = lambda i: {"name": f"TRAINING_ENV_{i}", "value": "x" * 64}
+    else:
+        items = obj["spec"]["template"]["spec"]["containers"][0]["env"]
+        make_item = lambda i: {"name": f"SERVER_ENV_{i}", "value": "x" * 64}
+
+    current_size = len(json.dumps(obj))
+    i = 0
+    while current_size < size:
+        item = make_item(i)
+        items.append(item)
+        current_size += len(json.dumps(item)) + 2
+        i += 1
+
+
+def make_admission_review(kind, operation, size, index):
+    """AdmissionReview of about size bytes, as the API server sends it. UPDATE carries both objects, DELETE only the old one."""
+
+    obj = make_object(kind, index)
+    group, _, version = obj["apiVersion"].rpartition("/")
+    resource = kind.lower() + "s"
+
+    num_objects = 2 if operation == "UPDATE" else 1
+    pad_object(obj, max(0, size - 1024) // num_objects)
+
+    request = {
+        "uid": uid_placeholder,
+        "kind": {"group": group, "version": version, "kind": kind},
+        "resource": {"group": group, "version": version, "resource": resource},
+        "requestKind": {"group": group, "version": version, "kind": kind},
+        "requestResource": {"group": group, "version": version, "resource": resource},
+        "name": obj["metadata"]["name"],
+        "operation": operation,
+        "userInfo": {
+            "username": "user2",
+            "uid": "aws-iam-authenticator:123456789012:AROAEXAMPLE",
+            "groups": ["eks-users", "system:authenticated"],
+        },
+        "object": None if operation == "DELETE" else obj,
+        "oldObject": copy.deepcopy(obj) if operation in ("UPDATE", "DELETE") else None,
+        "dryRun": False,
+        "options": {"kind": f"{operation.capitalize()}Options", "apiVersion": "meta.k8s.io/v1"},
+    }
+    if "namespace" in obj["metadata"]:
+        request["namespace"] = obj["metadata"]["namespace"]
+
+    return {"kind": "AdmissionReview", "apiVersion": "admission.k8s.io/v1", "request": request}
+
+
+class Payload:
+    """A pre-serialized request body. Only the UID is replaced per request."""
+
+    def __init__(self, label, admission_review):
+        admission_review = copy.deepcopy(admission_review)
+        admission_review["request"]["uid"] = uid_placeholder
+        self.label = label
+        self.prefix, self.suffix = json.dumps(admission_review).encode().split(uid_placeholder.encode())
+        self.size = len(self.prefix) + len(uid_placeholder) + len(self.suffix)
+
+    def make_body(self):
+        return self.prefix + str(uuid.uuid4()).encode() + self.suffix
+
+
+def make_payloads(args):
+
+    if args.payload:
+        payloads = []
+        for filename in args.payload:
+            with open(filename) as f:
+                admission_review = json.load(f)
+            payloads.append(Payload(os.path.basename(filename), admission_review))
+        return payloads
+
+    payloads = []
+    for kind in args.kinds.split(","):
+        for operation in args.operations.split(","):
+            for size_kb in args.sizes_kb.split(","):
+                label = f"{kind} {operation} {size_kb}KB"
+                payloads.append(Payload(label, make_admission_review(kind, operation, int(size_kb) * 1024, len(payloads))))
+    return payloads
+
+
+class Worker(threading.Thread):
+    """One connection, kept alive while the server allows it"""
+
+    def __init__(self, url, ssl_context, timeout, payloads, offset, stop_event, measure_event):
+        super().__init__(daemon=True)
+        self.url = url
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.payloads = payloads
+        self.offset = offset
+        self.stop_event = stop_event
+        self.measure_event = measure_event
+        self.connection = None
+        self.results = []
+        self.num_errors = 0
+        self.num_connections = 0
+
+    def run(self):
+
+        i = self.offset
+        while not self.stop_event.is_set():
+
+            payload = self.payloads[i % len(self.payloads)]
+            i += 1
+            body = payload.make_body()
+
+            if self.connection is None:
+                self.connection = http.client.HTTPSConnection(self.url.hostname, self.url.port or 443, context=self.ssl_context, timeout=self.timeout)
+
+            t0 = time.perf_counter()
+            try:
+                # http.client reconnects when the server closed the connection after the previous response
+                if self.connection.sock is None:
+                    self.connection.connect()
+                    new_connection = True
+                else:
+                    new_connection = False
+                self.connection.request("POST", self.url.path, body=body, headers={"Content-Type": "application/json"})
+                response = self.connection.getresponse()
+                response_body = response.read()
+                if response.will_close:
+                    self.connection.close()
+                ok = response.status == 200 and "response" in json.loads(response_body)
+            except (OSError, http.client.HTTPException, ValueError):
+                ok = False
+                new_connection = False
+                self.connection.close()
+                self.connection = None
+            latency = time.perf_counter() - t0
+
+            if self.measure_event.is_set():
+                self.num_connections += new_connection
+                if ok:
+                    self.results.append((payload.label, latency))
+                else:
+                    self.num_errors += 1
+
+        if self.connection:
+            self.connection.close()
+
+
+def run_benchmark(args, url, payloads):
+    """Run the closed-loop benchmark against a URL, and return the results."""
+
+    url = urlparse(url)
+
+    if args.insecure:
+        ssl_context = ssl._create_unverified_context()
+    else:
+        ssl_context = ssl.create_default_context(cafile=args.ca_file)
+
+    stop_event = threading.Event()
+    measure_event = threading.Event()
+
+    workers = [ Worker(url, ssl_context, args.timeout, payloads, i, stop_event, measure_event) for i in range(args.concurrency) ]
+    for worker in workers:
+        worker.start()
+
+    # Requests during the warmup (TLS handshakes, server thread startup) are not measured
+    time.sleep(args.warmup)
+    measure_event.set()
+    t0 = time.perf_counter()
+    time.sleep(args.duration)
+    measure_event.clear()
+    elapsed = time.perf_counter() - t0
+
+    stop_event.set()
+    for worker in workers:
+        worker.join(args.timeout + 1)
+
+    results = [ result for worker in workers for result in worker.results ]
+    latencies = sorted( latency for _, latency in results )
+
+    by_label = {}
+    for label, latency in results:
+        by_label.setdefault(label, []).append(latency)
+
+    return {
+        "elapsed": elapsed,
+        "num_requests": len(results),
+        "num_errors": sum( worker.num_errors for worker in workers ),
+        "num_connections": sum( worker.num_connections for worker in workers ),
+        "latencies": latencies,
+        "by_label": { label: sorted(values) for label, values in by_label.items() },
+    }
+
+
+def format_latencies(values):
+    return f"p50={percentile(values, 50)*1000:8.2f} ms  p99={percentile(values, 99)*1000:8.2f} ms  p99.9={percentile(values, 99.9)*1000:8.2f} ms"
+
+
+def print_result(name, result, payloads, breakdown):
+
+    rps = result["num_requests"] / result["elapsed"]
+    print(f"{name}: {rps:,.0f} requests/sec, {result['num_requests']} requests, {result['num_errors']} errors, {result['num_connections']} new connections")
+    print(f"  {'all':<28} {format_latencies(result['latencies'])}")
+
+    if breakdown:
+        for payload in payloads:
+            values = result["by_label"].get(payload.label, [])
+            print(f"  {payload.label:<28} {format_latencies(values)}  n={len(values)}")
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(command, url, log_file):
+    url = urlparse(url)
+    process = subprocess.Popen(shlex.split(command), stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+    if not wait_for_port(url.hostname, url.port or 443, timeout=15):
+        stop_server(process)
+        raise RuntimeError(f"Server didn't start listening on {url.hostname}:{url.port}: {command}")
+    return process
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Throughput and latency benchmark of admission webhooks")
+    argparser.add_argument('--url', action="store", default="https://localhost:8443/mutate", help='Webhook URL, when benchmarking a running server')
+    argparser.add_argument('--server', action="append", nargs=3, metavar=("NAME", "URL", "COMMAND"), default=[], help='Start a server with COMMAND, benchmark it at URL, and stop it. Repeated to compare servers')
+    argparser.add_argument('--concurrency', action="store", type=int, default=16, help='Number of concurrent connections')
+    argparser.add_argument('--duration', action="store", type=float, default=10, help='Measured duration in seconds')
+    argparser.add_argument('--warmup', action="store", type=float, default=2, help='Unmeasured warmup in seconds')
+    argparser.add_argument('--kinds', action="store", default=",".join(kinds), help='Comma separated kinds of synthetic payloads')
+    argparser.add_argument('--operations', action="store", default=",".join(operations), help='Comma separated operations of synthetic payloads')
+    argparser.add_argument('--sizes-kb', action="store", default="1,10,50,200", help='Comma separated sizes of synthetic payloads in KB')
+    argparser.add_argument('--payload', action="append", default=[], help='Recorded AdmissionReview JSON files to replay instead of synthetic payloads, repeated')
+    argparser.add_argument('--breakdown', action="store_true", help='Also print latency per payload')
+    argparser.add_argument('--ca-file', action="store", default="certs/tls.crt", help='CA certificate to verify the server with')
+    argparser.add_argument('--insecure', action="store_true", help='Don\'t verify the server certificate')
+    argparser.add_argument('--timeout', action="store", type=float, default=10, help='Request timeout in seconds (the API server default for webhooks is 10)')
+    argparser.add_argument('--server-log', action="store", default="admission_benchmark_server.log", help='Output of the servers started with --server')
+    args = argparser.parse_args()
+
+    payloads = make_payloads(args)
+    sizes = sorted( payload.size for payload in payloads )
+    print(f"{len(payloads)} payloads, {sizes[0]/1024:.1f} KB to {sizes[-1]/1024:.1f} KB. {args.concurrency} connections, {args.warmup:.0f} + {args.duration:.0f} sec per server", flush=True)
+
+    if not args.server:
+        result = run_benchmark(args, args.url, payloads)
+        print_result(args.url, result, payloads, args.breakdown)
+        return
+
+    results = []
+    with open(args.server_log, "w") as log_file:
+        for name, url, command in args.server:
+            print(f"Starting {name}: {command}", flush=True)
+            process = start_server(command, url, log_file)
+            try:
+                result = run_benchmark(args, url, payloads)
+            finally:
+                stop_server(process)
+            results.append((name, result))
+            print_result(name, result, payloads, args.breakdown)
+            print("", flush=True)
+
+    print(f"{'Server':<24} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} {'errors':>7} {'conns':>7}")
+    for name, result in results:
+        latencies = result["latencies"]
+        print(f"{name:<24} {result['num_requests']/result['elapsed']:>10,.0f} {percentile(latencies, 50)*1000:>9.2f} {percentile(latencies, 99)*1000:>9.2f} "
+              f"{percentile(latencies, 99.9)*1000:>9.2f} {result['num_errors']:>7} {result['num_connections']:>7}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Filtering of Kubernetes audit log messages, with cheap substring checks before any JSON parsing.
+"""
+import json
+import fnmatch
+
+
+_json_decoder = json.JSONDecoder()
+
+known_verbs = {'update', 'patch', 'watch', 'list', 'create', 'delete', 'get', 'post'}
+
+
+def get_json_string_field(message, key):
+    """Return the string value of the first '"key":"value"' in the message, without JSON parsing."""
+
+    needle = f'"{key}":"'
+    i = message.find(needle)
+    if i < 0:
+        return None
+    i += len(needle)
+    j = message.find('"', i)
+    if j < 0:
+        return None
+    return message[i:j]
+
+
+def get_json_value_field(message, key):
+    """Decode only the value of the first '"key":' in the message. Returns None if not found or truncated."""
+
+    needle = f'"{key}":'
+    i = message.find(needle)
+    if i < 0:
+        return None
+    try:
+        value, _ = _json_decoder.raw_decode(message, i + len(needle))
+    except json.decoder.JSONDecodeError:
+        return None
+    return value
+
+
+# Shorthands for --field
+field_paths = {
+    "labels": "metadata.labels",
+    "annotations": "metadata.annotations",
+    "taints": "spec.taints",
+}
+
+
+def get_path_value(request_object, path):
+    """Return the value at a dotted path of a request object, or the matching operations of a JSON patch."""
+
+    if isinstance(request_object, list):
+        # application/json-patch+json : [{"op": "add", "path": "/metadata/labels/foo", "value": "bar"}, ...]
+        prefix = "/" + path.replace(".", "/")
+        ops = [ op for op in request_object if isinstance(op, dict) and str(op.get("path", "")).startswith(prefix) ]
+        return ops or None
+
+    value = request_object
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def is_pattern(s):
+    return s is not None and any( c in s for c in "*?[" )
+
+
+class AuditFilter:
+    """Matches audit log messages by object, verb, user and the fields the request changes."""
+
+    def __init__(self, resource=None, name=None, namespace=None, verbs=None, user=None, field=None):
+        self.resource = resource
+        self.name = name
+        self.namespace = namespace
+        self.verbs = set(verbs) if verbs else None
+        self.user = user
+        self.field = field
+        self.field_path = field_paths.get(field, field) if field else None
+
+        # Substrings that must appear in objectRef, checked before decoding it
+        self.object_ref_needles = []
+        if resource:
+            self.object_ref_needles.append(f'"resource":"{resource}"')
+        if name and not is_pattern(name):
+            self.object_ref_needles.append(f'"name":"{name}"')
+        if namespace:
+            self.object_ref_needles.append(f'"namespace":"{namespace}"')
+
+        self.check_object_ref = bool(resource or name or namespace)
+
+    def match(self, message):
+        """Return (audit_event, field_value) if the message matches, otherwise None."""
+
+        if self.check_object_ref:
+            # objectRef is near the head of the message and has no nested objects
+            i = message.find('"objectRef":')
+            if i < 0:
+                return None
+            j = message.find('}', i)
+            for needle in self.object_ref_needles:
+                if message.find(needle, i, j) < 0:
+                    return None
+
+        # verb and user come before objectRef and requestObject, the first occurrences are the top-level ones
+        if self.verbs is not None and get_json_string_field(message, "verb") not in self.verbs:
+            return None
+
+        if self.user is not None:
+            username = get_json_string_field(message, "username")
+            if username is None or not fnmatch.fnmatchcase(username, self.user):
+                return None
+
+        if self.check_object_ref:
+            object_ref = get_json_value_field(message, "objectRef")
+            if not isinstance(object_ref, dict):
+                return None
+            if self.resource and object_ref.get("resource") != self.resource:
+                return None
+            if self.name and not fnmatch.fnmatchcase(object_ref.get("name", ""), self.name):
+                return None
+            if self.namespace and object_ref.get("namespace") != self.namespace:
+                return None
+
+        field_value = None
+        if self.field_path:
+            field_value = get_path_value(get_json_value_field(message, "requestObject"), self.field_path)
+            if field_value is None:
+                return None
+
+        # Parse the entire message only for matched events
+        try:
+            audit_event = json.loads(message)
+        except json.decoder.JSONDecodeError:
+            return None
+
+        if not isinstance(audit_event, dict) or audit_event.get("kind") != "Event":
+            return None
+
+        return audit_event, field_value
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the audit event filter of dump_node_label_events.py on a synthetic audit log corpus.
+
+Compares the regex + full json.loads filter (before) with the substring prefilter +
+partial JSON decode (after), checks that both detect the same events, and reports
+events per second.
+"""
+import re
+import json
+import time
+import random
+import argparse
+
+import dump_node_label_events
+
+
+def legacy_parse_label_update(message):
+    """The regex + full json.loads version of parse_label_update, as a baseline."""
+
+    object_name = dump_node_label_events.object_name
+
+    re_result = re.search(r'"objectRef":(\{[^}]+\})', message)
+    if re_result:
+        object_ref = json.loads(re_result.group(1))
+        if "name" not in object_ref or object_ref["name"] != object_name:
+            return None
+    else:
+        return None
+
+    try:
+        audit_event = json.loads(message)
+    except json.decoder.JSONDecodeError as e:
+        return None
+
+    if not isinstance(audit_event, dict) or "kind" not in audit_event or audit_event["kind"] != "Event":
+        return None
+
+    verb = audit_event.get("verb")
+    if verb not in {'update', 'patch'}:
+        return None
+
+    labels_updated = False
+    if "requestObject" in audit_event:
+        if "metadata" in audit_event["requestObject"]:
+            if "labels" in audit_event["requestObject"]["metadata"]:
+                labels_updated = True
+
+    if labels_updated:
+        return audit_event
+    return None
+
+
+def make_audit_event(rng, verb, resource, name, request_object=None, response_size=0):
+    audit_event = {
+        "kind": "Event",
+        "apiVersion": "audit.k8s.io/v1",
+        "level": "RequestResponse",
+        "auditID": "%032x" % rng.getrandbits(128),
+        "stage": "ResponseComplete",
+        "requestURI": f"/api/v1/{resource}/{name}",
+        "verb": verb,
+        "user": {"username": "system:node:" + name, "groups": ["system:nodes", "system:authenticated"]},
+        "sourceIPs": ["10.1.2.3"],
+        "userAgent": "kubelet/v1.31.0 (linux/amd64) kubernetes/abcdef",
+        "objectRef": {"resource": resource, "name": name, "apiVersion": "v1"},
+        "responseStatus": {"metadata": {}, "code": 200},
+    }
+    if request_object is not None:
+        audit_event["requestObject"] = request_object
+    if response_size:
+        # Node status responses carry large image lists
+        audit_event["responseObject"] = {
+            "kind": "Node",
+            "metadata": {"name": name, "labels": {"kubernetes.io/hostname": name}},
+            "status": {"images": [ {"names": ["registry.example.com/image-%d@sha256:%064x" % (i, rng.getrandbits(256))], "sizeBytes": rng.randint(10**6, 10**10)} for i in range(response_size // 150) ]},
+        }
+    return json.dumps(audit_event, separators=(",", ":"))
+
+
+def make_corpus(num_events, seed):
+    """Mix of reads, lease renewals, node status patches and a few label patches, like a busy EKS cluster."""
+
+    rng = random.Random(seed)
+    target = dump_node_label_events.object_name
+    nodes = [ f"hyperpod-i-{rng.getrandbits(68):017x}" for _ in range(63) ] + [target]
+
+    messages = []
+    for _ in range(num_events):
+        node = rng.choice(nodes)
+        r = rng.random()
+        if r < 0.45:
+            messages.append(make_audit_event(rng, rng.choice(["get", "list", "watch"]), "nodes", node))
+        elif r < 0.75:
+            messages.append(make_audit_event(rng, "update", "leases", node, {"kind": "Lease", "metadata": {"name": node}, "spec": {"holderIdentity": node}}))
+        elif r < 0.97:
+            messages.append(make_audit_event(rng, "patch", "nodes", node, {"status": {"conditions": [{"type": "Ready", "status": "True"}]}}, response_size=rng.randint(2, 200) * 1024))
+        else:
+            messages.append(make_audit_event(rng, "patch", "nodes", node, {"metadata": {"labels": {"sagemaker.amazonaws.com/node-health-status": rng.choice(["Schedulable", "Unschedulable"])}}}, response_size=20 * 1024))
+    return messages
+
+
+def measure(func, messages, iterations):
+    best = None
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        detected = [ m for m in messages if func(m) ]
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, detected
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the audit event filter of dump_node_label_events.py")
+    argparser.add_argument('--num-events', action="store", type=int, default=20000, help='Number of synthetic audit events')
+    argparser.add_argument('--iterations', action="store", type=int, default=3, help='Number of runs, the best is reported')
+    argparser.add_argument('--seed', action="store", type=int, default=0, help='Random seed of the corpus')
+    args = argparser.parse_args()
+
+    messages = make_corpus(args.num_events, args.seed)
+    total_mb = sum(len(m) for m in messages) / 1024 / 1024
+    print(f"Corpus: {len(messages)} events, {total_mb:.1f} MB")
+
+    elapsed_before, detected_before = measure(legacy_parse_label_update, messages, args.iterations)
+    elapsed_after, detected_after = measure(dump_node_label_events.parse_label_update, messages, args.iterations)
+
+    assert detected_before == detected_after, "Filters detected different events"
+    print(f"Detected: {len(detected_after)} label updates of {dump_node_label_events.object_name}")
+
+    for name, elapsed in [("regex + json.loads (before)", elapsed_before), ("prefilter + partial decode (after)", elapsed_after)]:
+        print(f"{name:<40} {len(messages)/elapsed:12,.0f} events/s  {total_mb/elapsed:8.1f} MB/s")
+    print(f"Speedup: {elapsed_before/elapsed_after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
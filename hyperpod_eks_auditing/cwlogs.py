@@ -0,0 +1,213 @@
+"""
+CloudWatch Logs helpers shared by the audit log tools.
+"""
+import re
+import sys
+import time
+import fnmatch
+import datetime
+import threading
+
+import boto3
+import botocore.config
+
+# Largest page sizes of the CloudWatch Logs APIs
+describe_log_streams_page_size = 50
+get_log_events_page_size = 10000
+insights_max_results = 10000
+
+# Enough for the thread pools of the tools, connections are created on demand
+max_pool_connections = 64
+
+_logs_client = None
+_logs_client_lock = threading.Lock()
+
+
+def datetime_to_timestamp_ms(dt):
+    if dt:
+        return int(datetime.datetime.strptime(dt, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    else:
+        return None
+
+
+def get_logs_client(region_name):
+    # boto3 clients are thread-safe, share one client and its connection pool across workers
+    global _logs_client
+    with _logs_client_lock:
+        if _logs_client is None:
+            config = botocore.config.Config(
+                max_pool_connections = max_pool_connections,
+                retries = {"mode": "adaptive", "max_attempts": 10},
+            )
+            _logs_client = boto3.client("logs", region_name=region_name, config=config)
+        return _logs_client
+
+
+class CwLogsGroup:
+
+    def __init__(self, region_name, log_group_name):
+        self.region_name = region_name
+        self.log_group_name = log_group_name
+
+    def list_streams_all(self, pattern="*", start_datetime=None, end_datetime=None):
+
+        start_timestamp = datetime_to_timestamp_ms(start_datetime)
+        end_timestamp = datetime_to_timestamp_ms(end_datetime)
+
+        logs_client = get_logs_client(self.region_name)
+
+        # Let the server filter by the literal part of the pattern
+        prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+        streams = []
+        next_token = None
+        while True:
+
+            params = {
+                "logGroupName" : self.log_group_name,
+                "limit" : describe_log_streams_page_size,
+            }
+
+            if prefix:
+                params["logStreamNamePrefix"] = prefix
+
+            if next_token:
+                params["nextToken"] = next_token
+
+            try:
+                response = logs_client.describe_log_streams(**params)
+            except logs_client.exceptions.ResourceNotFoundException as e:
+                print( f"Log group [{self.log_group_name}] not found" )
+                sys.exit(1)
+            
+            for stream in response["logStreams"]:
+                if not fnmatch.fnmatch(stream["logStreamName"], pattern):
+                    continue
+
+                if end_timestamp and stream["firstEventTimestamp"] > end_timestamp:
+                    continue
+
+                if start_timestamp and stream["lastEventTimestamp"] < start_timestamp:
+                    continue
+
+                streams.append(stream)
+
+            if "nextToken" in response and response["nextToken"]:
+                next_token = response["nextToken"]
+                continue
+            
+            break
+
+        return streams        
+
+
+class CwLogsStream:
+
+    def __init__(self, region_name, log_group_name, log_stream_name):
+        self.region_name = region_name
+        self.log_group_name = log_group_name
+        self.log_stream_name = log_stream_name
+
+    def iter_events_all(self, start_datetime=None, end_datetime=None):
+        yield from self.iter_events_range(datetime_to_timestamp_ms(start_datetime), datetime_to_timestamp_ms(end_datetime))
+
+    def iter_events_range(self, start_timestamp=None, end_timestamp=None):
+        """Yield events in [start_timestamp, end_timestamp) in milliseconds."""
+
+        logs_client = get_logs_client(self.region_name)
+
+        next_token = None
+        while True:
+
+            params = {
+                "logGroupName" : self.log_group_name,
+                "logStreamName" : self.log_stream_name,
+                "startFromHead" : True,
+                "limit" : get_log_events_page_size,
+            }
+
+            if start_timestamp:
+                params["startTime"] = start_timestamp
+
+            if end_timestamp:
+                params["endTime"] = end_timestamp
+
+            if next_token:
+                params["nextToken"] = next_token
+                params.pop("startTime", None)
+
+            # print("Calling get_log_events:", params)
+
+            try:
+                response = logs_client.get_log_events( **params )
+            except logs_client.exceptions.ResourceNotFoundException as e:
+                print( "Log group or stream not found [ %s, %s ]" % (self.log_group_name, self.log_stream_name) )
+                sys.exit(1)
+
+            # print("Num events:", len(response["events"]))
+
+            # if len(response["events"]):
+            #     print("Timestamp:", response["events"][0]["timestamp"])
+
+            for event in response["events"]:
+                yield event
+
+            assert "nextForwardToken" in response, "nextForwardToken not found"
+
+            if response["nextForwardToken"] != next_token:
+                next_token = response["nextForwardToken"]
+            else:
+                break
+
+
+class CwLogsInsightsQuery:
+
+    def __init__(self, region_name, log_group_name):
+        self.region_name = region_name
+        self.log_group_name = log_group_name
+
+    def iter_results_all(self, query_string, start_datetime, end_datetime):
+        """Run a Logs Insights query, and yield results as {field: value} dicts.
+
+        A query returns at most 10000 results, so the time range is split in halves until each part fits.
+        """
+
+        logs_client = get_logs_client(self.region_name)
+
+        ranges = [ (datetime_to_timestamp_ms(start_datetime) // 1000, datetime_to_timestamp_ms(end_datetime) // 1000) ]
+        while ranges:
+
+            start_time, end_time = ranges.pop(0)
+
+            response = logs_client.start_query(
+                logGroupName = self.log_group_name,
+                startTime = start_time,
+                endTime = end_time,
+                queryString = query_string,
+                limit = insights_max_results,
+            )
+            query_id = response["queryId"]
+
+            delay = 0.5
+            while True:
+                response = logs_client.get_query_results(queryId=query_id)
+                if response["status"] not in {"Scheduled", "Running"}:
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+            if response["status"] != "Complete":
+                print( f"Logs Insights query {query_id} ended with status {response['status']}" )
+                sys.exit(1)
+
+            results = response["results"]
+            if len(results) >= insights_max_results and end_time > start_time:
+                # Both ends of a range are inclusive, so the halves must not share the middle second
+                middle = (start_time + end_time) // 2
+                ranges[:0] = [ (start_time, middle), (middle + 1, end_time) ]
+                continue
+
+            print( f"Logs Insights query returned {len(results)} events, {response['statistics']['bytesScanned']/1024/1024:.1f} MB scanned" )
+
+            for result in results:
+                yield { field["field"]: field["value"] for field in result }
@@ -1,11 +1,10 @@
 
-import sys
 import json
-import fnmatch
-import re
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import boto3
+from cwlogs import CwLogsGroup, CwLogsStream, CwLogsInsightsQuery
+from audit_filter import known_verbs, get_json_string_field, get_json_value_field
 
 region_name = "us-west-2"
 eks_cluster_name = "sagemaker-hyperpod-eks-cluster"
@@ -13,207 +12,152 @@ log_group_name = f"/aws/eks/{eks_cluster_name}/cluster"
 start_datetime = "2025-05-06T18:00:00Z" # in UTC
 end_datetime = "2025-05-06T23:10:00Z" # in UTC
 object_name = "hyperpod-i-0fdb3d806306ede29"
+num_workers = 16 # number of log streams scanned concurrently
+use_logs_insights = False # filter on server side with a CloudWatch Logs Insights query, instead of downloading all events
 
 
-def datetime_to_timestamp_ms(dt):
-    if dt:
-        return int(datetime.datetime.strptime(dt, "%Y-%m-%dT%H:%M:%SZ").timestamp() * 1000)
-    else:
-        return None
-
-
-class CwLogsGroup:
-
-    def __init__(self, region_name, log_group_name):
-        self.region_name = region_name
-        self.log_group_name = log_group_name
+def print_audit_event(audit_event):
 
-    def list_streams_all(self, pattern="*", start_datetime=None, end_datetime=None):
+    print("")
+    print(json.dumps(audit_event, indent=2))
+    print("")
+    print("---")
 
-        start_timestamp = datetime_to_timestamp_ms(start_datetime)
-        end_timestamp = datetime_to_timestamp_ms(end_datetime)
 
-        logs_client = boto3.client("logs", region_name=self.region_name)
+def parse_label_update(message):
+    """Return the audit event if the message is a label update of the object, otherwise None."""
 
-        streams = []
-        next_token = None
-        while True:
+    # Cheap substring checks first. Most messages are about other objects, or are reads.
+    # objectRef is near the head of the message and has no nested objects, so only that
+    # part is searched. Audit log messages are compact JSON, so the name appears as is.
+    i = message.find('"objectRef":')
+    if i < 0:
+        return None
+    j = message.find('}', i)
+    if message.find(f'"name":"{object_name}"', i, j) < 0:
+        return None
 
-            params = {
-                "logGroupName" : self.log_group_name,
-                "limit" : 5,
-            }
+    # verb comes before objectRef and requestObject in audit events, the first occurrence is the top-level one
+    verb = get_json_string_field(message, "verb")
 
-            if next_token:
-                params["nextToken"] = next_token
+    # process only update and patch operations
+    if verb in {'update', 'patch'}:
+        pass
+    elif verb in known_verbs:
+        return None
+    else:
+        # Parse the whole event only to report the unexpected verb
+        try:
+            audit_event = json.loads(message)
+        except json.decoder.JSONDecodeError as e:
+            print(e, ":", message)
+            return None
+        if isinstance(audit_event, dict) and audit_event.get("kind") == "Event":
+            print_audit_event(audit_event)
+            assert False, f"Unknown verb {audit_event.get('verb')}"
+        return None
 
-            try:
-                response = logs_client.describe_log_streams(**params)
-            except logs_client.exceptions.ResourceNotFoundException as e:
-                print( f"Log group [{self.log_group_name}] not found" )
-                sys.exit(1)
-            
-            for stream in response["logStreams"]:
-                if not fnmatch.fnmatch(stream["logStreamName"], pattern):
-                    continue
+    # Decode only the small objectRef and requestObject, instead of the entire message which can be up to 256KB
+    object_ref = get_json_value_field(message, "objectRef")
+    if not isinstance(object_ref, dict) or object_ref.get("name") != object_name:
+        return None
 
-                if end_timestamp and stream["firstEventTimestamp"] > end_timestamp:
-                    continue
+    request_object = get_json_value_field(message, "requestObject")
+    if not isinstance(request_object, dict) or not isinstance(request_object.get("metadata"), dict) or "labels" not in request_object["metadata"]:
+        return None
 
-                if start_timestamp and stream["lastEventTimestamp"] < start_timestamp:
-                    continue
+    # Parse the entire message only for detected events, to print them
+    try:
+        audit_event = json.loads(message)
+    except json.decoder.JSONDecodeError as e:
+        print(e, ":", message)
+        return None
 
-                streams.append(stream)
+    # Skip unexpected data
+    if not isinstance(audit_event, dict) or "kind" not in audit_event or audit_event["kind"] != "Event":
+        return None
 
-            if "nextToken" in response and response["nextToken"]:
-                next_token = response["nextToken"]
-                continue
-            
-            break
+    return audit_event
 
-        return streams        
 
+def scan_stream(log_stream_name):
+    """Scan one log stream, and return the detected (timestamp, audit_event) list and the number of scanned events."""
 
-class CwLogsStream:
+    log_stream = CwLogsStream(region_name, log_group_name, log_stream_name)
 
-    def __init__(self, region_name, log_group_name, log_stream_name):
-        self.region_name = region_name
-        self.log_group_name = log_group_name
-        self.log_stream_name = log_stream_name
+    detected_audit_events = []
+    num_scanned = 0
 
-    def iter_events_all(self, start_datetime=None, end_datetime=None):
+    for log_event in log_stream.iter_events_all(
+            start_datetime = start_datetime,
+            end_datetime = end_datetime,
+        ):
 
-        start_timestamp = datetime_to_timestamp_ms(start_datetime)
-        end_timestamp = datetime_to_timestamp_ms(end_datetime)
+        num_scanned += 1
 
-        logs_client = boto3.client("logs", region_name=self.region_name)
+        audit_event = parse_label_update(log_event["message"])
+        if audit_event:
+            detected_audit_events.append( (log_event["timestamp"], audit_event) )
 
-        next_token = None
-        while True:
+    return detected_audit_events, num_scanned
 
-            params = {
-                "logGroupName" : self.log_group_name,
-                "logStreamName" : self.log_stream_name,
-                "startFromHead" : True,
-                #"limit" : 100,
-            }
 
-            if start_timestamp:
-                params["startTime"] = start_timestamp
+def scan_streams_parallel():
 
-            if end_timestamp:
-                params["endTime"] = end_timestamp
+    log_group = CwLogsGroup(region_name, log_group_name)
+    
+    streams = log_group.list_streams_all(
+        pattern = "kube-apiserver-audit-*",
+        start_datetime = start_datetime,
+        end_datetime = end_datetime,
+        )
 
-            if next_token:
-                params["nextToken"] = next_token
-                del params["startTime"]
+    print( f"Scanning {len(streams)} log streams with {num_workers} workers" )
 
-            # print("Calling get_log_events:", params)
+    detected_audit_events = []
 
-            try:
-                response = logs_client.get_log_events( **params )
-            except logs_client.exceptions.ResourceNotFoundException as e:
-                print( "Log group or stream not found [ %s, %s ]" % (self.log_group_name, self.log_stream_name) )
-                sys.exit(1)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
 
-            # print("Num events:", len(response["events"]))
+        futures = { executor.submit(scan_stream, stream["logStreamName"]): stream["logStreamName"] for stream in streams }
 
-            # if len(response["events"]):
-            #     print("Timestamp:", response["events"][0]["timestamp"])
+        for i, future in enumerate(as_completed(futures)):
+            stream_detected_audit_events, num_scanned = future.result()
+            detected_audit_events += stream_detected_audit_events
+            print( f"[{i+1}/{len(streams)}] {futures[future]} : {num_scanned} events scanned, {len(stream_detected_audit_events)} detected", flush=True )
 
-            for event in response["events"]:
-                yield event
+    return detected_audit_events
 
-            assert "nextForwardToken" in response, "nextForwardToken not found"
 
-            if response["nextForwardToken"] != next_token:
-                next_token = response["nextForwardToken"]
-            else:
-                break
+def scan_with_logs_insights():
 
-            print(".", end="", flush=True)
+    # Filter by object name and verb on server side, so only candidate events are transferred.
+    # Label changes are still checked on the client side with the same code as the stream scan.
+    query_string = (
+        "fields @timestamp, @message"
+        " | filter @logStream like /^kube-apiserver-audit-/"
+        f" and objectRef.name = {json.dumps(object_name)}"
+        " and verb in [\"update\", \"patch\"]"
+        " | sort @timestamp asc"
+    )
 
+    query = CwLogsInsightsQuery(region_name, log_group_name)
 
-def print_audit_event(audit_event):
+    detected_audit_events = []
+    for result in query.iter_results_all(query_string, start_datetime, end_datetime):
+        audit_event = parse_label_update(result["@message"])
+        if audit_event:
+            timestamp = int(datetime.datetime.strptime(result["@timestamp"], "%Y-%m-%d %H:%M:%S.%f").replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+            detected_audit_events.append( (timestamp, audit_event) )
 
-    print("")
-    print(json.dumps(audit_event, indent=2))
-    print("")
-    print("---")
+    return detected_audit_events
 
 
 def main():
 
-    log_group = CwLogsGroup(region_name, log_group_name)
-    
-    streams = log_group.list_streams_all(
-        pattern = "kube-apiserver-audit-*",
-        start_datetime = start_datetime,
-        end_datetime = end_datetime,
-        )
-    
-    detected_audit_events = []
-
-    for stream in streams:
-
-        log_stream_name = stream["logStreamName"]
-
-        print("")
-        print( f"Processing log stream {log_stream_name}")
-        print("")
-
-        log_stream = CwLogsStream(region_name, log_group_name, log_stream_name)
-
-        for log_event in log_stream.iter_events_all(
-                start_datetime = start_datetime,
-                end_datetime = end_datetime,
-            ):
-
-            timestamp = log_event["timestamp"]
-            message = log_event["message"]
-
-            # Use regex to check object name before parsing entire message as a JSON string,
-            # because long messages are truncated at 256KB. 
-            re_result = re.search(r'"objectRef":(\{[^}]+\})', message)
-            if re_result:
-                object_ref = json.loads(re_result.group(1))
-                if "name" not in object_ref or object_ref["name"] != object_name:
-                    continue
-            else:
-                continue
-
-            try:
-                audit_event = json.loads(message)
-            except json.decoder.JSONDecodeError as e:
-                print(e, ":", message)
-                continue
-            
-            # Skip unexpected data
-            if not isinstance(audit_event, dict) or "kind" not in audit_event or audit_event["kind"] != "Event":
-                continue
-
-            try:
-                verb = audit_event["verb"]
-            except (TypeError, KeyError) as e:
-                verb = None
-
-            # process only update and patch operations
-            if verb in {'update', 'patch'}:
-                pass
-            elif verb in {'watch', 'list', 'create', 'delete', 'get', 'post'}:
-                continue
-            else:
-                print_audit_event(audit_event)
-                assert False, f"Unknown verb {verb}"
-
-            labels_updated = False
-            if "requestObject" in audit_event:
-                if "metadata" in audit_event["requestObject"]:
-                    if "labels" in audit_event["requestObject"]["metadata"]:
-                        labels_updated = True
-
-            if labels_updated:
-                detected_audit_events.append( (timestamp, audit_event) )
+    if use_logs_insights:
+        detected_audit_events = scan_with_logs_insights()
+    else:
+        detected_audit_events = scan_streams_parallel()
 
     print("")
     print( f"Printing detected audit events in chronological order.")
@@ -229,4 +173,5 @@ def main():
     print( f"Done.")
     print("")
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Query EKS audit logs in CloudWatch Logs by object, verb, user and changed fields.
+
+The time window is split into shards aligned to --shard-minutes, and every
+(log stream, shard) pair is fetched by a pool of workers in parallel. Fetched
+shards are cached locally, so refining a query (different filters, or a window
+overlapping a previous one) doesn't download the same logs again.
+
+Examples:
+    # Label changes of a node
+    python3 query_audit_logs.py --cluster-name my-eks-cluster \
+        --start 2025-05-06T18:00:00Z --end 2025-05-06T23:10:00Z \
+        --resource nodes --name hyperpod-i-0fdb3d806306ede29 --verb update,patch --field labels
+
+    # Taint changes of any node by a specific user
+    python3 query_audit_logs.py --cluster-name my-eks-cluster \
+        --start 2025-05-06T18:00:00Z --end 2025-05-06T23:10:00Z \
+        --resource nodes --verb update,patch --user "system:serviceaccount:*" --field taints
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import hashlib
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cwlogs import CwLogsGroup, CwLogsStream, datetime_to_timestamp_ms
+from audit_filter import AuditFilter
+
+
+# Shards newer than this may still receive events (ingestion delay), so they are not cached
+cache_min_age_ms = 15 * 60 * 1000
+
+
+class ShardCache:
+    """Raw log events of a (log group, log stream, time shard), as gzipped JSONL files."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_filename(self, log_group_name, log_stream_name, start_timestamp, end_timestamp):
+        group_dir = hashlib.sha256(log_group_name.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, group_dir, log_stream_name.replace("/", "%2F"), f"{start_timestamp}-{end_timestamp}.jsonl.gz")
+
+    def load(self, log_group_name, log_stream_name, start_timestamp, end_timestamp):
+        filename = self.get_filename(log_group_name, log_stream_name, start_timestamp, end_timestamp)
+        if not os.path.exists(filename):
+            return None
+        with gzip.open(filename, "rt") as f:
+            return [ json.loads(line) for line in f ]
+
+    def save(self, log_group_name, log_stream_name, start_timestamp, end_timestamp, events):
+        if end_timestamp > time.time() * 1000 - cache_min_age_ms:
+            return
+        filename = self.get_filename(log_group_name, log_stream_name, start_timestamp, end_timestamp)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a temporary file and rename, so an interrupted run never leaves a partial shard
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with gzip.open(tmp_filename, "wt") as f:
+            for event in events:
+                f.write(json.dumps({"timestamp": event["timestamp"], "message": event["message"]}) + "\n")
+        os.replace(tmp_filename, filename)
+
+
+def make_shards(start_timestamp, end_timestamp, shard_ms):
+    """Split the window into shards aligned to multiples of shard_ms, so repeated queries hit the same cache entries."""
+    shards = []
+    t = start_timestamp - start_timestamp % shard_ms
+    while t < end_timestamp:
+        shards.append((t, t + shard_ms))
+        t += shard_ms
+    return shards
+
+
+def format_timestamp_ms(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp / 1000, tz=datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def scan_shard(args, audit_filter, cache, log_stream_name, shard_start, shard_end):
+    """Fetch one (stream, shard) from the cache or CloudWatch Logs, and return (matches, number of events, cache hit)."""
+
+    events = cache.load(args.log_group, log_stream_name, shard_start, shard_end) if cache else None
+    cache_hit = events is not None
+
+    if not cache_hit:
+        log_stream = CwLogsStream(args.region, args.log_group, log_stream_name)
+        events = list(log_stream.iter_events_range(shard_start, shard_end))
+        if cache:
+            cache.save(args.log_group, log_stream_name, shard_start, shard_end, events)
+
+    matches = []
+    for event in events:
+        # Whole shards are fetched for cache reuse, trim them to the query window here
+        if not (args.start_timestamp <= event["timestamp"] < args.end_timestamp):
+            continue
+        result = audit_filter.match(event["message"])
+        if result:
+            audit_event, field_value = result
+            matches.append((event["timestamp"], audit_event, field_value))
+
+    return matches, len(events), cache_hit
+
+
+def print_match(args, timestamp, audit_event, field_value):
+
+    if args.output == "json":
+        print(json.dumps({"timestamp": format_timestamp_ms(timestamp), "fieldValue": field_value, "event": audit_event}))
+        return
+
+    object_ref = audit_event.get("objectRef", {})
+    object_path = "/".join( v for v in [object_ref.get("resource"), object_ref.get("namespace"), object_ref.get("name")] if v )
+    line = f"{format_timestamp_ms(timestamp)}  {audit_event.get('verb', ''):<7} {audit_event.get('user', {}).get('username', ''):<40} {object_path}"
+    if field_value is not None:
+        line += "  " + json.dumps(field_value, separators=(",", ":"))
+    print(line)
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Query EKS audit logs in CloudWatch Logs")
+    argparser.add_argument('--region', action="store", default="us-west-2", help='AWS region')
+    argparser.add_argument('--cluster-name', action="store", help='EKS cluster name. The log group is /aws/eks/<cluster-name>/cluster')
+    argparser.add_argument('--log-group', action="store", help='Log group name, instead of --cluster-name')
+    argparser.add_argument('--stream-pattern', action="store", default="kube-apiserver-audit-*", help='Log stream name pattern')
+    argparser.add_argument('--start', action="store", required=True, help='Start of the time window in UTC, e.g. 2025-05-06T18:00:00Z')
+    argparser.add_argument('--end', action="store", required=True, help='End of the time window in UTC, e.g. 2025-05-06T23:10:00Z')
+    argparser.add_argument('--resource', action="store", help='Object resource type (objectRef.resource), e.g. nodes, pods')
+    argparser.add_argument('--name', action="store", help='Object name, wildcards allowed')
+    argparser.add_argument('--namespace', action="store", help='Object namespace')
+    argparser.add_argument('--verb', action="append", default=[], help='Verbs, comma separated or repeated, e.g. update,patch')
+    argparser.add_argument('--user', action="store", help='User name, wildcards allowed, e.g. "system:node:*"')
+    argparser.add_argument('--field', action="store", help='Only requests that change this field: labels, taints, annotations, or a dotted path like spec.unschedulable')
+    argparser.add_argument('--shard-minutes', action="store", type=int, default=60, help='Length of time shards scanned in parallel')
+    argparser.add_argument('--num-workers', action="store", type=int, default=16, help='Number of shards scanned concurrently')
+    argparser.add_argument('--cache-dir', action="store", default=".audit_cache", help='Directory of the local shard cache')
+    argparser.add_argument('--no-cache', action="store_true", help='Don\'t read or write the local shard cache')
+    argparser.add_argument('--output', action="store", choices=["text", "json"], default="text", help='Output format. json prints one JSON object per line')
+    args = argparser.parse_args()
+
+    if not args.log_group:
+        if not args.cluster_name:
+            argparser.error("--cluster-name or --log-group is required")
+        args.log_group = f"/aws/eks/{args.cluster_name}/cluster"
+
+    args.start_timestamp = datetime_to_timestamp_ms(args.start)
+    args.end_timestamp = datetime_to_timestamp_ms(args.end)
+
+    audit_filter = AuditFilter(
+        resource = args.resource,
+        name = args.name,
+        namespace = args.namespace,
+        verbs = [ verb for value in args.verb for verb in value.split(",") if verb ],
+        user = args.user,
+        field = args.field,
+    )
+
+    cache = None if args.no_cache else ShardCache(args.cache_dir)
+
+    t0 = time.time()
+
+    log_group = CwLogsGroup(args.region, args.log_group)
+    streams = log_group.list_streams_all(
+        pattern = args.stream_pattern,
+        start_datetime = args.start,
+        end_datetime = args.end,
+    )
+
+    shards = make_shards(args.start_timestamp, args.end_timestamp, args.shard_minutes * 60 * 1000)
+
+    # lastEventTimestamp of a stream is updated lazily, so only the stream start is used to skip shards
+    work_items = [
+        (stream["logStreamName"], shard_start, shard_end)
+        for stream in streams
+        for shard_start, shard_end in shards
+        if shard_end > stream.get("firstEventTimestamp", 0)
+    ]
+
+    print(f"Scanning {len(streams)} log streams x {len(shards)} shards ({len(work_items)} work items) with {args.num_workers} workers", file=sys.stderr, flush=True)
+
+    matches = []
+    num_events = 0
+    num_cache_hits = 0
+
+    with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+
+        futures = [ executor.submit(scan_shard, args, audit_filter, cache, *work_item) for work_item in work_items ]
+
+        for i, future in enumerate(as_completed(futures)):
+            shard_matches, shard_num_events, cache_hit = future.result()
+            matches += shard_matches
+            num_events += shard_num_events
+            num_cache_hits += cache_hit
+            print(f"\r[{i+1}/{len(work_items)}] {num_events} events scanned, {len(matches)} matched", end="", file=sys.stderr, flush=True)
+
+    print("", file=sys.stderr)
+
+    for timestamp, audit_event, field_value in sorted(matches, key=lambda x: x[0]):
+        print_match(args, timestamp, audit_event, field_value)
+
+    print(f"{len(matches)} matched, {num_events} events scanned, {num_cache_hits}/{len(work_items)} shards from cache, {time.time()-t0:.1f} sec", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Follow EKS audit logs in CloudWatch Logs, and emit node label / taint changes as they happen.
+
+New kube-apiserver-audit-* streams are picked up as they appear. The read position
+of each stream (nextForwardToken) is kept in a state file, so a restarted tailer
+continues where it stopped. Streams are polled again right away while they have
+new events, and less often (up to --max-poll-interval) while they are quiet.
+
+Examples:
+    python3 tail_audit_logs.py --cluster-name my-eks-cluster
+    python3 tail_audit_logs.py --cluster-name my-eks-cluster --field labels --webhook-url https://hooks.slack.com/services/...
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from cwlogs import CwLogsGroup, get_logs_client, get_log_events_page_size
+from audit_filter import AuditFilter
+from query_audit_logs import format_timestamp_ms
+
+
+class StreamCursor:
+
+    def __init__(self, log_stream_name, next_token=None, last_timestamp=None, last_timestamp_count=0):
+        self.log_stream_name = log_stream_name
+        self.next_token = next_token
+        self.last_timestamp = last_timestamp
+        # Number of events seen at last_timestamp, skipped when resuming from the time
+        self.last_timestamp_count = last_timestamp_count
+        self.poll_interval = 0.0
+        self.next_poll_time = 0.0
+
+
+class TailState:
+    """Cursors of all followed streams, persisted as JSON."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.cursors = {}
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename) as f:
+            state = json.load(f)
+        for log_stream_name, cursor in state["Streams"].items():
+            self.cursors[log_stream_name] = StreamCursor(log_stream_name, cursor["NextToken"], cursor["LastTimestamp"], cursor.get("LastTimestampCount", 0))
+
+    def save(self):
+        state = {
+            "Streams": {
+                cursor.log_stream_name: {"NextToken": cursor.next_token, "LastTimestamp": cursor.last_timestamp, "LastTimestampCount": cursor.last_timestamp_count}
+                for cursor in self.cursors.values()
+            }
+        }
+        # Write to a temporary file and rename, so a crash never leaves a broken state file
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_filename, self.filename)
+
+
+class StdoutEmitter:
+
+    def emit(self, change):
+        object_ref = change["objectRef"]
+        object_path = "/".join( v for v in [object_ref.get("resource"), object_ref.get("namespace"), object_ref.get("name")] if v )
+        print(f"{change['timestamp']}  {change['verb']:<7} {change['user']:<40} {object_path}  {change['field']}={json.dumps(change['value'], separators=(',', ':'))}", flush=True)
+
+
+class WebhookEmitter:
+
+    def __init__(self, url, format, timeout=5, max_retries=2):
+        self.url = url
+        self.format = format
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def emit(self, change):
+
+        if self.format == "slack":
+            object_ref = change["objectRef"]
+            payload = {"text": f"{change['timestamp']} {change['user']} {change['verb']} {object_ref.get('resource')}/{object_ref.get('name')} {change['field']}: `{json.dumps(change['value'])}`"}
+        else:
+            payload = change
+
+        request = urllib.request.Request(
+            self.url,
+            data = json.dumps(payload).encode("utf-8"),
+            headers = {"Content-Type": "application/json"},
+            method = "POST",
+        )
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+                return
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    print(f"Webhook delivery failed: {e}", file=sys.stderr, flush=True)
+                    return
+                time.sleep(0.2 * (2 ** attempt))
+
+
+class AuditLogTailer:
+
+    def __init__(self, args, audit_filters, emitter, state):
+        self.args = args
+        self.audit_filters = audit_filters
+        self.emitter = emitter
+        self.state = state
+        self.stop_event = threading.Event()
+        self.log_group = CwLogsGroup(args.region, args.log_group)
+        self.logs_client = get_logs_client(args.region)
+
+    def discover_streams(self):
+
+        now_ms = int(time.time() * 1000)
+        stream_names = { stream["logStreamName"] for stream in self.log_group.list_streams_all(pattern=self.args.stream_pattern) }
+
+        for log_stream_name in sorted(stream_names - set(self.state.cursors)):
+            # Streams that existed at the first start are followed from now. Streams created
+            # later are followed from their head, so their first events are not missed.
+            last_timestamp = now_ms - self.args.lookback_seconds * 1000 if self.initial_discovery else 0
+            self.state.cursors[log_stream_name] = StreamCursor(log_stream_name, None, last_timestamp)
+            print(f"Following {log_stream_name}", file=sys.stderr, flush=True)
+
+        # Forget streams that were deleted by the retention policy
+        for log_stream_name in set(self.state.cursors) - stream_names:
+            del self.state.cursors[log_stream_name]
+
+        self.initial_discovery = False
+
+    def poll_stream(self, cursor):
+        """Read new events of a stream, and return the number of events, or None on a transient error."""
+
+        params = {
+            "logGroupName" : self.args.log_group,
+            "logStreamName" : cursor.log_stream_name,
+            "startFromHead" : True,
+            "limit" : get_log_events_page_size,
+        }
+
+        # Resuming from a time includes the events already seen in its millisecond, which are skipped
+        num_to_skip = 0
+        if cursor.next_token:
+            params["nextToken"] = cursor.next_token
+        elif cursor.last_timestamp:
+            params["startTime"] = cursor.last_timestamp
+            num_to_skip = cursor.last_timestamp_count
+
+        try:
+            response = self.logs_client.get_log_events(**params)
+        except self.logs_client.exceptions.InvalidParameterException:
+            # The token expired while the tailer was stopped. Resume from the last seen event time.
+            print(f"Cursor of {cursor.log_stream_name} expired, resuming from the last event time", file=sys.stderr, flush=True)
+            cursor.next_token = None
+            return 0
+        except self.logs_client.exceptions.ResourceNotFoundException:
+            return 0
+        except (BotoCoreError, ClientError) as e:
+            # e.g. connection errors, or throttling after the retries of botocore. Try again later.
+            print(f"Failed to read {cursor.log_stream_name}, backing off: {e}", file=sys.stderr, flush=True)
+            return None
+
+        for event in response["events"]:
+            if num_to_skip and event["timestamp"] == cursor.last_timestamp:
+                num_to_skip -= 1
+                continue
+            num_to_skip = 0
+
+            for audit_filter in self.audit_filters:
+                result = audit_filter.match(event["message"])
+                if result:
+                    audit_event, field_value = result
+                    self.emitter.emit({
+                        "timestamp": format_timestamp_ms(event["timestamp"]),
+                        "logStream": cursor.log_stream_name,
+                        "verb": audit_event.get("verb"),
+                        "user": audit_event.get("user", {}).get("username", ""),
+                        "objectRef": audit_event.get("objectRef", {}),
+                        "field": audit_filter.field,
+                        "value": field_value,
+                    })
+                    break
+
+            if event["timestamp"] == cursor.last_timestamp:
+                cursor.last_timestamp_count += 1
+            else:
+                cursor.last_timestamp = event["timestamp"]
+                cursor.last_timestamp_count = 1
+
+        cursor.next_token = response["nextForwardToken"]
+        return len(response["events"])
+
+    def schedule(self, cursor, num_events):
+        # Adaptive backoff: poll again immediately while pages are full, keep the minimum
+        # interval while events are flowing, and double the interval while the stream is quiet.
+        # After an error, wait for the longest interval.
+        if num_events is None:
+            cursor.poll_interval = self.args.max_poll_interval
+        elif num_events >= get_log_events_page_size:
+            cursor.poll_interval = 0.0
+        elif num_events:
+            cursor.poll_interval = self.args.min_poll_interval
+        else:
+            cursor.poll_interval = min(max(cursor.poll_interval * 2, self.args.min_poll_interval), self.args.max_poll_interval)
+        cursor.next_poll_time = time.monotonic() + cursor.poll_interval
+
+    def run(self):
+
+        self.initial_discovery = not self.state.cursors
+        next_discovery_time = 0.0
+
+        # The state is saved also on a fatal error, so a restarted tailer continues from the last events read
+        try:
+            with ThreadPoolExecutor(max_workers=self.args.num_workers) as executor:
+
+                while not self.stop_event.is_set():
+
+                    if time.monotonic() >= next_discovery_time:
+                        try:
+                            self.discover_streams()
+                        except (BotoCoreError, ClientError) as e:
+                            print(f"Failed to list streams, retrying at the next discovery: {e}", file=sys.stderr, flush=True)
+                        next_discovery_time = time.monotonic() + self.args.discovery_interval
+
+                    now = time.monotonic()
+                    due_cursors = [ cursor for cursor in self.state.cursors.values() if cursor.next_poll_time <= now ]
+
+                    if due_cursors:
+                        for cursor, num_events in zip(due_cursors, executor.map(self.poll_stream, due_cursors)):
+                            self.schedule(cursor, num_events)
+                        self.state.save()
+
+                    next_poll_time = min( [ cursor.next_poll_time for cursor in self.state.cursors.values() ] + [next_discovery_time] )
+                    self.stop_event.wait(max(0.0, next_poll_time - time.monotonic()))
+        finally:
+            self.state.save()
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Follow EKS audit logs, and emit node label / taint changes")
+    argparser.add_argument('--region', action="store", default="us-west-2", help='AWS region')
+    argparser.add_argument('--cluster-name', action="store", help='EKS cluster name. The log group is /aws/eks/<cluster-name>/cluster')
+    argparser.add_argument('--log-group', action="store", help='Log group name, instead of --cluster-name')
+    argparser.add_argument('--stream-pattern', action="store", default="kube-apiserver-audit-*", help='Log stream name pattern')
+    argparser.add_argument('--resource', action="store", default="nodes", help='Object resource type (objectRef.resource)')
+    argparser.add_argument('--name', action="store", help='Object name, wildcards allowed')
+    argparser.add_argument('--field', action="append", default=[], help='Fields to watch, repeated. Default: labels and taints')
+    argparser.add_argument('--state-file', action="store", default=".tail_audit_logs.state.json", help='File to keep the stream cursors across restarts')
+    argparser.add_argument('--lookback-seconds', action="store", type=int, default=60, help='On the first start, also emit changes from this many seconds ago')
+    argparser.add_argument('--min-poll-interval', action="store", type=float, default=1.0, help='Poll interval of active streams, in seconds')
+    argparser.add_argument('--max-poll-interval', action="store", type=float, default=30.0, help='Longest poll interval of quiet streams, in seconds')
+    argparser.add_argument('--discovery-interval', action="store", type=float, default=60.0, help='How often to look for new streams, in seconds')
+    argparser.add_argument('--num-workers', action="store", type=int, default=8, help='Number of streams polled concurrently')
+    argparser.add_argument('--webhook-url', action="store", help='Post changes to this webhook, instead of printing them')
+    argparser.add_argument('--webhook-format', action="store", choices=["slack", "json"], default="json", help='Payload format of the webhook')
+    args = argparser.parse_args()
+
+    if not args.log_group:
+        if not args.cluster_name:
+            argparser.error("--cluster-name or --log-group is required")
+        args.log_group = f"/aws/eks/{args.cluster_name}/cluster"
+
+    audit_filters = []
+    for field in args.field or ["labels", "taints"]:
+        audit_filters.append(AuditFilter(resource=args.resource, name=args.name, verbs=["update", "patch"], field=field))
+
+    emitter = WebhookEmitter(args.webhook_url, args.webhook_format) if args.webhook_url else StdoutEmitter()
+
+    state = TailState(args.state_file)
+    state.load()
+
+    tailer = AuditLogTailer(args, audit_filters, emitter, state)
+
+    def stop(signum, frame):
+        tailer.stop_event.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    tailer.run()
+    print("Stopped. Cursors saved to " + args.state_file, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the admission fast path of webhook.py on large Pod specs.
+
+Compares the full path (json.loads + mutate + json.dumps of the response) with the
+fast path (scan of uid / kind / operation / namespace / name + pre-serialized
+response), checks that both return the same response bytes, and reports
+requests per second for each Pod spec size.
+"""
+import sys
+import copy
+import json
+import time
+import uuid
+import argparse
+
+import webhook
+
+
+def legacy_handle(body):
+    """Request handling before the fast path, as a baseline."""
+    post_data = json.loads(body)
+    response, patch = webhook.mutate(post_data)
+    return json.dumps(response).encode()
+
+
+def fast_path_handle(body):
+    """Request handling of APIHandler.do_POST"""
+    fields = webhook.scan_request_fields(body)
+    if webhook.is_fast_path(fields):
+        return webhook.make_allowed_response(fields["uid"])
+    return legacy_handle(body)
+
+
+def make_pod_request(template, size_kb):
+    """Pod CREATE request in the default namespace, padded with containers and env vars up to size_kb, like a large training job."""
+
+    post_data = copy.deepcopy(template)
+    post_data["request"]["uid"] = str(uuid.uuid4())
+    spec = post_data["request"]["object"]["spec"]
+    container = spec["containers"][0]
+
+    size = len(json.dumps(post_data))
+    i = 0
+    while size < size_kb * 1024:
+        if i % 50 == 0:
+            spec["containers"].append(copy.deepcopy(container))
+            spec["containers"][-1]["name"] = f"worker-{i}"
+            spec["containers"][-1].setdefault("env", [])
+            size += len(json.dumps(spec["containers"][-1])) + 2
+        env_var = {"name": f"TRAINING_ENV_{i}", "value": "x" * 64}
+        spec["containers"][-1]["env"].append(env_var)
+        size += len(json.dumps(env_var)) + 2
+        i += 1
+
+    return json.dumps(post_data).encode()
+
+
+def measure(func, bodies, iterations):
+    best = None
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        responses = [ func(body) for body in bodies ]
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, responses
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the admission fast path of webhook.py on large Pod specs")
+    argparser.add_argument('--sizes-kb', action="store", default="2,20,100,500", help='Comma separated Pod request sizes in KB')
+    argparser.add_argument('--num-requests', action="store", type=int, default=200, help='Number of requests per size')
+    argparser.add_argument('--iterations', action="store", type=int, default=3, help='Number of runs, the best is reported')
+    args = argparser.parse_args()
+
+    with open("test-data/pod-create.json") as f:
+        pod_template = json.load(f)
+    with open("test-data/node-create.json") as f:
+        node_body = json.dumps(json.load(f)).encode()
+
+    # Requests that need a patch take the full path, and get the same patch
+    assert fast_path_handle(node_body) == legacy_handle(node_body), "Responses differ for a Node request"
+
+    print(f"{'Pod size':>10} {'json.loads (before)':>22} {'fast path (after)':>22} {'speedup':>8}")
+
+    for size_kb in [ int(v) for v in args.sizes_kb.split(",") ]:
+        bodies = [ make_pod_request(pod_template, size_kb) for _ in range(args.num_requests) ]
+
+        elapsed_before, responses_before = measure(legacy_handle, bodies, args.iterations)
+        elapsed_after, responses_after = measure(fast_path_handle, bodies, args.iterations)
+
+        assert responses_before == responses_after, "Responses differ"
+
+        print(f"{size_kb:>7} KB {len(bodies)/elapsed_before:>14,.0f} req/s {len(bodies)/elapsed_after:>16,.0f} req/s {elapsed_before/elapsed_after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Load test of the mutating webhook at a fixed request rate.
+
+Requests are sent open-loop: request i is due at start + i / rate, whether or not
+earlier requests have completed, like admission requests during a large job launch.
+Latency is measured from the due time, so time spent waiting for a free connection
+is included (no coordinated omission). Connections are kept alive, like the API server.
+
+Example:
+    python3 webhook.py &
+    python3 load_test.py --rate 1000 --duration 10
+"""
+import ssl
+import json
+import math
+import time
+import uuid
+import queue
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values)-1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def load_payloads(filenames):
+    """Load AdmissionReview samples. The UID is replaced per request."""
+    payloads = []
+    for filename in filenames:
+        with open(filename) as f:
+            payloads.append(json.load(f))
+    return payloads
+
+
+def make_body(payload):
+    payload["request"]["uid"] = str(uuid.uuid4())
+    return json.dumps(payload).encode()
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, args, ssl_context, work_queue, results, lock):
+        super().__init__(daemon=True)
+        self.args = args
+        self.ssl_context = ssl_context
+        self.work_queue = work_queue
+        self.results = results
+        self.lock = lock
+        self.url = urlparse(args.url)
+        self.connection = None
+
+    def connect(self):
+        self.connection = http.client.HTTPSConnection(self.url.hostname, self.url.port or 443, context=self.ssl_context, timeout=self.args.timeout)
+
+    def run(self):
+
+        while True:
+            item = self.work_queue.get()
+            if item is None:
+                break
+            due_time, body = item
+
+            if self.connection is None:
+                self.connect()
+
+            send_time = time.perf_counter()
+            try:
+                self.connection.request("POST", self.url.path, body=body, headers={"Content-Type": "application/json"})
+                response = self.connection.getresponse()
+                response_body = response.read()
+                ok = response.status == 200 and json.loads(response_body)["response"]["allowed"]
+            except (OSError, http.client.HTTPException, ValueError, KeyError):
+                ok = False
+                self.connection.close()
+                self.connection = None
+            end_time = time.perf_counter()
+
+            with self.lock:
+                self.results.append((ok, end_time - due_time, end_time - send_time))
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description="Load test of the mutating webhook at a fixed request rate")
+    argparser.add_argument('--url', action="store", default="https://localhost:8443/mutate", help='Webhook URL')
+    argparser.add_argument('--rate', action="store", type=float, default=1000, help='Requests per second')
+    argparser.add_argument('--duration', action="store", type=float, default=10, help='Test duration in seconds')
+    argparser.add_argument('--connections', action="store", type=int, default=32, help='Number of keep-alive connections')
+    argparser.add_argument('--payload', action="append", default=[], help='AdmissionReview JSON files, repeated. Requests cycle through them')
+    argparser.add_argument('--ca-file', action="store", default="certs/tls.crt", help='CA certificate to verify the server with')
+    argparser.add_argument('--insecure', action="store_true", help='Don\'t verify the server certificate')
+    argparser.add_argument('--timeout', action="store", type=float, default=10, help='Request timeout in seconds (the API server default for webhooks is 10)')
+    args = argparser.parse_args()
+
+    payloads = load_payloads(args.payload or ["test-data/pod-create.json", "test-data/node-create.json"])
+
+    if args.insecure:
+        ssl_context = ssl._create_unverified_context()
+    else:
+        ssl_context = ssl.create_default_context(cafile=args.ca_file)
+
+    work_queue = queue.Queue()
+    results = []
+    lock = threading.Lock()
+
+    workers = [ Worker(args, ssl_context, work_queue, results, lock) for _ in range(args.connections) ]
+    for worker in workers:
+        worker.start()
+
+    num_requests = int(args.rate * args.duration)
+
+    # Pre-serialize request bodies, so generating them doesn't limit the rate
+    bodies = [ make_body(payloads[i % len(payloads)]) for i in range(num_requests) ]
+
+    print(f"Sending {num_requests} requests at {args.rate:.0f} requests/sec over {args.connections} connections to {args.url}")
+
+    start_time = time.perf_counter() + 0.5
+    for i, body in enumerate(bodies):
+        due_time = start_time + i / args.rate
+        delay = due_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        work_queue.put((due_time, body))
+
+    for _ in workers:
+        work_queue.put(None)
+    for worker in workers:
+        worker.join()
+
+    elapsed = time.perf_counter() - start_time
+
+    num_ok = sum( 1 for ok, _, _ in results if ok )
+    latencies = sorted( latency for _, latency, _ in results )
+    service_times = sorted( service_time for _, _, service_time in results )
+
+    print(f"Completed: {len(results)} requests in {elapsed:.1f} sec ({len(results)/elapsed:.0f} requests/sec), {len(results) - num_ok} errors")
+    for name, values in [("Latency (from due time)", latencies), ("Service time (on the wire)", service_times)]:
+        print(f"{name:<28} p50={percentile(values, 50)*1000:7.2f} ms  p90={percentile(values, 90)*1000:7.2f} ms  "
+              f"p99={percentile(values, 99)*1000:7.2f} ms  p99.9={percentile(values, 99.9)*1000:7.2f} ms  max={values[-1]*1000 if values else float('nan'):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
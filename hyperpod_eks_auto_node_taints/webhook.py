@@ -1,7 +1,20 @@
 import os
 import ssl
+import sys
 import json
+import time
+import re
 import base64
+import bisect
+import fnmatch
+import queue
+import random
+import signal
+import socket
+import logging
+import selectors
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 
@@ -11,23 +24,555 @@ if os.path.exists("./certs"):
 else:
     cert_dirname = "/certs"
 
+# Number of TLS handshakes and requests served concurrently. Idle keep-alive connections wait in a selector, not in a worker.
+num_workers = int(os.environ.get("WEBHOOK_WORKERS", "64"))
+
+# Idle keep-alive connections are closed after this many seconds
+keep_alive_timeout = float(os.environ.get("WEBHOOK_KEEP_ALIVE_TIMEOUT", "60"))
+
+# Time limit of a TLS handshake, and of reading a request once it started arriving
+io_timeout = 10
+
+# Connections waiting to be accepted. A full backlog drops SYNs, and the client retransmits only after 1 second.
+listen_backlog = int(os.environ.get("WEBHOOK_LISTEN_BACKLOG", "1024"))
+
+# On SIGTERM, /readyz fails for this many seconds before the server stops accepting, so the Pod is removed from the Service endpoints first
+shutdown_grace_seconds = float(os.environ.get("WEBHOOK_SHUTDOWN_GRACE_SECONDS", "5"))
+
+# DEBUG, INFO, WARNING or ERROR
+log_level = os.environ.get("WEBHOOK_LOG_LEVEL", "INFO")
+
+# Fraction of admission requests without a patch that are logged. Patched requests and errors are always logged.
+log_sample_rate = float(os.environ.get("WEBHOOK_LOG_SAMPLE_RATE", "0.01"))
+
+# Dump the entire request, patch and response of every admission request. Only for debugging, it's slow for large Pod specs.
+log_full_dump = os.environ.get("WEBHOOK_LOG_FULL_DUMP", "false").lower() == "true"
+
+# Mutation rules (JSON), typically a ConfigMap mounted as a volume. The built-in rules are used if the file doesn't exist.
+if os.path.exists("./rules.json"):
+    rules_filename = os.environ.get("WEBHOOK_RULES_FILE", "./rules.json")
+else:
+    rules_filename = os.environ.get("WEBHOOK_RULES_FILE", "/config/rules.json")
+
+# How often to check the rules file for changes, in seconds
+rules_reload_interval = float(os.environ.get("WEBHOOK_RULES_RELOAD_INTERVAL", "10"))
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed as extra={"fields": {...}}"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry)
+
+
+def create_logger():
+    logger = logging.getLogger("webhook")
+    logger.setLevel(log_level)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonLogFormatter())
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+
+logger = create_logger()
+
+
+class Metrics:
+    """Request counters and latency histogram, exposed in the Prometheus text format on /metrics"""
+
+    latency_buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.in_flight = 0
+        self.latency_counts = [0] * (len(self.latency_buckets) + 1)
+        self.latency_sum = 0.0
+
+    def begin_request(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end_request(self, kind, operation, result, duration):
+        key = (kind, operation, result)
+        with self.lock:
+            self.in_flight -= 1
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency_counts[bisect.bisect_left(self.latency_buckets, duration)] += 1
+            self.latency_sum += duration
+
+    def render(self):
+        with self.lock:
+            lines = [
+                "# HELP webhook_admission_requests_total Number of admission requests.",
+                "# TYPE webhook_admission_requests_total counter",
+            ]
+            for (kind, operation, result), count in sorted(self.requests.items()):
+                lines.append(f'webhook_admission_requests_total{{kind="{kind}",operation="{operation}",result="{result}"}} {count}')
+
+            lines += [
+                "# HELP webhook_admission_duration_seconds Time to handle an admission request.",
+                "# TYPE webhook_admission_duration_seconds histogram",
+            ]
+            cumulative = 0
+            for le, count in zip(self.latency_buckets + ["+Inf"], self.latency_counts):
+                cumulative += count
+                lines.append(f'webhook_admission_duration_seconds_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"webhook_admission_duration_seconds_sum {self.latency_sum}")
+            lines.append(f"webhook_admission_duration_seconds_count {cumulative}")
+
+            lines += [
+                "# HELP webhook_in_flight_requests Number of admission requests being handled.",
+                "# TYPE webhook_in_flight_requests gauge",
+                f"webhook_in_flight_requests {self.in_flight}",
+            ]
+        return ("\n".join(lines) + "\n").encode()
+
+
+metrics = Metrics()
+
+
+def log_admission(request, patch, response, duration):
+
+    if log_full_dump and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Admission request dump", extra={"fields": {"request": request, "patch": patch, "response": response}})
+
+    # Most requests need no patch, log only a sample of them
+    if patch is None and random.random() >= log_sample_rate:
+        return
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Admission request", extra={"fields": {
+            "uid": request["uid"],
+            "kind": request["kind"]["kind"],
+            "operation": request["operation"],
+            "namespace": request.get("namespace", ""),
+            "name": get_request_name(request),
+            "patched": patch is not None,
+            "sampled": patch is None,
+            "duration_ms": round(duration * 1000, 3),
+        }})
+
+
+def get_request_name(request):
+    if "name" in request:
+        return request["name"]
+    elif "object" in request and "metadata" in request["object"] and "generateName" in request["object"]["metadata"]:
+        return request["object"]["metadata"]["generateName"] + "..."
+    else:
+        return ""
+
+
+# Built-in rules, used when the rules file doesn't exist. Same format as rules.json.
+default_rules = [
+    {
+        # Add label and taint to new HyperPod nodes
+        "name": "hyperpod-node-label-and-taint",
+        "match": {
+            "kind": "Node",
+            "operations": ["CREATE"],
+            "names": ["hyperpod-*"],
+        },
+        "patch": [
+            {
+                "op": "add",
+                "path": "/metadata/labels/mutating-webhook-label",
+                "value": "123"
+            },
+            {
+                "op": "add",
+                "path": "/spec/taints/-",
+                "value": {
+                    "key": "mutating-webhook-taint",
+                    "effect": "NoSchedule",
+                    "value": "true",
+                }
+            },
+        ],
+    },
+    {
+        # Add toleration to HyperPod system Pods
+        "name": "hyperpod-system-pod-toleration",
+        "match": {
+            "kind": "Pod",
+            "operations": ["CREATE"],
+            "namespaces": ["aws-hyperpod"],
+            "names": ["hardwarecheck", "hardwarecheck-*", "dcgm", "dcgm-*", "efa", "efa-*", "nccl", "nccl-*"],
+        },
+        "patch": [
+            {
+                "op": "add",
+                "path": "/spec/tolerations/-",
+                "value": {
+                    "operator": "Exists",
+                }
+            },
+        ],
+    },
+]
+
+
+def split_json_pointer(path):
+    return [ token.replace("~1", "/").replace("~0", "~") for token in path.split("/")[1:] ]
+
+
+def join_json_pointer(tokens):
+    return "".join( "/" + token.replace("~", "~0").replace("/", "~1") for token in tokens )
+
+
+class CompiledRule:
+    """A rule with its matchers and patch prepared once at load time."""
+
+    def __init__(self, rule):
+        match = rule.get("match", {})
+
+        self.name = rule["name"]
+        self.kind = match.get("kind", "*")
+        self.operations = match.get("operations", ["*"])
+        self.namespaces = match.get("namespaces")
+        self.labels = match.get("labels", {})
+
+        # Exact names are a set lookup, wildcard patterns are combined into one regex
+        names = match.get("names", [])
+        self.exact_names = { name for name in names if not any( c in name for c in "*?[" ) }
+        patterns = [ name for name in names if name not in self.exact_names ]
+        self.name_regex = re.compile("|".join( fnmatch.translate(pattern) for pattern in patterns )) if patterns else None
+        self.match_any_name = not names
+
+        self.patch = rule["patch"]
+        for op in self.patch:
+            if op.get("op") not in {"add", "replace", "remove"} or not str(op.get("path", "")).startswith("/"):
+                raise ValueError(f"Rule {self.name}: unsupported patch operation {op}")
+
+        # Parents that each "add" operation needs, e.g. /metadata/labels for /metadata/labels/foo, and /spec/taints for /spec/taints/-
+        self.ops_with_parents = []
+        for op in self.patch:
+            parents = []
+            if op["op"] == "add":
+                tokens = split_json_pointer(op["path"])
+                # Missing parents are created as objects, so a list element can't be a parent
+                for token in tokens[:-1]:
+                    if token == "-" or token.isdigit():
+                        raise ValueError(f"Rule {self.name}: list index in the parent of an add operation {op}")
+                for i in range(1, len(tokens)):
+                    parents.append((tuple(tokens[:i]), [] if tokens[i] == "-" else {}))
+            self.ops_with_parents.append((op, parents))
+
+    def matches_name(self, name):
+        return self.match_any_name or name in self.exact_names or bool(self.name_regex and self.name_regex.match(name))
+
+    def matches(self, name, obj):
+        if not self.matches_name(name):
+            return False
+        if self.labels:
+            labels = (obj.get("metadata") or {}).get("labels") or {}
+            for key, value in self.labels.items():
+                if labels.get(key) != value:
+                    return False
+        return True
+
+
+class RuleSet:
+    """Rules indexed by (kind, operation) and namespace, so a request is checked only against the rules that can match."""
+
+    def __init__(self, rules):
+        self.index = {}
+        for rule in rules:
+            compiled_rule = CompiledRule(rule)
+            for operation in compiled_rule.operations:
+                by_namespace = self.index.setdefault((compiled_rule.kind, operation), {})
+                for namespace in compiled_rule.namespaces or [None]:
+                    by_namespace.setdefault(namespace, []).append(compiled_rule)
+        self.num_rules = len(rules)
+
+    def lookup(self, kind, operation, namespace):
+        rules = []
+        for key in ((kind, operation), (kind, "*"), ("*", operation), ("*", "*")):
+            by_namespace = self.index.get(key)
+            if by_namespace:
+                if namespace:
+                    rules += by_namespace.get(namespace, [])
+                rules += by_namespace.get(None, [])
+        return rules
+
+    def may_match(self, kind, operation, namespace, name):
+        """Return False if no rule can match, decided without the object.
+
+        Rules with label conditions, and objects without a name (matched by generateName), need the object, so they may match.
+        """
+        for rule in self.lookup(kind, operation, namespace):
+            if name is None or rule.labels or rule.matches_name(name):
+                return True
+        return False
+
+    def get_patch(self, kind, operation, namespace, name, obj):
+        """Return the JSON patch of all matching rules in order, or None when no rule matches."""
+
+        patch = []
+        created = set()
+
+        for rule in self.lookup(kind, operation, namespace):
+            if not rule.matches(name, obj):
+                continue
+
+            for op, parents in rule.ops_with_parents:
+
+                # Create missing parent fields, e.g. labels or taints, before adding to them
+                for parent, empty_value in parents:
+                    if parent in created:
+                        continue
+                    value = obj
+                    for token in parent:
+                        value = value.get(token) if isinstance(value, dict) else None
+                    if value is None:
+                        patch.append({"op": "add", "path": join_json_pointer(parent), "value": empty_value})
+                        created.add(parent)
+
+                patch.append(op)
+
+        return patch or None
+
+
+def load_rules(filename):
+    if filename and os.path.exists(filename):
+        with open(filename) as f:
+            return json.load(f)["rules"]
+    return default_rules
+
+
+class RuleLoader:
+    """Keeps the current RuleSet, and reloads the rules file when it changes.
+
+    ConfigMap volumes are updated by swapping a symlink, so the stat of the path
+    (following the symlink) changes. A file with errors is logged and ignored,
+    and the previous rules stay in effect.
+    """
+
+    def __init__(self, filename, interval):
+        self.filename = filename
+        self.interval = interval
+        self.file_stat = self.get_file_stat()
+        self.rule_set = RuleSet(load_rules(filename))
+        logger.info("Rules loaded", extra={"fields": {"file": filename if self.file_stat else "(built-in)", "rules": self.rule_set.num_rules}})
+
+    def get_file_stat(self):
+        try:
+            st = os.stat(self.filename)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except (OSError, TypeError):
+            return None
+
+    def reload_if_changed(self):
+        file_stat = self.get_file_stat()
+        if file_stat == self.file_stat:
+            return
+        self.file_stat = file_stat
+        try:
+            rule_set = RuleSet(load_rules(self.filename))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Failed to reload rules, keeping the previous rules", extra={"fields": {"file": self.filename, "error": repr(e)}})
+            return
+        # Replacing the reference is atomic, requests in flight keep using the previous RuleSet
+        self.rule_set = rule_set
+        logger.info("Rules reloaded", extra={"fields": {"file": self.filename, "rules": rule_set.num_rules}})
+
+    def watch(self):
+        while True:
+            time.sleep(self.interval)
+            self.reload_if_changed()
+
+    def start(self):
+        threading.Thread(target=self.watch, daemon=True).start()
+
+
+rule_loader = RuleLoader(rules_filename, rules_reload_interval)
+
+
+json_decoder = json.JSONDecoder()
+json_whitespace = re.compile(r'[ \t\n\r]*')
+
+# Fields of AdmissionReview.request that the fast path needs. The API server serializes them before the objects.
+scan_request_field_names = {"uid", "kind", "operation", "namespace", "name"}
+scan_request_stop_field_names = {"object", "oldObject"}
+
+
+def scan_request_fields(body):
+    """Return uid, kind, operation, namespace and name of an AdmissionReview, without parsing the objects in it.
+
+    Returns None if the body isn't in the expected shape, and the request is handled by the full parse.
+    """
+
+    try:
+        s = body.decode()
+
+        idx = s.index('"request"')
+        idx = json_whitespace.match(s, idx + len('"request"')).end()
+        if s[idx] != ":":
+            return None
+        idx = json_whitespace.match(s, idx + 1).end()
+        if s[idx] != "{":
+            return None
+        idx = json_whitespace.match(s, idx + 1).end()
+
+        fields = {}
+        while s[idx] == '"':
+            key, idx = json.decoder.scanstring(s, idx + 1)
+            idx = json_whitespace.match(s, idx).end()
+            if s[idx] != ":":
+                return None
+            idx = json_whitespace.match(s, idx + 1).end()
+
+            if key in scan_request_stop_field_names:
+                break
+
+            value, idx = json_decoder.raw_decode(s, idx)
+            if key in scan_request_field_names:
+                fields[key] = value
+
+            idx = json_whitespace.match(s, idx).end()
+            if s[idx] != ",":
+                break
+            idx = json_whitespace.match(s, idx + 1).end()
+
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+    if not (isinstance(fields.get("uid"), str) and isinstance(fields.get("kind"), dict)
+            and isinstance(fields["kind"].get("kind"), str) and isinstance(fields.get("operation"), str)):
+        return None
+
+    return fields
+
+
+# The response to requests that need no patch, pre-serialized. Only the UID is filled in per request.
+allowed_response_prefix, allowed_response_suffix = json.dumps({
+    "apiVersion": "admission.k8s.io/v1",
+    "kind": "AdmissionReview",
+    "response": {
+        "uid": "UID",
+        "allowed": True
+    }
+}).encode().split(b'"UID"')
+
+
+def make_allowed_response(uid):
+    return allowed_response_prefix + json.dumps(uid).encode() + allowed_response_suffix
+
+
+def is_fast_path(fields):
+    """True if the request surely needs no patch, so the full parse can be skipped"""
+
+    if fields is None or log_full_dump:
+        return False
+
+    return not rule_loader.rule_set.may_match(
+        fields["kind"]["kind"],
+        fields["operation"],
+        fields.get("namespace"),
+        fields.get("name"),
+    )
+
+
+def mutate(post_data):
+    """Return (AdmissionReview response, JSON patch or None) for an AdmissionReview request."""
+
+    request = post_data["request"]
+    request_id = request["uid"]
+    name = get_request_name(request)
+
+    response = {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "response": {
+            "uid": request_id,
+            "allowed": True
+        }
+    }
+
+    patch = rule_loader.rule_set.get_patch(
+        request["kind"]["kind"],
+        request["operation"],
+        request.get("namespace"),
+        name,
+        request.get("object") or {},
+    )
+
+    if patch:
+        # Base64 encode the patch
+        patch_bytes = json.dumps(patch).encode('utf-8')
+        base64_patch = base64.b64encode(patch_bytes).decode('utf-8')
+
+        # Add the patch to the response
+        response["response"]["patchType"] = "JSONPatch"
+        response["response"]["patch"] = base64_patch
+
+    return response, patch
+
 
 class APIHandler(BaseHTTPRequestHandler):
 
+    # Keep connections alive, so the API server doesn't pay a TLS handshake per admission request
+    protocol_version = "HTTP/1.1"
+    timeout = io_timeout
+
+    # Headers and body are separate writes. Without this, Nagle's algorithm and delayed ACK add ~40ms on keep-alive connections.
+    disable_nagle_algorithm = True
+
     # Suppress logs
     def log_message(self, format, *args):
         pass
 
-    def _send_response(self, data):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+    def handle(self):
+        # Requests are served one at a time by PooledHTTPSServer.serve_connection(),
+        # so that a connection doesn't hold a worker while it's idle
+        pass
+
+    def finish(self):
+        # The connection outlives the constructor, it's closed by close()
+        pass
+
+    def close(self):
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def _send_body(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.draining:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
 
-    def _read_post_data(self):
+    def do_GET(self):
+
+        api_path = urlparse(self.path).path
+
+        if api_path == '/healthz':
+            self._send_body(200, b'ok', 'text/plain')
+        elif api_path == '/metrics':
+            self._send_body(200, metrics.render(), 'text/plain; version=0.0.4')
+        elif api_path == '/readyz':
+            if self.server.draining:
+                self._send_body(503, b'shutting down', 'text/plain')
+            else:
+                self._send_body(200, b'ok', 'text/plain')
+        else:
+            self._send_body(404, b'', 'text/plain')
+
+    def _read_body(self):
         content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        return json.loads(post_data.decode())
+        return self.rfile.read(content_length)
 
     def do_POST(self):
 
@@ -35,176 +580,229 @@ class APIHandler(BaseHTTPRequestHandler):
         api_path = parsed_url.path
 
         if api_path == '/mutate':
+
+            t0 = time.perf_counter()
+            metrics.begin_request()
+            kind = operation = ""
+            result = "error"
+
             try:
-                post_data = self._read_post_data()
-
-                request = post_data["request"]
-                request_id = request["uid"]
-
-                if "name" in request:
-                    name = request["name"]
-                elif "object" in request and "metadata" in request["object"] and "generateName" in request["object"]["metadata"]:
-                    name = request["object"]["metadata"]["generateName"] + "..."
-                else:
-                    name = ""
-
-                print( "%s(%s) - %s" % (request["kind"]["kind"], name, request["operation"]) )
-
-                response = {
-                    "apiVersion": "admission.k8s.io/v1",
-                    "kind": "AdmissionReview",
-                    "response": {
-                        "uid": request_id,
-                        "allowed": True
-                    }
-                }
+                try:
+                    body = self._read_body()
+                    fields = scan_request_fields(body)
 
-                # Add label and taint to new HyperPod nodes
-                if request["kind"]["kind"] == "Node" and request["operation"] == "CREATE" and name.startswith("hyperpod-"):
-
-                    print("Request:")
-                    print(json.dumps(post_data, indent=2))
-
-                    patch = []
-
-                    # Create labels field if it doesn't exist.
-                    if "labels" not in request["object"]["metadata"]:
-                        patch.append(
-                            {
-                                "op": "add",
-                                "path": "/metadata/labels",
-                                "value": {}
-                            }
-                        )
-
-                    # Add a label
-                    patch.append(
-                        {
-                            "op": "add",
-                            "path": "/metadata/labels/mutating-webhook-label",
-                            "value": "123"
-                        }
-                    )
-
-                    # Create taints field if it doesn't exist.
-                    if "taints" not in request["object"]["spec"]:
-                        patch.append(
-                            {
-                                "op": "add",
-                                "path": "/spec/taints",
-                                "value": []
-                            }
-                        )
-
-                    # Add a taint
-                    patch.append(
-                        {
-                            "op": "add",
-                            "path": "/spec/taints/-",
-                            "value": {
-                                "key": "mutating-webhook-taint",
-                                "effect": "NoSchedule",
-                                "value": "true",
-                            }
-                        }
-                    )
-                    
-                    # Base64 encode the patch
-                    patch_bytes = json.dumps(patch).encode('utf-8')
-                    base64_patch = base64.b64encode(patch_bytes).decode('utf-8')
-                    
-                    # Add the patch to the response
-                    response["response"]["patchType"] = "JSONPatch"
-                    response["response"]["patch"] = base64_patch                    
-
-                    print("Patch:")
-                    print(json.dumps(patch, indent=2))
-
-                    print("Response:")
-                    print(json.dumps(response, indent=2))
-
-
-                # Add label and toleration to HyperPod system Pods
-                elif request["kind"]["kind"] == "Pod" and request["operation"] == "CREATE":
-
-                    print("Request:")
-                    print(json.dumps(post_data, indent=2))
-
-                    if request["namespace"] in ["aws-hyperpod"] and name.split("-")[0] in ["hardwarecheck", "dcgm", "efa", "nccl"]:
-
-                        patch = []
-
-                        # Create tolerations field if it doesn't exist.
-                        if "tolerations" not in request["object"]["spec"]:
-                            patch.append(
-                                {
-                                    "op": "add",
-                                    "path": "/spec/tolerations",
-                                    "value": []
-                                }
-                            )
-
-                        # Add a toleration
-                        patch.append(
-                            {
-                                "op": "add",
-                                "path": "/spec/tolerations/-",
-                                "value": {
-                                    "operator": "Exists",
-                                }
-                            }
-                        )
-                            
-                        # Base64 encode the patch
-                        patch_bytes = json.dumps(patch).encode('utf-8')
-                        base64_patch = base64.b64encode(patch_bytes).decode('utf-8')
-                        
-                        # Add the patch to the response
-                        response["response"]["patchType"] = "JSONPatch"
-                        response["response"]["patch"] = base64_patch                    
-
-                        print("Patch:")
-                        print(json.dumps(patch, indent=2))
-
-                    print("Response:")
-                    print(json.dumps(response, indent=2))
-
-                self._send_response(response)
-
-            except json.JSONDecodeError as e:
-
-                print("Error:", e)
-
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    'error': 'Invalid JSON data',
-                    'status': 'error'
-                }).encode())
-        else:
-            print(f"Error: unknown API path {api_path}")
+                    if is_fast_path(fields):
+                        # Most requests need no patch. Answer them without parsing the object.
+                        request = fields
+                        response, patch = None, None
+                        response_body = make_allowed_response(request["uid"])
+                    else:
+                        post_data = json.loads(body)
+                        request = post_data["request"]
+                        response, patch = mutate(post_data)
+                        response_body = json.dumps(response).encode()
 
-            self.send_response(404)
-            self.end_headers()
+                    kind = request["kind"]["kind"]
+                    operation = request["operation"]
+
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+
+                    logger.warning("Invalid admission request", extra={"fields": {"error": repr(e)}})
+
+                    self._send_body(400, json.dumps({
+                        'error': 'Invalid JSON data',
+                        'status': 'error'
+                    }).encode())
+                    return
+
+                self._send_body(200, response_body)
+                result = "patched" if patch else "allowed"
+
+            finally:
+                duration = time.perf_counter() - t0
+                metrics.end_request(kind, operation, result, duration)
+
+            log_admission(request, patch, response, duration)
+
+        else:
+            logger.warning("Unknown API path", extra={"fields": {"path": api_path}})
+
+            self._send_body(404, b'', 'text/plain')
+
+
+class PooledHTTPSServer(HTTPServer):
+    """HTTPS server handling connections in a bounded thread pool.
+
+    The TLS handshake runs in the worker thread, so a slow client doesn't block accepting other connections.
+    Between requests, keep-alive connections wait in a selector thread, and are handed to a worker again
+    only when their next request is readable. Idle connections don't hold workers, so they can't starve
+    handshakes of new connections.
+    """
+
+    request_queue_size = listen_backlog
+
+    def __init__(self, server_address, RequestHandlerClass, ssl_context, num_workers):
+        self.ssl_context = ssl_context
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="webhook")
+        self.draining = False
+        self.closing_idle = False
+        self.stopping = False
+
+        # Workers pass idle connections to the selector thread through a queue, and wake it up with a socket pair
+        self.selector = selectors.DefaultSelector()
+        self.parked = queue.SimpleQueue()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+
+        super().__init__(server_address, RequestHandlerClass)
+
+        self.idle_thread = threading.Thread(target=self.watch_idle_connections, name="webhook-idle", daemon=True)
+        self.idle_thread.start()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            request.settimeout(io_timeout)
+            request = self.ssl_context.wrap_socket(request, server_side=True)
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except (ssl.SSLError, OSError):
+            self.shutdown_request(request)
+            return
+
+        self.serve_connection(handler)
+
+    def serve_connection(self, handler):
+        """Serve the requests that are ready on a connection, then park it until the next one arrives."""
+        try:
+            while True:
+                handler.handle_one_request()
+                if handler.close_connection:
+                    break
+                if not self.has_buffered_data(handler):
+                    self.park(handler)
+                    return
+        except (ssl.SSLError, OSError):
+            pass
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+        self.close_handler(handler)
+
+    def has_buffered_data(self, handler):
+        # Data already read into the file or TLS buffers doesn't make the socket readable again
+        handler.connection.setblocking(False)
+        try:
+            return bool(handler.rfile.peek(1))
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return False
+        finally:
+            handler.connection.settimeout(handler.timeout)
+
+    def close_handler(self, handler):
+        handler.close()
+        self.shutdown_request(handler.request)
+
+    def park(self, handler):
+        self.parked.put(handler)
+        self.wake_idle_thread()
+
+    def wake_idle_thread(self):
+        try:
+            self.wakeup_writer.send(b"x")
+        except OSError:
+            pass
+
+    def watch_idle_connections(self):
+        """Selector loop of idle keep-alive connections. Only this thread registers and unregisters them."""
+
+        idle_since = {}
+
+        while not self.stopping:
+
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.fileobj is self.wakeup_reader:
+                    self.wakeup_reader.recv(4096)
+                    continue
+                handler = key.data
+                self.selector.unregister(key.fileobj)
+                del idle_since[handler]
+                try:
+                    self.executor.submit(self.serve_connection, handler)
+                except RuntimeError:
+                    # The executor is shut down
+                    self.close_handler(handler)
+
+            now = time.monotonic()
+
+            while not self.parked.empty():
+                handler = self.parked.get()
+                self.selector.register(handler.connection, selectors.EVENT_READ, handler)
+                idle_since[handler] = now
+
+            for handler, since in list(idle_since.items()):
+                if self.closing_idle or now - since >= keep_alive_timeout:
+                    self.selector.unregister(handler.connection)
+                    del idle_since[handler]
+                    self.close_handler(handler)
+
+        for handler in idle_since:
+            self.close_handler(handler)
+
+    def close_idle_connections(self):
+        # Connections that become idle later are closed too
+        self.closing_idle = True
+        self.wake_idle_thread()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        self.stopping = True
+        self.wake_idle_thread()
+        self.idle_thread.join()
+        while not self.parked.empty():
+            self.close_handler(self.parked.get())
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
 
 
 def run_server(host='0.0.0.0', port=8443):
     server_address = (host, port)
-    httpd = HTTPServer(server_address, APIHandler)
-    
+
     # SSL context configuration
     ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     ssl_context.load_cert_chain(
         certfile = os.path.join(cert_dirname, "tls.crt"),
         keyfile = os.path.join(cert_dirname, "tls.key"),
     )
-    
-    # Wrap the socket with SSL
-    httpd.socket = ssl_context.wrap_socket(httpd.socket, server_side=True)
-    
-    print(f'Starting secure server on {host}:{port}')
-    httpd.serve_forever()
+
+    httpd = PooledHTTPSServer(server_address, APIHandler, ssl_context, num_workers)
+
+    rule_loader.start()
+
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        stop_event.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info("Starting secure server", extra={"fields": {"host": host, "port": port, "workers": num_workers, "backlog": listen_backlog}})
+    server_thread = threading.Thread(target=httpd.serve_forever)
+    server_thread.start()
+
+    stop_event.wait()
+
+    # Graceful shutdown: fail readiness first, stop accepting, then let in-flight requests finish
+    logger.info("Shutting down", extra={"fields": {"grace_seconds": shutdown_grace_seconds}})
+    httpd.draining = True
+    time.sleep(shutdown_grace_seconds)
+    httpd.shutdown()
+    server_thread.join()
+    httpd.close_idle_connections()
+    httpd.server_close()
+    logger.info("Stopped")
 
 
 if __name__ == '__main__':
@@ -1,13 +1,276 @@
 import os
 import ssl
 import json
+import time
 import pprint
+import threading
+import http.client
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, quote
 
 
 #cert_dirname = os.path.dirname(__file__)
-cert_dirname = "/certs"
+if os.path.exists("./certs"):
+    cert_dirname = "./certs"
+else:
+    cert_dirname = "/certs"
+
+# Group policy (JSON), typically a ConfigMap mounted as a volume. The built-in policy is used if the file doesn't exist.
+if os.path.exists("./policy.json"):
+    policy_filename = os.environ.get("WEBHOOK_POLICY_FILE", "./policy.json")
+else:
+    policy_filename = os.environ.get("WEBHOOK_POLICY_FILE", "/config/policy.json")
+
+# ConfigMap holding the namespace / team ownership map, in the namespace of the webhook. Empty to disable.
+ownership_configmap_name = os.environ.get("WEBHOOK_OWNERSHIP_CONFIGMAP", "")
+ownership_configmap_key = "owners.json"
+
+# Length of a single watch request to the API server, in seconds
+watch_timeout_seconds = 300
+
+serviceaccount_dirname = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+# Number of distinct group lists to remember decisions for
+group_cache_size = 4096
+
+
+default_policy = {
+    # Kinds to validate. Other kinds are allowed.
+    "kinds": ["Pod", "Deployment"],
+
+    # Operations allowed to everyone
+    "allowedOperations": ["CREATE"],
+
+    # Groups allowed everything
+    "allowedGroups": ["dynamic-admission:admin"],
+
+    # Groups starting with these prefixes are allowed everything
+    "allowedGroupPrefixes": ["system:"],
+
+    # Groups that never allow anything by allowedGroups / allowedGroupPrefixes
+    "ignoredGroups": ["system:authenticated"],
+
+    # Labels holding the owner of an object, a user name or a team of the ownership map. The first label found is used.
+    "ownerLabels": ["dynamic-admission-owner"],
+}
+
+
+def load_policy(filename):
+    policy = dict(default_policy)
+    if filename and os.path.exists(filename):
+        with open(filename) as f:
+            policy.update(json.load(f))
+    return policy
+
+
+class PrefixTrie:
+    """Set of prefixes, to find the prefix of a string in one pass over the string"""
+
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        node = self.root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        # Keys are single characters, so "" marks the end of a prefix
+        node[""] = prefix
+
+    def find_prefix(self, s):
+        node = self.root
+        for c in s:
+            if "" in node:
+                return node[""]
+            node = node.get(c)
+            if node is None:
+                return None
+        return node.get("")
+
+
+class GroupPolicy:
+    """Policy configuration, compiled into sets and a prefix trie once at startup"""
+
+    def __init__(self, policy):
+        self.kinds = set(policy["kinds"])
+        self.allowed_operations = set(policy["allowedOperations"])
+        self.allowed_groups = set(policy["allowedGroups"])
+        self.allowed_group_prefixes = PrefixTrie(policy["allowedGroupPrefixes"])
+        self.ignored_groups = set(policy["ignoredGroups"])
+        self.owner_labels = list(policy["ownerLabels"])
+        self.group_cache = {}
+
+    def find_allowed_group(self, groups):
+        """Return the group that allows everything, or None.
+
+        Users in a cluster share a few distinct group lists, so decisions are cached per group list.
+        """
+
+        key = tuple(groups)
+        if key in self.group_cache:
+            return self.group_cache[key]
+
+        allowed_group = None
+        for group in groups:
+            if group in self.ignored_groups:
+                continue
+            if group in self.allowed_groups or self.allowed_group_prefixes.find_prefix(group) is not None:
+                allowed_group = group
+                break
+
+        if len(self.group_cache) >= group_cache_size:
+            self.group_cache.clear()
+        self.group_cache[key] = allowed_group
+
+        return allowed_group
+
+    def get_owner(self, obj):
+        labels = ((obj or {}).get("metadata") or {}).get("labels") or {}
+        for owner_label in self.owner_labels:
+            if owner_label in labels:
+                return labels[owner_label]
+        return None
+
+
+class OwnershipMap:
+    """Namespace and team ownership, from the "owners.json" key of the ownership ConfigMap
+
+    {
+        "teams": {
+            "ml-research": {"users": ["user1", "user2"], "groups": ["ml-research-admins"]}
+        },
+        "namespaces": {
+            "ml-research": "ml-research",
+            "sandbox-user3": "user3"
+        }
+    }
+
+    Owners (of namespaces, or in owner labels) are user names, or team names.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.teams = {
+            name: (frozenset(team.get("users", [])), frozenset(team.get("groups", [])))
+            for name, team in data.get("teams", {}).items()
+        }
+        self.namespace_owners = dict(data.get("namespaces", {}))
+
+    def get_namespace_owner(self, namespace):
+        return self.namespace_owners.get(namespace)
+
+    def is_owner(self, owner, username, groups):
+        if owner == username:
+            return True
+        team = self.teams.get(owner)
+        if team is None:
+            return False
+        team_users, team_groups = team
+        return username in team_users or not team_groups.isdisjoint(groups)
+
+
+class OwnershipMapWatcher:
+    """Keeps the ownership map up to date, by watching the ownership ConfigMap through the Kubernetes API.
+
+    The map is replaced as a whole on each change, so requests always see a consistent map.
+    Until the ConfigMap is read successfully for the first time, synced is False.
+    """
+
+    def __init__(self, configmap_name):
+        self.configmap_name = configmap_name
+        self.ownership_map = OwnershipMap()
+        self.synced = not configmap_name
+
+    def connect(self, timeout):
+        ssl_context = ssl.create_default_context(cafile=os.path.join(serviceaccount_dirname, "ca.crt"))
+        return http.client.HTTPSConnection(
+            os.environ["KUBERNETES_SERVICE_HOST"],
+            int(os.environ.get("KUBERNETES_SERVICE_PORT", "443")),
+            context=ssl_context,
+            timeout=timeout,
+        )
+
+    def get(self, connection, path):
+        # The token is rotated by the kubelet, so read it for each request
+        with open(os.path.join(serviceaccount_dirname, "token")) as f:
+            token = f.read().strip()
+        connection.request("GET", path, headers={"Authorization": f"Bearer {token}", "Accept": "application/json"})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise http.client.HTTPException(f"GET {path} failed: {response.status} {response.read()[:200]}")
+        return response
+
+    def apply(self, configmap):
+        if configmap is None:
+            self.ownership_map = OwnershipMap()
+            self.synced = True
+            print(f"Ownership ConfigMap {self.configmap_name} doesn't exist, using an empty ownership map")
+            return
+        try:
+            data = json.loads(configmap.get("data", {}).get(ownership_configmap_key, "{}"))
+            ownership_map = OwnershipMap(data)
+        except (ValueError, AttributeError, TypeError) as e:
+            print(f"Invalid ownership ConfigMap {self.configmap_name}, keeping the previous ownership map: {e}")
+            return
+        self.ownership_map = ownership_map
+        self.synced = True
+        print(f"Ownership map updated: {len(ownership_map.teams)} teams, {len(ownership_map.namespace_owners)} namespaces")
+
+    def list_and_watch(self, namespace):
+
+        path = f"/api/v1/namespaces/{namespace}/configmaps?fieldSelector={quote('metadata.name=' + self.configmap_name)}"
+
+        connection = self.connect(timeout=30)
+        try:
+            configmap_list = json.load(self.get(connection, path))
+        finally:
+            connection.close()
+
+        items = configmap_list.get("items") or []
+        self.apply(items[0] if items else None)
+        resource_version = configmap_list["metadata"]["resourceVersion"]
+
+        # The API server ends a watch after timeoutSeconds, then it's started again from the last resourceVersion
+        while True:
+            connection = self.connect(timeout=watch_timeout_seconds + 30)
+            try:
+                response = self.get(connection, f"{path}&watch=true&allowWatchBookmarks=true&timeoutSeconds={watch_timeout_seconds}&resourceVersion={resource_version}")
+                for line in response:
+                    event = json.loads(line)
+                    if event["type"] == "ERROR":
+                        # e.g. 410 Gone, when the resourceVersion is too old. List again.
+                        print(f"Ownership ConfigMap watch error: {event['object'].get('message')}")
+                        return
+                    resource_version = event["object"]["metadata"]["resourceVersion"]
+                    if event["type"] in ("ADDED", "MODIFIED"):
+                        self.apply(event["object"])
+                    elif event["type"] == "DELETED":
+                        self.apply(None)
+            finally:
+                connection.close()
+
+    def run(self):
+
+        with open(os.path.join(serviceaccount_dirname, "namespace")) as f:
+            namespace = f.read().strip()
+
+        retry_interval = 1
+        while True:
+            try:
+                self.list_and_watch(namespace)
+                retry_interval = 1
+            except (OSError, ValueError, KeyError, http.client.HTTPException) as e:
+                print(f"Ownership ConfigMap watch failed, retrying in {retry_interval} sec: {e}")
+                time.sleep(retry_interval)
+                retry_interval = min(retry_interval * 2, 60)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+group_policy = GroupPolicy(load_policy(policy_filename))
+ownership_watcher = OwnershipMapWatcher(ownership_configmap_name)
 
 
 class APIHandler(BaseHTTPRequestHandler):
@@ -33,42 +296,42 @@ class APIHandler(BaseHTTPRequestHandler):
         print(f"Operation: {operation}, Kind: {kind}")
 
         # Allow unknown kinds
-        if kind["kind"] not in ["Pod", "Deployment"]:
+        if kind["kind"] not in group_policy.kinds:
             print("Ignoring unknown kinds:", kind["kind"])
             return True, 200, ""
 
-        # Allow all groups that start with "system:" prefix (except for system:authenticated).
-        # Allow "dynamic-admission:admin" group.
-        for group in api_invoker_groups:
-            if group in ["system:authenticated"]:
-                continue
-            if group.startswith("system:") or group == "dynamic-admission:admin":
-                print(f"Allowing by group: {group}")
-                return True, 200, ""
+        # Allow groups in allowedGroups, or starting with allowedGroupPrefixes (e.g. "system:"), except for ignoredGroups (e.g. "system:authenticated").
+        allowed_group = group_policy.find_allowed_group(api_invoker_groups)
+        if allowed_group is not None:
+            print(f"Allowing by group: {allowed_group}")
+            return True, 200, ""
 
-        # Allow all resource creation operations.
-        if operation in ["CREATE"]:
+        # Allow operations in allowedOperations (e.g. resource creation)
+        if operation in group_policy.allowed_operations:
             print(f"Allowing operation {operation}")
             return True, 200, ""
 
-        # Get target object information
-        if operation in ["UPDATE", "DELETE", "CONNECT"]:
+        # Get target object information. For CONNECT, the object is the connect options (e.g. PodExecOptions).
+        if operation in ["UPDATE", "DELETE"]:
             obj = req["oldObject"]
-        elif operation in ["CONNECT"]:
-            obj = req["object"]
+        else:
+            obj = req.get("object")
 
-        # Get owner information from labels
-        try:
-            obj_owner = obj["metadata"]["labels"]["dynamic-admission-owner"]
-        except KeyError:
-            obj_owner = None
+        # Get owner information from labels, or from the namespace ownership
+        ownership_map = ownership_watcher.ownership_map
+        obj_owner = group_policy.get_owner(obj)
+        if obj_owner is None:
+            # Before the ownership map is read, the namespace owner is unknown. Deny, rather than allow as unowned.
+            if not ownership_watcher.synced:
+                return False, 503, "Ownership map is not loaded yet, try again later"
+            obj_owner = ownership_map.get_namespace_owner(req.get("namespace"))
 
-        # If owner information is missing in the object, allow everything
+        # If owner information is missing, allow everything
         if obj_owner is None:
             print(f"Allowing {operation} operation to resources without dynamic admission owner")
             return True, 200, ""
 
-        if obj_owner != api_invoker_username:
+        if not ownership_map.is_owner(obj_owner, api_invoker_username, api_invoker_groups):
             return False, 403, f"Forbidden access to resource owned by different user (owner:{obj_owner} != you:{api_invoker_username})"
 
         print(f"Allowing {operation} operation to resources owned by the API invoker ({api_invoker_username})")
@@ -148,6 +411,9 @@ def run_server(host='0.0.0.0', port=8443):
     # Wrap the socket with SSL
     httpd.socket = ssl_context.wrap_socket(httpd.socket, server_side=True)
     
+    if ownership_configmap_name:
+        ownership_watcher.start()
+
     print(f'Starting secure server on {host}:{port}')
     httpd.serve_forever()
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of lambda_function cold start and per-invocation latency.
+
+SES calls are answered locally by a botocore "before-send" hook, so no email is sent
+and no AWS credentials are needed. Compares:
+  - creating the SES client on every invocation (before) vs reusing it (after)
+  - HTML rendering with string concatenation (before) vs the compiled templates (after)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Dummy settings so boto3 can build clients without a real AWS environment
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("SENDER_EMAIL_ADDRESS", "sender@example.com")
+os.environ.setdefault("RECEIVER_EMAIL_ADDRESS", "receiver@example.com")
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+import lambda_function
+
+
+class _FakeRawResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+_SEND_EMAIL_RESPONSE = (
+    b'<SendEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+    b'<SendEmailResult><MessageId>benchmark</MessageId></SendEmailResult>'
+    b'<ResponseMetadata><RequestId>benchmark</RequestId></ResponseMetadata>'
+    b'</SendEmailResponse>'
+)
+
+
+def fake_ses_send(request, **kwargs):
+    return AWSResponse(request.url, 200, {}, _FakeRawResponse(_SEND_EMAIL_RESPONSE))
+
+
+def install_fake_ses():
+    # Registered on the default session, so every client created by boto3.client() gets it
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register("before-send.ses", fake_ses_send)
+
+
+def legacy_format_html_for_node_health_event(event):
+    """The string concatenation version of format_html_for_node_health_event, as a baseline."""
+
+    html_body = '<body style="font-family:Helvetica; font-size: 11pt;">\n'
+    html_body += '<table>\n'
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("AWS account:", event["account"])
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("Region:", event["region"])
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("Cluster name:", event["detail"]["ClusterName"])
+    html_body += '</table>\n'
+    html_body += "<br>\n"
+    html_body += '<table border="1" >\n'
+    html_body += '<caption>Instance health info</caption>\n'
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("Instance ID", event["detail"]["InstanceId"])
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("Health Status", event["detail"]["HealthSummary"]["HealthStatus"])
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("Health Status Reason", event["detail"]["HealthSummary"]["HealthStatusReason"])
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("RepairAction", event["detail"]["HealthSummary"]["RepairAction"])
+    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % ("Recommendation", event["detail"]["HealthSummary"]["Recommendation"])
+    html_body += '</table>\n'
+    html_body += "<br>\n"
+    html_body += '<a href="%s">Link to HyperPod console</a>\n' % lambda_function.get_console_url(event)
+    html_body += "</body>"
+    return html_body
+
+
+def measure(func, iterations):
+    latencies = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies)-1, int(len(latencies) * 0.99))] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def measure_cold_start(event_file, iterations):
+    """Import the module and run the first invocation in a fresh interpreter, like a Lambda cold start."""
+
+    code = (
+        "import time, json, sys\n"
+        "t0 = time.perf_counter()\n"
+        "import benchmark_lambda\n"
+        "benchmark_lambda.install_fake_ses()\n"
+        "t1 = time.perf_counter()\n"
+        f"event = json.load(open({event_file!r}))\n"
+        "benchmark_lambda.lambda_function.lambda_handler(event, None)\n"
+        "t2 = time.perf_counter()\n"
+        "print(json.dumps([t1 - t0, t2 - t1]))\n"
+    )
+
+    imports = []
+    first_invocations = []
+    for _ in range(iterations):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        t_import, t_first = json.loads(output.strip().splitlines()[-1])
+        imports.append(t_import)
+        first_invocations.append(t_first)
+
+    return statistics.median(imports) * 1000, statistics.median(first_invocations) * 1000
+
+
+def print_result(name, result):
+    print(f"{name:<45} p50={result['p50_ms']:8.3f} ms  p99={result['p99_ms']:8.3f} ms  mean={result['mean_ms']:8.3f} ms")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Micro-benchmark of the HyperPod events Lambda function")
+    argparser.add_argument('--test-event-file', action="store", default="test_events/node_health_event.json", help='Test event JSON file')
+    argparser.add_argument('--iterations', action="store", type=int, default=200, help='Number of warm invocations')
+    argparser.add_argument('--cold-start-iterations', action="store", type=int, default=5, help='Number of cold starts (fresh interpreters)')
+    args = argparser.parse_args()
+
+    with open(args.test_event_file) as fd:
+        event = json.load(fd)
+
+    install_fake_ses()
+
+    # Cold start
+    t_import, t_first = measure_cold_start(os.path.abspath(args.test_event_file), args.cold_start_iterations)
+    print(f"{'Cold start: import':<45} p50={t_import:8.3f} ms")
+    print(f"{'Cold start: first invocation':<45} p50={t_first:8.3f} ms")
+
+    # Per-invocation latency
+    def invoke_with_new_client():
+        lambda_function.reset_clients()
+        lambda_function.lambda_handler(event, None)
+
+    def invoke_with_reused_client():
+        lambda_function.lambda_handler(event, None)
+
+    print_result("Invocation, new SES client each time (before)", measure(invoke_with_new_client, args.iterations))
+    lambda_function.reset_clients()
+    print_result("Invocation, reused SES client (after)", measure(invoke_with_reused_client, args.iterations))
+
+    # Rendering only
+    if event["detail-type"] == lambda_function.EVENT_TYPE_NODE_HEALTH:
+        print_result("Render, string concatenation (before)", measure(lambda: legacy_format_html_for_node_health_event(event), args.iterations * 50))
+    print_result("Render, compiled templates (after)", measure(lambda: lambda_function.format_email_for_event(event)[1], args.iterations * 50))
+
+
+if __name__ == "__main__":
+    main()
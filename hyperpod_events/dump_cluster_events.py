@@ -2,32 +2,54 @@
 """
 Utility script to dump all HyperPod cluster events.
 Use this to see variations of EventDetails and decide how to implement email formatting code.
+
+With --incremental, events are appended to a JSONL file, and a checkpoint of the
+last exported event time is kept next to it. Repeat runs fetch only newer events,
+and memory use doesn't grow with the number of events.
 """
+import os
 import json
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import boto3
 
 
-def list_cluster_events_all(sagemaker_client, cluster_name):
-    """List all events for a given cluster with pagination."""
-    events = []
+# Events in this window before the checkpoint are fetched again and de-duplicated by EventId,
+# so events sharing a timestamp with the last exported event are not lost.
+CHECKPOINT_OVERLAP = timedelta(seconds=1)
+
+
+def iter_cluster_events_pages(sagemaker_client, cluster_name, event_time_after=None):
+    """Yield pages (lists) of events for a given cluster, oldest first."""
     next_token = None
     
     while True:
-        params = {"ClusterName": cluster_name}
+        params = {
+            "ClusterName": cluster_name,
+            "SortBy": "EventTime",
+            "SortOrder": "Ascending",
+            "MaxResults": 100,
+        }
+        if event_time_after:
+            params["EventTimeAfter"] = event_time_after
         if next_token:
             params["NextToken"] = next_token
         
         response = sagemaker_client.list_cluster_events(**params)
-        events += response["Events"]
+        yield response["Events"]
         
         if "NextToken" in response and response["NextToken"]:
             next_token = response["NextToken"]
             continue
         break
-    
+
+
+def list_cluster_events_all(sagemaker_client, cluster_name):
+    """List all events for a given cluster with pagination."""
+    events = []
+    for page in iter_cluster_events_pages(sagemaker_client, cluster_name):
+        events += page
     return events
 
 
@@ -38,6 +60,82 @@ def datetime_converter(obj):
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
 
+def load_checkpoint(checkpoint_filename, cluster_name):
+    if not os.path.exists(checkpoint_filename):
+        return None
+
+    with open(checkpoint_filename) as f:
+        checkpoint = json.load(f)
+
+    if checkpoint["ClusterName"] != cluster_name:
+        raise ValueError(f"Checkpoint {checkpoint_filename} is for cluster {checkpoint['ClusterName']}, not {cluster_name}")
+
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_filename, checkpoint):
+    # Write to a temporary file and rename, so a crash never leaves a broken checkpoint
+    tmp_filename = checkpoint_filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, checkpoint_filename)
+
+
+def export_incremental(sagemaker_client, cluster_name, output_filename, checkpoint_filename):
+    """Append events newer than the checkpoint to a JSONL file, one page at a time."""
+
+    checkpoint = load_checkpoint(checkpoint_filename, cluster_name)
+
+    if checkpoint:
+        last_event_time = datetime.fromisoformat(checkpoint["LastEventTime"])
+        recent_events = { event_id: datetime.fromisoformat(t) for event_id, t in checkpoint["RecentEvents"].items() }
+        event_time_after = last_event_time - CHECKPOINT_OVERLAP
+        print(f"Resuming from checkpoint: {checkpoint['LastEventTime']}", flush=True)
+    else:
+        last_event_time = None
+        recent_events = {}
+        event_time_after = None
+        print("No checkpoint. Exporting all events.", flush=True)
+
+    num_exported = 0
+
+    with open(output_filename, "a") as f:
+
+        for page in iter_cluster_events_pages(sagemaker_client, cluster_name, event_time_after):
+
+            new_events = [ event for event in page if event["EventId"] not in recent_events ]
+            if not new_events:
+                continue
+
+            for event in new_events:
+                f.write(json.dumps(event, default=datetime_converter) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+            for event in new_events:
+                recent_events[event["EventId"]] = event["EventTime"]
+                if last_event_time is None or event["EventTime"] > last_event_time:
+                    last_event_time = event["EventTime"]
+
+            # Keep only the IDs inside the overlap window, so the checkpoint stays small
+            recent_events = {
+                event_id: t for event_id, t in recent_events.items() if t >= last_event_time - CHECKPOINT_OVERLAP
+            }
+
+            save_checkpoint(checkpoint_filename, {
+                "ClusterName": cluster_name,
+                "LastEventTime": last_event_time.isoformat(),
+                "RecentEvents": { event_id: t.isoformat() for event_id, t in sorted(recent_events.items()) },
+            })
+
+            num_exported += len(new_events)
+            print(f"Exported {num_exported} events (up to {last_event_time.isoformat()})", flush=True)
+
+    print(f"Exported {num_exported} new events to: {output_filename}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Dump all HyperPod cluster events to analyze EventDetails variations"
@@ -61,12 +159,29 @@ def main():
         action="store_true",
         help="Pretty print JSON output"
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Append only events newer than the checkpoint to --output as JSONL"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Checkpoint file for --incremental (default: <output>.checkpoint.json)"
+    )
     
     args = parser.parse_args()
     
     # Create SageMaker client
     sagemaker_client = boto3.client("sagemaker", region_name=args.region)
     
+    if args.incremental:
+        if not args.output:
+            parser.error("--incremental requires --output")
+        checkpoint_filename = args.checkpoint or args.output + ".checkpoint.json"
+        print(f"Fetching new events for cluster: {args.cluster_name}...", flush=True)
+        export_incremental(sagemaker_client, args.cluster_name, args.output, checkpoint_filename)
+        return
+    
     # Fetch all events
     print(f"Fetching events for cluster: {args.cluster_name}...", flush=True)
     events = list_cluster_events_all(sagemaker_client, args.cluster_name)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Local analytics index over exported HyperPod cluster events.
+
+Loads events exported by dump_cluster_events.py (the JSON dump, or the JSONL of
+--incremental) into a SQLite database indexed by time, resource type, instance
+group and instance ID, and runs canned queries on it.
+
+Examples:
+    python3 index_cluster_events.py load --db events.db events.jsonl
+    python3 index_cluster_events.py events-per-node --db events.db --bucket day
+    python3 index_cluster_events.py flapping --db events.db --window-hours 24 --min-events 6
+    python3 index_cluster_events.py mtbr --db events.db
+    python3 index_cluster_events.py query --db events.db "SELECT kind, COUNT(*) FROM events GROUP BY kind"
+"""
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    event_id TEXT PRIMARY KEY,
+    cluster_name TEXT,
+    resource_type TEXT,
+    instance_group TEXT,
+    instance_id TEXT,
+    event_time INTEGER NOT NULL,  -- epoch milliseconds
+    event_level TEXT,
+    kind TEXT NOT NULL,
+    description TEXT,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_time ON events (event_time);
+CREATE INDEX IF NOT EXISTS idx_events_resource_type ON events (resource_type, event_time);
+CREATE INDEX IF NOT EXISTS idx_events_instance_group ON events (instance_group, event_time);
+-- Covers the per-node window queries, so they don't touch the table rows
+CREATE INDEX IF NOT EXISTS idx_events_instance_id ON events (instance_id, event_time, kind, instance_group);
+CREATE INDEX IF NOT EXISTS idx_events_kind ON events (kind, instance_group, event_time);
+"""
+
+# Event kinds, classified from the description at load time so queries don't need LIKE scans.
+# The first matching pattern wins.
+KIND_PATTERNS = [
+    ("lcs_started", re.compile(r"lifecycle script execution .* has Started")),
+    ("lcs_succeeded", re.compile(r"lifecycle script execution .* has Succeeded")),
+    ("lcs_failed", re.compile(r"lifecycle script execution .* has Failed")),
+    ("instance_provisioned", re.compile(r"EC2 Instance \S+ successfully provisioned")),
+    ("instance_provision_failed", re.compile(r"Failed to provision EC2 Instance|Instance creation .* failed")),
+    ("instance_terminated", re.compile(r"EC2 Instance \S* ?successfully terminated")),
+    ("instance_created", re.compile(r"Instance \S+ creation .* completed")),
+    ("instance_deleted", re.compile(r"Instance \S+ deletion .* completed")),
+    ("reboot", re.compile(r"[Rr]eboot")),
+    ("replace", re.compile(r"[Rr]eplace")),
+    ("scaling", re.compile(r"scaling")),
+]
+
+# Kinds that count as a node replacement, for mean time between replacements
+REPLACEMENT_KINDS = ("instance_terminated",)
+
+
+def classify(description):
+    for kind, pattern in KIND_PATTERNS:
+        if pattern.search(description or ""):
+            return kind
+    return "other"
+
+
+def to_epoch_ms(event_time):
+    if isinstance(event_time, (int, float)):
+        return int(event_time)
+    dt = datetime.fromisoformat(event_time)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def format_epoch_ms(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def iter_events_from_file(filename):
+    """Yield events from a dump_cluster_events.py JSON dump, or from its JSONL export."""
+
+    with open(filename) as f:
+        first = f.read(1)
+        f.seek(0)
+
+        if first == "{":
+            # Either a JSON dump ({"Events": [...]}) or JSONL. JSONL lines are complete objects.
+            line = f.readline()
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                obj = None
+
+            if obj is not None and "EventId" in obj:
+                yield obj
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+                return
+
+            f.seek(0)
+            yield from json.load(f)["Events"]
+        else:
+            yield from json.load(f)
+
+
+def open_db(filename):
+    conn = sqlite3.connect(filename)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def cmd_load(args):
+
+    conn = open_db(args.db)
+
+    num_events = 0
+    for filename in args.inputs:
+        rows = []
+        for event in iter_events_from_file(filename):
+            rows.append((
+                event["EventId"],
+                event.get("ClusterName"),
+                event.get("ResourceType"),
+                event.get("InstanceGroupName"),
+                event.get("InstanceId"),
+                to_epoch_ms(event["EventTime"]),
+                event.get("EventLevel"),
+                classify(event.get("Description")),
+                event.get("Description"),
+                json.dumps(event),
+            ))
+            if len(rows) >= 10000:
+                num_events += insert_rows(conn, rows)
+                rows = []
+        num_events += insert_rows(conn, rows)
+
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    total = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    print(f"Loaded {num_events} events. {total} events in {args.db}")
+
+
+def insert_rows(conn, rows):
+    # Re-loading the same export is idempotent, keyed by EventId
+    conn.executemany("INSERT OR REPLACE INTO events VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+    return len(rows)
+
+
+def time_range_clause(args, params):
+    clauses = []
+    if args.since:
+        clauses.append("event_time >= ?")
+        params.append(to_epoch_ms(args.since))
+    if args.until:
+        clauses.append("event_time < ?")
+        params.append(to_epoch_ms(args.until))
+    if getattr(args, "instance_group", None):
+        clauses.append("instance_group = ?")
+        params.append(args.instance_group)
+    return (" AND " + " AND ".join(clauses)) if clauses else ""
+
+
+def run_query(conn, sql, params=()):
+    t0 = time.perf_counter()
+    cursor = conn.execute(sql, params)
+    rows = cursor.fetchall()
+    elapsed = time.perf_counter() - t0
+    columns = [ d[0] for d in cursor.description ] if cursor.description else []
+    return columns, rows, elapsed
+
+
+def print_table(columns, rows, elapsed):
+    widths = [ max([len(str(c))] + [ len(str(row[i])) for row in rows ]) for i, c in enumerate(columns) ]
+    print("  ".join( str(c).ljust(w) for c, w in zip(columns, widths) ))
+    for row in rows:
+        print("  ".join( str(v).ljust(w) for v, w in zip(row, widths) ))
+    print(f"({len(rows)} rows, {elapsed*1000:.1f} ms)")
+
+
+def cmd_events_per_node(args):
+
+    conn = open_db(args.db)
+    bucket_ms = {"hour": 3600 * 1000, "day": 86400 * 1000}[args.bucket]
+
+    params = [bucket_ms, bucket_ms]
+    sql = f"""
+        SELECT instance_id, (event_time / ?) * ? AS bucket, COUNT(*) AS events
+        FROM events
+        WHERE instance_id IS NOT NULL AND instance_id != '' {time_range_clause(args, params)}
+        GROUP BY instance_id, bucket
+        ORDER BY instance_id, bucket
+    """
+    columns, rows, elapsed = run_query(conn, sql, params)
+    rows = [ (instance_id, format_epoch_ms(bucket), count) for instance_id, bucket, count in rows ]
+    print_table(["instance_id", args.bucket, "events"], rows, elapsed)
+
+
+def cmd_flapping(args):
+    """Nodes with at least --min-events events of the given kinds within any --window-hours window."""
+
+    conn = open_db(args.db)
+    window_ms = int(args.window_hours * 3600 * 1000)
+    kinds = [ kind.strip() for kind in args.kinds.split(",") if kind.strip() ]
+
+    params = list(kinds)
+    # Window frame bounds must be constants in SQLite, window_ms is an int so it's safe to inline
+    sql = f"""
+        WITH windowed AS (
+            SELECT instance_id, instance_group, event_time,
+                COUNT(*) OVER (
+                    PARTITION BY instance_id ORDER BY event_time
+                    RANGE BETWEEN CURRENT ROW AND {window_ms} FOLLOWING
+                ) AS events_in_window
+            FROM events
+            WHERE instance_id IS NOT NULL AND instance_id != ''
+                AND kind IN ({",".join("?" * len(kinds))}) {time_range_clause(args, params)}
+        )
+        SELECT instance_id, instance_group, MAX(events_in_window) AS max_events_in_window,
+            MIN(event_time) AS first_event, MAX(event_time) AS last_event
+        FROM windowed
+        GROUP BY instance_id
+        HAVING max_events_in_window >= ?
+        ORDER BY max_events_in_window DESC
+    """
+    params.append(args.min_events)
+
+    columns, rows, elapsed = run_query(conn, sql, params)
+    rows = [ (i, g, n, format_epoch_ms(t0), format_epoch_ms(t1)) for i, g, n, t0, t1 in rows ]
+    print_table(columns, rows, elapsed)
+
+
+def cmd_mtbr(args):
+    """Mean time between replacement events, per instance group."""
+
+    conn = open_db(args.db)
+
+    params = list(REPLACEMENT_KINDS)
+    sql = f"""
+        WITH replacements AS (
+            SELECT cluster_name, instance_group, event_time,
+                event_time - LAG(event_time) OVER (PARTITION BY cluster_name, instance_group ORDER BY event_time) AS interval_ms
+            FROM events
+            WHERE kind IN ({",".join("?" * len(REPLACEMENT_KINDS))}) {time_range_clause(args, params)}
+        )
+        SELECT cluster_name, instance_group, COUNT(*) AS replacements,
+            ROUND(AVG(interval_ms) / 3600000.0, 2) AS mean_hours_between,
+            ROUND(MIN(interval_ms) / 3600000.0, 2) AS min_hours_between,
+            MAX(event_time) AS last_replacement
+        FROM replacements
+        GROUP BY cluster_name, instance_group
+        ORDER BY mean_hours_between
+    """
+    columns, rows, elapsed = run_query(conn, sql, params)
+    rows = [ (c, g, n, mean, mn, format_epoch_ms(last)) for c, g, n, mean, mn, last in rows ]
+    print_table(columns, rows, elapsed)
+
+
+def cmd_query(args):
+    conn = open_db(args.db)
+    print_table(*run_query(conn, args.sql))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index exported HyperPod cluster events in SQLite, and run canned queries")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p, time_filter=True):
+        p.add_argument("--db", default="events.db", help="SQLite database (default: events.db)")
+        if time_filter:
+            p.add_argument("--since", help="Only events at or after this time (ISO 8601)")
+            p.add_argument("--until", help="Only events before this time (ISO 8601)")
+            p.add_argument("--instance-group", help="Only events of this instance group")
+
+    p = subparsers.add_parser("load", help="Load exported events (JSON dump or JSONL)")
+    add_common(p, time_filter=False)
+    p.add_argument("inputs", nargs="+", help="Files written by dump_cluster_events.py")
+    p.set_defaults(func=cmd_load)
+
+    p = subparsers.add_parser("events-per-node", help="Number of events per node over time")
+    add_common(p)
+    p.add_argument("--bucket", choices=["hour", "day"], default="day", help="Time bucket")
+    p.set_defaults(func=cmd_events_per_node)
+
+    p = subparsers.add_parser("flapping", help="Nodes with many lifecycle events in a short window")
+    add_common(p)
+    p.add_argument("--window-hours", type=float, default=24, help="Sliding window length in hours")
+    p.add_argument("--min-events", type=int, default=6, help="Minimum number of events in a window")
+    p.add_argument("--kinds", default="lcs_started,lcs_failed,instance_provisioned,instance_terminated,reboot,replace",
+                   help="Comma separated event kinds to count")
+    p.set_defaults(func=cmd_flapping)
+
+    p = subparsers.add_parser("mtbr", help="Mean time between replacement events, per instance group")
+    add_common(p)
+    p.set_defaults(func=cmd_mtbr)
+
+    p = subparsers.add_parser("query", help="Run an arbitrary SQL query on the events table")
+    add_common(p, time_filter=False)
+    p.add_argument("sql", help="SQL query")
+    p.set_defaults(func=cmd_query)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
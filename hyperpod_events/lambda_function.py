@@ -1,7 +1,81 @@
 import os
+import re
+import html
 import json
+import time
+import string
+import threading
+import urllib.request
+import concurrent.futures
 from datetime import datetime
 import boto3
+from botocore.config import Config
+
+# Events in the same cluster, of the same type, within this many seconds are sent as one digest email
+# when the function receives a batch of events from SQS.
+DIGEST_WINDOW_SECONDS = int(os.environ.get("DIGEST_WINDOW_SECONDS", "300"))
+
+EVENT_TYPE_CLUSTER_STATE_CHANGE = "SageMaker HyperPod Cluster State Change"
+EVENT_TYPE_NODE_HEALTH = "SageMaker HyperPod Cluster Node Health Event"
+EVENT_TYPE_CLUSTER_EVENT = "SageMaker HyperPod Cluster Event"
+
+# State cache for suppressing repeated notifications: "none", "dynamodb" or "file".
+STATE_STORE = os.environ.get("STATE_STORE", "none")
+STATE_TABLE_NAME = os.environ.get("STATE_TABLE_NAME", "")
+STATE_FILE = os.environ.get("STATE_FILE", "/tmp/hyperpod_events_state.json")
+
+# The same state is notified again only after this many seconds.
+STATE_SUPPRESSION_TTL_SECONDS = int(os.environ.get("STATE_SUPPRESSION_TTL_SECONDS", "3600"))
+
+# A state is claimed as "pending" before delivery, and marked "sent" after it. A pending claim older than
+# this is from an invocation that died during delivery, and doesn't suppress anything.
+STATE_CLAIM_TIMEOUT_SECONDS = int(os.environ.get("STATE_CLAIM_TIMEOUT_SECONDS", "300"))
+
+# Notification channels: comma separated list of "ses", "sns" and "webhook".
+# By default, every channel that has its settings is used.
+NOTIFICATION_CHANNELS = os.environ.get("NOTIFICATION_CHANNELS", "")
+SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN", "")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_FORMAT = os.environ.get("WEBHOOK_FORMAT", "slack") # "slack", "chime" or "json"
+
+# Each delivery attempt is bounded by the timeout, and retried with exponential backoff.
+# Channels are delivered concurrently, so a slow channel doesn't delay the others.
+CHANNEL_TIMEOUT_SECONDS = float(os.environ.get("CHANNEL_TIMEOUT_SECONDS", "5"))
+CHANNEL_MAX_RETRIES = int(os.environ.get("CHANNEL_MAX_RETRIES", "2"))
+
+# Services of notification channels, whose clients don't retry on their own
+NOTIFIER_SERVICES = ("ses", "sns")
+
+# boto3 clients and the state store are created on first use, and reused by warm invocations
+# of the same Lambda execution environment.
+_clients = {}
+_state_store = None
+_notifiers = None
+_delivery_executor = None
+
+def get_client(service_name):
+    if service_name not in _clients:
+        if service_name in NOTIFIER_SERVICES:
+            # Retries are done per channel by deliver_with_retries(), so botocore must not retry on its own.
+            config = Config(
+                connect_timeout=CHANNEL_TIMEOUT_SECONDS,
+                read_timeout=CHANNEL_TIMEOUT_SECONDS,
+                retries={"total_max_attempts": 1, "mode": "standard"},
+            )
+        else:
+            # Other clients (the state store) rely on botocore retries for throttling and transient errors
+            config = Config(retries={"mode": "standard"})
+        # {SERVICE}_ENDPOINT_URL points a client to a local stand-in for testing.
+        endpoint_url = os.environ.get(f"{service_name.upper()}_ENDPOINT_URL") or None
+        _clients[service_name] = boto3.client(service_name, config=config, endpoint_url=endpoint_url)
+    return _clients[service_name]
+
+def reset_clients():
+    """Drop cached clients, notifiers and the state store, as in a cold start."""
+    global _state_store, _notifiers
+    _clients.clear()
+    _state_store = None
+    _notifiers = None
 
 def format_event_time(event_time):
     try:
@@ -10,232 +84,167 @@ def format_event_time(event_time):
     except:
         return event_time
 
-def get_console_url(event):
-    region = event["region"]
-
+def get_cluster_name(event):
     if "ClusterName" in event["detail"]:
-        cluster_name = event["detail"]["ClusterName"]
+        return event["detail"]["ClusterName"]
     elif "EventDetails" in event["detail"]:
-        cluster_name = event["detail"]["EventDetails"]["ClusterName"]
-    else:
-        cluster_name = ""
+        return event["detail"]["EventDetails"].get("ClusterName", "")
+    return ""
+
+def get_console_url(event):
+    region = event["region"]
+    cluster_name = get_cluster_name(event)
     
     console_url = f"https://{region}.console.aws.amazon.com/sagemaker/home?region={region}#/cluster-management/{cluster_name}"
     return console_url
 
-def format_html_for_cluster_status_event(event):
-
-    html_body = '<body style="font-family:Helvetica; font-size: 11pt;">\n'
-
-    # Table of summary
-    html_body += '<table>\n'
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "AWS account:", 
-        event["account"]
-    )
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Region:", 
-        event["region"]
-    )
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Cluster name:", 
-        event["detail"]["ClusterName"]
-    )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Cluster status:", 
-        event["detail"]["ClusterStatus"]
-    )
-
-    html_body += '</table>\n'
+class SafeHtml(str):
+    """A string that is already HTML and is inserted into templates without escaping."""
+
+class HtmlTemplate:
+    """A template with {name} placeholders, compiled once at load time.
+
+    Compiling turns the literal parts into a %-format string and records the placeholder
+    order, so rendering is a single formatting call. Values are HTML-escaped unless they
+    are SafeHtml.
+    """
+
+    def __init__(self, source):
+        format_parts = []
+        self.field_names = []
+        for literal, field_name, _, _ in string.Formatter().parse(source):
+            format_parts.append(literal.replace("%", "%%"))
+            if field_name is not None:
+                format_parts.append("%s")
+                self.field_names.append(field_name)
+        self.format = "".join(format_parts)
+
+    def render(self, **values):
+        return SafeHtml(self.format % tuple( escape_html(values[name]) for name in self.field_names ))
+
+    def render_values(self, values):
+        """Render with positional values, in placeholder order."""
+        return SafeHtml(self.format % tuple( escape_html(value) for value in values ))
+
+def escape_html(value):
+    if isinstance(value, SafeHtml):
+        return value
+    return html.escape(str(value), quote=False)
+
+BODY_TEMPLATE = HtmlTemplate(
+    '<body style="font-family:Helvetica; font-size: 11pt;">\n'
+    '{content}'
+    '<a href="{console_url}">Link to HyperPod console</a>\n'
+    '</body>'
+)
+
+SUMMARY_TABLE_TEMPLATE = HtmlTemplate('<table>\n{rows}</table>\n<br>\n')
+DETAIL_TABLE_TEMPLATE = HtmlTemplate('<table border="1" >\n<caption>{caption}</caption>\n{rows}</table>\n<br>\n')
+# Row templates, compiled once per number of columns
+_row_templates = {}
+
+def get_row_template(num_columns, header):
+    key = (num_columns, header)
+    if key not in _row_templates:
+        cells = "".join( " <td>{%d}</td>" % i for i in range(num_columns) )
+        _row_templates[key] = HtmlTemplate(('<tr bgcolor="#ccccff">' if header else "<tr>") + cells + " </tr>\n")
+    return _row_templates[key]
+
+def render_row(values, header=False):
+    return get_row_template(len(values), header).render_values(values)
+
+def render_summary_table(rows):
+    return SUMMARY_TABLE_TEMPLATE.render(rows=SafeHtml("".join( render_row(row) for row in rows )))
+
+def render_detail_table(caption, rows, header=None):
+    rendered_rows = [render_row(header, header=True)] if header else []
+    rendered_rows += [ render_row(row) for row in rows ]
+    return DETAIL_TABLE_TEMPLATE.render(caption=caption, rows=SafeHtml("".join(rendered_rows)))
+
+def render_body(event, tables):
+    return str(BODY_TEMPLATE.render(content=SafeHtml("".join(tables)), console_url=get_console_url(event)))
 
-    html_body += "<br>\n"
-
-    # Table of instance groups
-    html_body += '<table border="1" >\n'
-    html_body += '<caption>Instance groups</caption>\n'
+def format_html_for_cluster_status_event(event):
 
-    # Header row
-    html_body += '<tr bgcolor="#ccccff"> <td>%s</td> <td>%s</td> <td>%s</td> <td>%s</td> </tr>\n' % (
-        "Name", "Status", "Current count", "Target count"
+    summary_table = render_summary_table([
+        ("AWS account:", event["account"]),
+        ("Region:", event["region"]),
+        ("Cluster name:", event["detail"]["ClusterName"]),
+        ("Cluster status:", event["detail"]["ClusterStatus"]),
+    ])
+
+    instance_groups_table = render_detail_table(
+        "Instance groups",
+        [
+            (
+                instance_group["InstanceGroupName"],
+                instance_group["Status"],
+                instance_group["CurrentCount"],
+                instance_group["TargetCount"],
+            )
+            for instance_group in event["detail"]["InstanceGroups"]
+        ],
+        header=("Name", "Status", "Current count", "Target count"),
     )
 
-    # Data row
-    for instance_group in event["detail"]["InstanceGroups"]:
-        html_body += "<tr> <td>%s</td> <td>%s</td> <td>%s</td> <td>%s</td> </tr>\n" % (
-            instance_group["InstanceGroupName"],
-            instance_group["Status"],
-            instance_group["CurrentCount"],
-            instance_group["TargetCount"],
-        )
-
-    html_body += '</table>\n'
-
-    html_body += "<br>\n"
-
-    # Hyperlink to console page
-    html_body += '<a href="%s">Link to HyperPod console</a>\n' % get_console_url(event)
-
-    html_body += "</body>"
-
-    return html_body
+    return render_body(event, [summary_table, instance_groups_table])
 
 def format_html_for_node_health_event(event):
 
-    html_body = '<body style="font-family:Helvetica; font-size: 11pt;">\n'
-
-    # Table of summary
-    html_body += '<table>\n'
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "AWS account:", 
-        event["account"]
-    )
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Region:", 
-        event["region"]
-    )
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Cluster name:", 
-        event["detail"]["ClusterName"]
-    )
-
-    html_body += '</table>\n'
-
-    html_body += "<br>\n"
-
-    # Table of instance groups
-    html_body += '<table border="1" >\n'
-    html_body += '<caption>Instance health info</caption>\n'
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Instance ID", 
-        event["detail"]["InstanceId"]
-    )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Health Status", 
-        event["detail"]["HealthSummary"]["HealthStatus"]
-    )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Health Status Reason", 
-        event["detail"]["HealthSummary"]["HealthStatusReason"]
-    )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "RepairAction", 
-        event["detail"]["HealthSummary"]["RepairAction"]
-    )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Recommendation", 
-        event["detail"]["HealthSummary"]["Recommendation"]
-    )
-
-    html_body += '</table>\n'
-
-    html_body += "<br>\n"
+    health_summary = event["detail"]["HealthSummary"]
 
-    # Hyperlink to console page
-    html_body += '<a href="%s">Link to HyperPod console</a>\n' % get_console_url(event)
+    summary_table = render_summary_table([
+        ("AWS account:", event["account"]),
+        ("Region:", event["region"]),
+        ("Cluster name:", event["detail"]["ClusterName"]),
+    ])
 
-    html_body += "</body>"
+    health_table = render_detail_table("Instance health info", [
+        ("Instance ID", event["detail"]["InstanceId"]),
+        ("Health Status", health_summary["HealthStatus"]),
+        ("Health Status Reason", health_summary["HealthStatusReason"]),
+        ("RepairAction", health_summary["RepairAction"]),
+        ("Recommendation", health_summary["Recommendation"]),
+    ])
 
-    return html_body
+    return render_body(event, [summary_table, health_table])
 
 def format_html_for_cluster_event(event):
     """Format HTML for generic cluster events with EventDetails."""
     
     event_details = event["detail"]["EventDetails"]
 
-    html_body = '<body style="font-family:Helvetica; font-size: 11pt;">\n'
-
-    # Table of summary
-    html_body += '<table>\n'
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "AWS account:", 
-        event["account"]
-    )
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Region:", 
-        event["region"]
-    )
-    
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Cluster name:", 
-        event_details.get("ClusterName", "N/A")
-    )
-
-    html_body += '</table>\n'
-
-    html_body += "<br>\n"
-
-    # Table of event details
-    html_body += '<table border="1" >\n'
-    html_body += '<caption>Event details</caption>\n'
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Resource Type", 
-        event_details.get("ResourceType", "N/A")
-    )
+    summary_table = render_summary_table([
+        ("AWS account:", event["account"]),
+        ("Region:", event["region"]),
+        ("Cluster name:", event_details.get("ClusterName", "N/A")),
+    ])
 
+    rows = [("Resource Type", event_details.get("ResourceType", "N/A"))]
     if "InstanceGroupName" in event_details:
-        html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-            "Instance Group", 
-            event_details["InstanceGroupName"]
-        )
-
+        rows.append(("Instance Group", event_details["InstanceGroupName"]))
     if "InstanceId" in event_details:
-        html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-            "Instance ID", 
-            event_details["InstanceId"]
-        )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Event Time", 
-        format_event_time(event_details.get("EventTime", "N/A"))
-    )
-
-    html_body += "<tr> <td>%s</td> <td>%s</td> </tr>\n" % (
-        "Description", 
-        event_details.get("Description", "N/A")
-    )
+        rows.append(("Instance ID", event_details["InstanceId"]))
+    rows.append(("Event Time", format_event_time(event_details.get("EventTime", "N/A"))))
+    rows.append(("Description", event_details.get("Description", "N/A")))
 
-    html_body += '</table>\n'
+    details_table = render_detail_table("Event details", rows)
 
-    html_body += "<br>\n"
+    return render_body(event, [summary_table, details_table])
 
-    # Hyperlink to console page
-    html_body += '<a href="%s">Link to HyperPod console</a>\n' % get_console_url(event)
-
-    html_body += "</body>"
-
-    return html_body
-
-def lambda_handler(event, context):
-    ses = boto3.client('ses')
-    
-    email_source = os.environ['SENDER_EMAIL_ADDRESS']
-    email_recipient = os.environ['RECEIVER_EMAIL_ADDRESS']
+def format_email_for_event(event):
+    """Return (subject, html body) for a single event."""
 
     event_type = event["detail-type"]
-    if event_type == "SageMaker HyperPod Cluster State Change":
+    if event_type == EVENT_TYPE_CLUSTER_STATE_CHANGE:
         cluster_status = event["detail"]["ClusterStatus"]
         email_subject = f"HyperPod Cluster State Change - {cluster_status}"
         email_body = format_html_for_cluster_status_event(event)
-    elif event_type == "SageMaker HyperPod Cluster Node Health Event":
+    elif event_type == EVENT_TYPE_NODE_HEALTH:
         node_status = event["detail"]["HealthSummary"]["HealthStatus"]
         email_subject = f"HyperPod Cluster Node Health Event - {node_status}"
         email_body = format_html_for_node_health_event(event)
-    elif event_type == "SageMaker HyperPod Cluster Event":
+    elif event_type == EVENT_TYPE_CLUSTER_EVENT:
         event_details = event["detail"]["EventDetails"]
         cluster_name = event_details.get("ClusterName", "Unknown")
         resource_type = event_details.get("ResourceType", "Unknown")
@@ -244,26 +253,611 @@ def lambda_handler(event, context):
     else:
         assert False, f"Unknown event type {event_type}"
 
-    ses.send_email(
-        Source=email_source,
-        Destination={
-            'ToAddresses': [email_recipient]
-        },
-        Message={
-            'Subject': {
-                "Charset": "UTF-8",
-                'Data': email_subject,
+    return email_subject, email_body
+
+def get_digest_row(event):
+    """Return one row of the digest table for an event, as (header, values)."""
+
+    event_type = event["detail-type"]
+    detail = event["detail"]
+
+    if event_type == EVENT_TYPE_CLUSTER_STATE_CHANGE:
+        instance_groups = ", ".join(
+            "%s: %s (%s/%s)" % (ig["InstanceGroupName"], ig["Status"], ig["CurrentCount"], ig["TargetCount"])
+            for ig in detail.get("InstanceGroups") or []
+        )
+        return ["Time", "Cluster status", "Instance groups"], [event["time"], detail["ClusterStatus"], instance_groups]
+
+    elif event_type == EVENT_TYPE_NODE_HEALTH:
+        health_summary = detail["HealthSummary"]
+        return ["Time", "Instance ID", "Health Status", "Health Status Reason", "RepairAction"], [
+            event["time"],
+            detail["InstanceId"],
+            health_summary["HealthStatus"],
+            health_summary["HealthStatusReason"],
+            health_summary["RepairAction"],
+        ]
+
+    elif event_type == EVENT_TYPE_CLUSTER_EVENT:
+        event_details = detail["EventDetails"]
+        return ["Event Time", "Resource Type", "Instance Group", "Instance ID", "Description"], [
+            format_event_time(event_details.get("EventTime", "N/A")),
+            event_details.get("ResourceType", "N/A"),
+            event_details.get("InstanceGroupName", ""),
+            event_details.get("InstanceId", ""),
+            event_details.get("Description", "N/A"),
+        ]
+
+    assert False, f"Unknown event type {event_type}"
+
+def format_html_for_digest(events):
+    """Format one HTML email for multiple events of the same type in the same cluster."""
+
+    first_event = events[0]
+
+    summary_table = render_summary_table([
+        ("AWS account:", first_event["account"]),
+        ("Region:", first_event["region"]),
+        ("Cluster name:", get_cluster_name(first_event)),
+        ("Number of events:", len(events)),
+        ("Period:", "%s - %s" % (events[0]["time"], events[-1]["time"])),
+    ])
+
+    # Aggregated table, one row per event
+    rows = [ get_digest_row(event) for event in events ]
+    events_table = render_detail_table(first_event["detail-type"], [ values for _, values in rows ], header=rows[0][0])
+
+    return render_body(first_event, [summary_table, events_table])
+
+def get_event_epoch(event):
+    try:
+        return datetime.strptime(event["time"], "%Y-%m-%dT%H:%M:%SZ").timestamp()
+    except (KeyError, ValueError):
+        return 0
+
+def group_events_for_digest(events, window_seconds=DIGEST_WINDOW_SECONDS):
+    """Group events by (cluster, event type, time window), keeping the time order within each group."""
+
+    groups = {}
+    for event in sorted(events, key=get_event_epoch):
+        window = int(get_event_epoch(event) // window_seconds) if window_seconds > 0 else 0
+        key = (get_cluster_name(event), event["detail-type"], window)
+        groups.setdefault(key, []).append(event)
+
+    return list(groups.values())
+
+def format_email_for_digest(events):
+    """Return (subject, html body) for a group of events. A single event gets the regular email."""
+
+    if len(events) == 1:
+        return format_email_for_event(events[0])
+
+    first_event = events[0]
+    event_type = first_event["detail-type"].replace("SageMaker HyperPod ", "")
+    email_subject = f"HyperPod {event_type} digest - {get_cluster_name(first_event)} - {len(events)} events"
+    email_body = format_html_for_digest(events)
+
+    return email_subject, email_body
+
+# State store items are dicts {"state", "updated_at", "status", "delivered"}. Writes are conditional on the item
+# read before (expected, or None for no item), and return False when another invocation changed it.
+
+class DictStateStore:
+    """Keeps states in a dict. Survives warm invocations only; mainly for testing."""
+
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        item = self.states.get(key)
+        return dict(item) if item else None
+
+    def _matches(self, key, expected):
+        current = self.states.get(key)
+        if expected is None:
+            return current is None
+        return current is not None and current["state"] == expected["state"] and current["updated_at"] == expected["updated_at"]
+
+    def put(self, key, item, expected):
+        with self.lock:
+            if not self._matches(key, expected):
+                return False
+            self.states[key] = dict(item)
+            self.save()
+            return True
+
+    def delete(self, key, expected):
+        with self.lock:
+            if not self._matches(key, expected):
+                return False
+            del self.states[key]
+            self.save()
+            return True
+
+    def save(self):
+        pass
+
+class FileStateStore(DictStateStore):
+    """Keeps states in a local JSON file."""
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        if os.path.exists(filename):
+            with open(filename) as fd:
+                self.states = json.load(fd)
+
+    def save(self):
+        with open(self.filename, "w") as fd:
+            json.dump(self.states, fd)
+
+class DynamoDBStateStore:
+    """Keeps states in a DynamoDB table with partition key "Key" (string) and TTL attribute "ExpiresAt"."""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = get_client("dynamodb")
+
+    def get(self, key):
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={"Key": {"S": key}},
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return None
+        item = response["Item"]
+        return {
+            "state": item["State"]["S"],
+            "updated_at": float(item["UpdatedAt"]["N"]),
+            # Items written before claims were introduced are all delivered
+            "status": item.get("Status", {"S": "sent"})["S"],
+            "delivered": [ name["S"] for name in item.get("Delivered", {"L": []})["L"] ],
+        }
+
+    def _condition(self, expected):
+        # "Key" and "State" are reserved words in DynamoDB expressions
+        if expected is None:
+            return {
+                "ConditionExpression": "attribute_not_exists(#key)",
+                "ExpressionAttributeNames": {"#key": "Key"},
+            }
+        return {
+            "ConditionExpression": "#state = :state AND UpdatedAt = :updated_at",
+            "ExpressionAttributeNames": {"#state": "State"},
+            "ExpressionAttributeValues": {":state": {"S": expected["state"]}, ":updated_at": {"N": str(expected["updated_at"])}},
+        }
+
+    def put(self, key, item, expected):
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    "Key": {"S": key},
+                    "State": {"S": item["state"]},
+                    "UpdatedAt": {"N": str(item["updated_at"])},
+                    "Status": {"S": item["status"]},
+                    "Delivered": {"L": [ {"S": name} for name in item.get("delivered", []) ]},
+                    # Let DynamoDB expire entries that are old enough not to suppress anything
+                    "ExpiresAt": {"N": str(int(item["updated_at"] + STATE_SUPPRESSION_TTL_SECONDS * 2))},
+                },
+                **self._condition(expected),
+            )
+            return True
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def delete(self, key, expected):
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={"Key": {"S": key}},
+                **self._condition(expected),
+            )
+            return True
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+
+def get_state_store():
+    global _state_store
+    if _state_store is None:
+        _state_store = create_state_store()
+    return _state_store
+
+def create_state_store():
+    if STATE_STORE == "none":
+        return None
+    elif STATE_STORE == "dynamodb":
+        return DynamoDBStateStore(STATE_TABLE_NAME)
+    elif STATE_STORE == "file":
+        return FileStateStore(STATE_FILE)
+    elif STATE_STORE == "dict":
+        return DictStateStore()
+    assert False, f"Unknown state store {STATE_STORE}"
+
+def get_state_key_and_value(event):
+    """Return (key, state) to compare with the previous notification for the same resource."""
+
+    event_type = event["detail-type"]
+    detail = event["detail"]
+    cluster_name = get_cluster_name(event)
+
+    if event_type == EVENT_TYPE_NODE_HEALTH:
+        health_summary = detail["HealthSummary"]
+        key = f"{cluster_name}#node#{detail['InstanceId']}"
+        state = f"{health_summary['HealthStatus']}#{health_summary['RepairAction']}"
+
+    elif event_type == EVENT_TYPE_CLUSTER_STATE_CHANGE:
+        # Include instance group counts, so scaling progress is still notified while the cluster stays "Updating"
+        key = f"{cluster_name}#cluster"
+        state = detail["ClusterStatus"] + "".join(
+            "#%s:%s:%s/%s" % (ig["InstanceGroupName"], ig["Status"], ig["CurrentCount"], ig["TargetCount"])
+            for ig in detail.get("InstanceGroups") or []
+        )
+
+    elif event_type == EVENT_TYPE_CLUSTER_EVENT:
+        # Every cluster event is unique, so only drop re-deliveries of the same event
+        event_details = detail["EventDetails"]
+        key = f"{cluster_name}#event#{event_details.get('EventId', event['id'])}"
+        state = "seen"
+
+    else:
+        assert False, f"Unknown event type {event_type}"
+
+    return key, state
+
+class StateClaim:
+    """The state of an event, written as "pending" before delivery.
+
+    After delivery the claim is committed ("sent"). When delivery fails, it is released,
+    so a re-delivered event is notified again: the previous item is restored, or when some
+    channels succeeded, the item is marked "partial" with them, and the retry skips them.
+    """
+
+    def __init__(self, key, item, previous):
+        self.key = key
+        self.item = item
+        self.previous = previous
+
+    @property
+    def delivered(self):
+        """Channels that already delivered this state, by an earlier invocation."""
+        return self.item["delivered"] if self.item else []
+
+    def commit(self, state_store):
+        # Fails only when a later event of the same resource replaced the claim, which is fine
+        state_store.put(self.key, dict(self.item, status="sent", delivered=[]), expected=self.item)
+
+    def release(self, state_store, delivered=()):
+        if delivered:
+            state_store.put(self.key, dict(self.item, status="partial", delivered=sorted(delivered)), expected=self.item)
+        elif self.previous:
+            state_store.put(self.key, self.previous, expected=self.item)
+        else:
+            state_store.delete(self.key, expected=self.item)
+
+def is_suppressed(previous, state, now):
+    """An event is suppressed when its resource was last notified with the same state less than
+    STATE_SUPPRESSION_TTL_SECONDS ago, or is being notified with it by another invocation."""
+
+    if not previous or previous["state"] != state:
+        return False
+    if previous.get("status", "sent") == "partial":
+        return False
+    if previous.get("status", "sent") == "pending":
+        return now - previous["updated_at"] < STATE_CLAIM_TIMEOUT_SECONDS
+    return now - previous["updated_at"] < STATE_SUPPRESSION_TTL_SECONDS
+
+def claim_state(state_store, event, now=None, max_attempts=3):
+    """Return a StateClaim if the event should be notified, or None if it is suppressed.
+
+    The claim is a conditional write on the item that was read, so of concurrent invocations
+    with the same state, exactly one gets the claim and the others are suppressed.
+    """
+
+    if state_store is None:
+        return StateClaim(None, None, None)
+
+    if now is None:
+        now = time.time()
+
+    key, state = get_state_key_and_value(event)
+
+    for _ in range(max_attempts):
+        previous = state_store.get(key)
+
+        if is_suppressed(previous, state, now):
+            print(f"Suppressed notification for {key} - state {state} unchanged")
+            return None
+
+        # A retry after a partial delivery carries over the channels that succeeded
+        delivered = []
+        if previous and previous["state"] == state and previous.get("status") == "partial" and now - previous["updated_at"] < STATE_SUPPRESSION_TTL_SECONDS:
+            delivered = previous.get("delivered", [])
+
+        item = {"state": state, "updated_at": now, "status": "pending", "delivered": delivered}
+        if state_store.put(key, item, expected=previous):
+            return StateClaim(key, item, previous)
+
+        # Another invocation wrote the item after it was read. Decide again on its state.
+
+    raise RuntimeError(f"State of {key} kept changing while claiming it")
+
+def commit_claims(state_store, claims):
+    if state_store is None:
+        return
+    for claim in claims:
+        claim.commit(state_store)
+
+def release_claims(state_store, claims, delivered=()):
+    if state_store is None:
+        return
+    # Newest first, so claims of the same resource in one batch unwind to the original item
+    for claim in reversed(claims):
+        try:
+            claim.release(state_store, delivered)
+        except Exception as e:
+            print(f"Failed to release the state of {claim.key}: {e}")
+
+def get_delivered_channels(state_store, claims):
+    """Channels that already delivered the states of all the claims, and are skipped on retry."""
+    if state_store is None or not claims:
+        return set()
+    return set.intersection(*( set(claim.delivered) for claim in claims ))
+
+def html_to_text(html_body):
+    """Plain text version of an email body, for channels that don't render HTML."""
+
+    text = re.sub(r"\s*<td>", "", html_body)
+    text = re.sub(r"</td>", "  ", text)
+    text = re.sub(r'<a href="([^"]*)">([^<]*)</a>', r"\2: \1", text)
+    text = re.sub(r"<[^>]+>", "", text)
+    text = "\n".join( line.strip() for line in text.splitlines() )
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return html.unescape(text).strip()
+
+class SesNotifier:
+    name = "ses"
+
+    def send(self, subject, html_body, text_body):
+
+        email_source = os.environ['SENDER_EMAIL_ADDRESS']
+        email_recipient = os.environ['RECEIVER_EMAIL_ADDRESS']
+
+        get_client("ses").send_email(
+            Source=email_source,
+            Destination={
+                'ToAddresses': [email_recipient]
             },
-            'Body': {
-                "Html": {
+            Message={
+                'Subject': {
                     "Charset": "UTF-8",
-                    "Data": email_body,
+                    'Data': subject,
+                },
+                'Body': {
+                    "Html": {
+                        "Charset": "UTF-8",
+                        "Data": html_body,
+                    }
                 }
             }
+        )
+
+class SnsNotifier:
+    name = "sns"
+
+    def __init__(self, topic_arn):
+        self.topic_arn = topic_arn
+
+    def send(self, subject, html_body, text_body):
+        get_client("sns").publish(
+            TopicArn=self.topic_arn,
+            # SNS subjects are limited to 100 characters
+            Subject=subject[:100],
+            Message=text_body,
+        )
+
+class WebhookNotifier:
+    """Posts JSON to an incoming webhook (Slack, Amazon Chime, or a generic JSON receiver)."""
+
+    name = "webhook"
+
+    def __init__(self, url, format):
+        self.url = url
+        self.format = format
+
+    def send(self, subject, html_body, text_body):
+
+        if self.format == "slack":
+            payload = {"text": f"*{subject}*\n```{text_body}```"}
+        elif self.format == "chime":
+            payload = {"Content": f"/md **{subject}**\n```\n{text_body}\n```"}
+        elif self.format == "json":
+            payload = {"subject": subject, "text": text_body, "html": html_body}
+        else:
+            assert False, f"Unknown webhook format {self.format}"
+
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=CHANNEL_TIMEOUT_SECONDS) as response:
+            response.read()
+
+def create_notifiers():
+
+    if NOTIFICATION_CHANNELS:
+        channels = [ channel.strip() for channel in NOTIFICATION_CHANNELS.split(",") if channel.strip() ]
+    else:
+        channels = []
+        if os.environ.get("SENDER_EMAIL_ADDRESS"):
+            channels.append("ses")
+        if SNS_TOPIC_ARN:
+            channels.append("sns")
+        if WEBHOOK_URL:
+            channels.append("webhook")
+
+    notifiers = []
+    for channel in channels:
+        if channel == "ses":
+            notifiers.append(SesNotifier())
+        elif channel == "sns":
+            notifiers.append(SnsNotifier(SNS_TOPIC_ARN))
+        elif channel == "webhook":
+            notifiers.append(WebhookNotifier(WEBHOOK_URL, WEBHOOK_FORMAT))
+        else:
+            assert False, f"Unknown notification channel {channel}"
+
+    return notifiers
+
+def get_notifiers():
+    global _notifiers
+    if _notifiers is None:
+        _notifiers = create_notifiers()
+    return _notifiers
+
+def get_delivery_executor():
+    global _delivery_executor
+    if _delivery_executor is None:
+        _delivery_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="notify")
+    return _delivery_executor
+
+def deliver_with_retries(notifier, subject, html_body, text_body):
+
+    for attempt in range(CHANNEL_MAX_RETRIES + 1):
+        try:
+            notifier.send(subject, html_body, text_body)
+            return
+        except Exception as e:
+            if attempt >= CHANNEL_MAX_RETRIES:
+                raise
+            delay = 0.2 * (2 ** attempt)
+            print(f"Delivery to {notifier.name} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+class DeliveryError(RuntimeError):
+    """Some channels failed. delivered lists the channels that succeeded (or were skipped)."""
+
+    def __init__(self, errors, delivered):
+        super().__init__(f"Delivery failed on channels: {errors}")
+        self.errors = errors
+        self.delivered = delivered
+
+def notify(subject, html_body, skip=()):
+    """Deliver one notification to all channels concurrently, except the ones in skip.
+
+    Raises DeliveryError when any channel failed, so that the event is retried. The
+    channels that succeeded are in the error, for the retry to skip them.
+    """
+
+    notifiers = get_notifiers()
+    assert notifiers, "No notification channel is configured"
+
+    text_body = html_to_text(html_body)
+
+    futures = {
+        get_delivery_executor().submit(deliver_with_retries, notifier, subject, html_body, text_body): notifier
+        for notifier in notifiers if notifier.name not in skip
+    }
+
+    errors = {}
+    for future in concurrent.futures.as_completed(futures):
+        notifier = futures[future]
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Delivery to {notifier.name} failed: {e}")
+            errors[notifier.name] = e
+
+    if errors:
+        delivered = [ notifier.name for notifier in notifiers if notifier.name not in errors ]
+        raise DeliveryError(errors, delivered)
+
+def handle_sqs_batch(state_store, records):
+    """Send digests for a batch of SQS messages.
+
+    Messages of digests that failed are returned in batchItemFailures, so that SQS
+    (with ReportBatchItemFailures) re-delivers only them, not the whole batch.
+    """
+
+    failed_message_ids = []
+
+    # Events are dicts decoded from the message bodies, so their ids map back to the messages
+    message_ids = {}
+    events = []
+    for record in records:
+        try:
+            e = json.loads(record["body"])
+        except json.JSONDecodeError as ex:
+            # A re-delivery can't fix a broken message, so it is dropped
+            print(f"Dropped message {record['messageId']}: {ex}")
+            continue
+        message_ids[id(e)] = record["messageId"]
+        events.append(e)
+
+    transitions = []
+    claims = {}
+    for e in sorted(events, key=get_event_epoch):
+        try:
+            claim = claim_state(state_store, e)
+        except Exception as ex:
+            print(f"State check failed for message {message_ids[id(e)]}: {ex}")
+            failed_message_ids.append(message_ids[id(e)])
+            continue
+        if claim:
+            transitions.append(e)
+            claims[id(e)] = claim
+
+    groups = group_events_for_digest(transitions)
+
+    num_sent = 0
+    for group in groups:
+        group_claims = [ claims[id(e)] for e in group ]
+        try:
+            email_subject, email_body = format_email_for_digest(group)
+            notify(email_subject, email_body, skip=get_delivered_channels(state_store, group_claims))
+        except Exception as ex:
+            print(f"Digest of {len(group)} events failed: {ex}")
+            release_claims(state_store, group_claims, getattr(ex, "delivered", ()))
+            failed_message_ids += [ message_ids[id(e)] for e in group ]
+            continue
+        commit_claims(state_store, group_claims)
+        num_sent += 1
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'{num_sent} notifications sent for {len(transitions)} events.'),
+        'batchItemFailures': [ {"itemIdentifier": message_id} for message_id in failed_message_ids ],
+    }
+
+def lambda_handler(event, context):
+    state_store = get_state_store()
+
+    # Batching mode: EventBridge -> SQS -> Lambda. The SQS event source mapping buffers events
+    # (MaximumBatchingWindowInSeconds), and each group in the batch is sent as one digest email.
+    if "Records" in event:
+        return handle_sqs_batch(state_store, event["Records"])
+
+    claim = claim_state(state_store, event)
+    if claim is None:
+        return {
+            'statusCode': 200,
+            'body': json.dumps('Notification suppressed. State unchanged.')
         }
-    )
+
+    # The state is recorded only after delivery, so a retried invocation isn't suppressed
+    try:
+        email_subject, email_body = format_email_for_event(event)
+        notify(email_subject, email_body, skip=get_delivered_channels(state_store, [claim]))
+    except Exception as ex:
+        release_claims(state_store, [claim], getattr(ex, "delivered", ()))
+        raise
+    commit_claims(state_store, [claim])
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Email sent successfully.')
+        'body': json.dumps('Notification sent successfully.')
     }
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Local HTTP stand-ins for the notification channels of lambda_function.py.
+
+Each stand-in records the requests it received, and can be slowed down or made
+to fail the first N requests, to test per-channel timeouts and retries:
+  - SES     : answers the SendEmail query API
+  - SNS     : answers the Publish query API
+  - webhook : accepts any JSON POST (Slack / Chime / generic)
+
+Run standalone to watch notifications from another process:
+    python3 local_channels.py
+"""
+import json
+import time
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers an AWS query API call of one action (SES and SNS). Subclasses set the action and its response."""
+
+    protocol_version = "HTTP/1.1"
+
+    action = None
+    response_xml = b""
+
+    def do_POST(self):
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        server = self.server
+        with server.lock:
+            server.num_requests += 1
+            fail = server.num_requests <= server.fail_first
+
+        if server.delay:
+            time.sleep(server.delay)
+
+        if fail:
+            self.reply(500, "text/plain", b"injected failure")
+            return
+
+        status, content_type, response = self.handle_body(body)
+
+        with server.lock:
+            server.received.append(body)
+        if server.verbose:
+            print(f"[{server.channel}] {body[:200]!r}")
+
+        self.reply(status, content_type, response)
+
+    def reply(self, status, content_type, response):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def handle_body(self, body):
+        params = urllib.parse.parse_qs(body.decode("utf-8"))
+        if params.get("Action") != [self.action]:
+            return 400, "text/plain", b"unsupported action"
+        return 200, "text/xml", self.response_xml
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SesHandler(StandInHandler):
+
+    action = "SendEmail"
+    response_xml = (
+        b'<SendEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+        b'<SendEmailResult><MessageId>local</MessageId></SendEmailResult>'
+        b'<ResponseMetadata><RequestId>local</RequestId></ResponseMetadata>'
+        b'</SendEmailResponse>'
+    )
+
+
+class SnsHandler(StandInHandler):
+
+    action = "Publish"
+    response_xml = (
+        b'<PublishResponse xmlns="http://sns.amazonaws.com/doc/2010-03-31/">'
+        b'<PublishResult><MessageId>local</MessageId></PublishResult>'
+        b'<ResponseMetadata><RequestId>local</RequestId></ResponseMetadata>'
+        b'</PublishResponse>'
+    )
+
+
+class WebhookHandler(StandInHandler):
+
+    def handle_body(self, body):
+        json.loads(body)
+        return 200, "text/plain", b"ok"
+
+
+handler_classes = {
+    "ses": SesHandler,
+    "sns": SnsHandler,
+    "webhook": WebhookHandler,
+}
+
+
+def start_stand_in(channel, delay=0.0, fail_first=0, verbose=False, port=0):
+    """Start a stand-in server in a background thread, and return it. server.url is its endpoint."""
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_classes[channel])
+    server.daemon_threads = True
+    server.channel = channel
+    server.delay = delay
+    server.fail_first = fail_first
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.num_requests = 0
+    server.received = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_all_stand_ins(delays=None, fail_first=None, verbose=False):
+    """Start stand-ins for all channels, and return (servers, environment variables for lambda_function)."""
+
+    delays = delays or {}
+    fail_first = fail_first or {}
+
+    servers = { channel: start_stand_in(channel, delays.get(channel, 0.0), fail_first.get(channel, 0), verbose) for channel in handler_classes }
+
+    environ = {
+        "NOTIFICATION_CHANNELS": "ses,sns,webhook",
+        "SES_ENDPOINT_URL": servers["ses"].url,
+        "SNS_ENDPOINT_URL": servers["sns"].url,
+        "SNS_TOPIC_ARN": "arn:aws:sns:us-west-2:123456789012:local-topic",
+        "WEBHOOK_URL": servers["webhook"].url,
+        "WEBHOOK_FORMAT": "json",
+        # boto3 still signs requests, so it needs some credentials and a region
+        "AWS_DEFAULT_REGION": "us-west-2",
+        "AWS_ACCESS_KEY_ID": "local",
+        "AWS_SECRET_ACCESS_KEY": "local",
+    }
+
+    return servers, environ
+
+
+def parse_channel_values(values, value_type):
+    """Parse ["webhook=3", ...] into {"webhook": 3}"""
+    result = {}
+    for value in values or []:
+        channel, _, v = value.partition("=")
+        if channel not in handler_classes:
+            raise ValueError(f"Unknown channel {channel}")
+        result[channel] = value_type(v)
+    return result
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Local stand-ins for SES, SNS and webhook notification channels")
+    argparser.add_argument('--delay', action="append", default=[], help='Response delay of a channel, e.g. webhook=3')
+    argparser.add_argument('--fail-first', action="append", default=[], help='Fail the first N requests of a channel, e.g. sns=2')
+    args = argparser.parse_args()
+
+    servers, environ = start_all_stand_ins(
+        parse_channel_values(args.delay, float),
+        parse_channel_values(args.fail_first, int),
+        verbose=True,
+    )
+
+    print("Set these environment variables for lambda_function.py:")
+    for key, value in environ.items():
+        print(f"export {key}={value}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
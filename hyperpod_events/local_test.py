@@ -1,22 +1,68 @@
 #!/usr/bin/env python3
 import os
 import json
+import time
 import argparse
 
-from lambda_function import lambda_handler
+
+def make_sqs_batch(events):
+    """Wrap events the way the SQS event source mapping delivers them to Lambda."""
+    return {
+        "Records": [
+            {
+                "messageId": f"local-{i}",
+                "eventSource": "aws:sqs",
+                "body": json.dumps(event),
+            }
+            for i, event in enumerate(events)
+        ]
+    }
 
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser(description="Lambda function to send HTML email by SES")
     argparser.add_argument('--sender', action="store", required=True, help='Sender email address')
     argparser.add_argument('--receiver', action="store", required=True, help='Receiver email address')
-    argparser.add_argument('--test-event-file', action="store", required=True, help='Test event JSON file')
+    argparser.add_argument('--test-event-file', action="store", nargs="+", required=True, help='Test event JSON file(s)')
+    argparser.add_argument('--batch', action="store_true", help='Deliver all test events in one SQS batch, as in the batching mode')
+    argparser.add_argument('--repeat', action="store", type=int, default=1, help='Repeat each test event N times, to simulate an event storm')
+    argparser.add_argument('--state-file', action="store", default=None, help='Enable de-duplication with a local JSON file as the state store')
+    argparser.add_argument('--local-channels', action="store_true", help='Deliver to local SES / SNS / webhook stand-ins instead of AWS')
+    argparser.add_argument('--local-delay', action="append", default=[], help='Response delay of a local stand-in, e.g. webhook=3')
+    argparser.add_argument('--local-fail-first', action="append", default=[], help='Fail the first N requests of a local stand-in, e.g. sns=2')
     args = argparser.parse_args()
 
     os.environ["SENDER_EMAIL_ADDRESS"] = args.sender
     os.environ["RECEIVER_EMAIL_ADDRESS"] = args.receiver
 
-    with open(args.test_event_file) as fd:
-        event = json.load(fd)
+    if args.state_file:
+        os.environ["STATE_STORE"] = "file"
+        os.environ["STATE_FILE"] = args.state_file
+
+    if args.local_channels:
+        import local_channels
+        servers, environ = local_channels.start_all_stand_ins(
+            local_channels.parse_channel_values(args.local_delay, float),
+            local_channels.parse_channel_values(args.local_fail_first, int),
+            verbose=True,
+        )
+        os.environ.update(environ)
+
+    # Import after setting environment variables, as the module reads them at load time
+    from lambda_function import lambda_handler
+
+    events = []
+    for test_event_file in args.test_event_file:
+        with open(test_event_file) as fd:
+            event = json.load(fd)
+        events += [event] * args.repeat
+
+    if args.batch:
+        invocations = [make_sqs_batch(events)]
+    else:
+        invocations = events
 
-    lambda_handler(event, None)
+    for invocation in invocations:
+        t0 = time.time()
+        print(lambda_handler(invocation, None))
+        print(f"Invocation took {time.time() - t0:.3f}s")
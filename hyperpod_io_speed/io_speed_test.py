@@ -2,6 +2,7 @@ import os
 import time
 import re
 import io
+import mmap
 import random
 import tempfile
 import subprocess
@@ -88,6 +89,21 @@ class Config:
         max_workers = 1
         s3_transfer_config = None
 
+    # File I/O mode for the FSx / NVMe read/write tests
+    #   "buffered" : regular buffered write()/read() through the page cache
+    #   "fsync"    : buffered, but fsync() before close is included in the write timing
+    #   "direct"   : O_DIRECT with page-aligned buffers, bypassing the page cache
+    io_mode = "buffered"
+    #io_mode = "fsync"
+    #io_mode = "direct"
+
+    # Size of each write()/read() call. Must be a multiple of 4KB for "direct" mode.
+    io_block_size = 16 * 1024 * 1024 # 16 MB
+
+    # Evict written files from the page cache with posix_fadvise(DONTNEED) before read tests,
+    # so that read numbers don't just measure the page cache right after the write.
+    evict_page_cache = True
+
     @staticmethod
     def print():
 
@@ -101,6 +117,9 @@ class Config:
         print(f"num_files : {Config.num_files}")
         print(f"max_workers : {Config.max_workers}")
         print(f"s3_transfer_config : {Config.s3_transfer_config}")
+        print(f"io_mode : {Config.io_mode}")
+        print(f"io_block_size : {Config.io_block_size}")
+        print(f"evict_page_cache : {Config.evict_page_cache}")
 
 
 def split_s3_path( s3_path ):
@@ -121,6 +140,15 @@ def get_file_size_string(size):
     return f"{size}{unit}"
 
 
+# O_DIRECT requires file offsets, sizes and buffer addresses to be aligned to the logical block size.
+# Anonymous mmap buffers are page aligned, and 4KB covers both NVMe and FSx for Lustre.
+DIRECT_IO_ALIGNMENT = 4096
+
+
+def align_up(size, alignment=DIRECT_IO_ALIGNMENT):
+    return (size + alignment - 1) // alignment * alignment
+
+
 class App:
 
     _s3_resoruce = None
@@ -217,23 +245,108 @@ class App:
     @staticmethod
     def write_single_file(fsx_path):
 
-        print(f"Writing to {fsx_path}")
+        print(f"Writing to {fsx_path} ({Config.io_mode})")
+
+        if Config.io_mode=="direct":
+            App._write_single_file_direct(fsx_path)
+            return fsx_path
 
-        with open( fsx_path, "wb" ) as fd:
-            fd.write(App.get_src_buffer())
+        src_buffer = memoryview(App.get_src_buffer())
+
+        with open( fsx_path, "wb", buffering=0 ) as fd:
+            for offset in range(0, len(src_buffer), Config.io_block_size):
+                fd.write(src_buffer[offset:offset+Config.io_block_size])
+            if Config.io_mode=="fsync":
+                os.fsync(fd.fileno())
 
         return fsx_path
 
 
+    @staticmethod
+    def _write_single_file_direct(fsx_path):
+
+        src_buffer = memoryview(App.get_src_buffer())
+        file_size = len(src_buffer)
+        block_size = align_up(Config.io_block_size)
+
+        # O_DIRECT needs an aligned user buffer, so stage each block through an anonymous mmap
+        aligned_buffer = mmap.mmap(-1, block_size)
+        fd = os.open( fsx_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o644 )
+        try:
+            for offset in range(0, file_size, block_size):
+                size = min(block_size, file_size-offset)
+                aligned_buffer[:size] = src_buffer[offset:offset+size]
+
+                # Pad the last partial block up to the alignment, and truncate after the loop
+                size_to_write = align_up(size)
+                aligned_buffer[size:size_to_write] = bytes(size_to_write-size)
+                size_written = os.write(fd, memoryview(aligned_buffer)[:size_to_write])
+                assert size_written==size_to_write, f"Short write to {fsx_path}: {size_written} of {size_to_write} bytes"
+
+            if align_up(file_size) != file_size:
+                os.ftruncate(fd, file_size)
+
+            # O_DIRECT bypasses the page cache, but not the device/metadata write-back
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            aligned_buffer.close()
+
+
     @staticmethod
     def read_single_file(fsx_path):
 
-        print(f"Reading {fsx_path}")
+        print(f"Reading {fsx_path} ({Config.io_mode})")
+
+        if Config.io_mode=="direct":
+            size_read = App._read_single_file_direct(fsx_path)
+        else:
+            size_read = 0
+            with open( fsx_path, "rb", buffering=0 ) as fd:
+                while True:
+                    d = fd.read(Config.io_block_size)
+                    if not d:
+                        break
+                    size_read += len(d)
+
+        assert size_read==Config.file_size
+
+        return fsx_path
+
+
+    @staticmethod
+    def _read_single_file_direct(fsx_path):
+
+        block_size = align_up(Config.io_block_size)
+        aligned_buffer = mmap.mmap(-1, block_size)
+
+        size_read = 0
+        fd = os.open( fsx_path, os.O_RDONLY | os.O_DIRECT )
+        try:
+            while True:
+                size = os.readv(fd, [aligned_buffer])
+                if size==0:
+                    break
+                size_read += size
+        finally:
+            os.close(fd)
+            aligned_buffer.close()
+
+        return size_read
+
+
+    @staticmethod
+    def evict_single_file(fsx_path):
 
-        with open( fsx_path, "rb" ) as fd:
-            d = fd.read()
+        print(f"Evicting {fsx_path} from page cache")
 
-        assert len(d)==Config.file_size
+        fd = os.open( fsx_path, os.O_RDONLY )
+        try:
+            # Dirty pages can't be dropped, so flush them first
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
 
         return fsx_path
 
@@ -261,7 +374,7 @@ class App:
         os.makedirs(Config.tmp_location, exist_ok=True)
 
 
-        def run_and_measure( subject, func, input ):
+        def run_and_measure( subject, func, input, print_bandwidth=True ):
 
             if Config.concurrent_executor=="thread":
                 PoolExecuterClass = concurrent.futures.ThreadPoolExecutor
@@ -282,7 +395,8 @@ class App:
             t1 = time.time()
 
             print(f"{subject} : Time spent : {t1-t0}")
-            print(f"{subject} : Bandwidth  : {(Config.file_size * Config.num_files) /(t1-t0) / (1024*1024)} MB/s")
+            if print_bandwidth:
+                print(f"{subject} : Bandwidth  : {(Config.file_size * Config.num_files) /(t1-t0) / (1024*1024)} MB/s")
 
 
         #run_and_measure("Upload to S3 with Boto3", App.upload_single_file, s3_paths)
@@ -290,8 +404,12 @@ class App:
         #run_and_measure("Download from S3 with AWSCLI(CRT)", App.download_single_file_with_awscli_crt, s3_paths)
         #run_and_measure("Download from S3 with s5cmd", App.download_single_file_with_s5cmd, s3_paths)
         run_and_measure("Write to FSx", App.write_single_file, fsx_paths)
+        if Config.evict_page_cache:
+            run_and_measure("Evict FSx files from page cache", App.evict_single_file, fsx_paths, print_bandwidth=False)
         run_and_measure("Read from FSx", App.read_single_file, fsx_paths)
         run_and_measure("Write to NVMe", App.write_single_file, nvme_paths)
+        if Config.evict_page_cache:
+            run_and_measure("Evict NVMe files from page cache", App.evict_single_file, nvme_paths, print_bandwidth=False)
         run_and_measure("Read from NVMe", App.read_single_file, nvme_paths)
 
 
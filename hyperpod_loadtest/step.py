@@ -1,65 +1,174 @@
 import os
+import sys
+import math
 import time
-import random
+import queue
 import logging
+import logging.handlers
 import concurrent.futures
 
 
 class Config:
-    
-    #logging_method = "print"
-    #logging_method = "print_with_flush"
-    logging_method = "logging_to_separate_files"
+
+    # Logging methods to compare. Each one is run for every line size and rate below.
+    #   "print"                     : print() to stdout (Slurm output file)
+    #   "print_with_flush"          : print(flush=True) to stdout
+    #   "logging_to_separate_files" : logging.FileHandler, one file per process
+    #   "logging_queue"             : QueueHandler in the caller, QueueListener thread writes the file
+    #   "buffered_writer"           : lines are batched in memory and written in large chunks
+    logging_methods = [
+        #"print",
+        #"print_with_flush",
+        "logging_to_separate_files",
+        "logging_queue",
+        "buffered_writer",
+    ]
 
     num_logging_processes = 1000
     num_logging_lines_per_process = 10
 
+    # Approximate size of each log line in bytes
+    line_sizes = [ 128 ]
+    #line_sizes = [ 128, 1024, 16 * 1024 ]
 
-class App:
+    # Lines per second per process. 0 means as fast as possible.
+    lines_per_second = [ 100 ]
+    #lines_per_second = [ 10, 100, 1000, 0 ]
 
-    @staticmethod
-    def init_worker():
-        print("Initializing worker process")
+    # Settings for "buffered_writer"
+    buffered_writer_batch_lines = 1000
+    buffered_writer_flush_interval = 1.0 # seconds
 
+    output_dir = "output/separate"
 
-    @staticmethod
-    def test_logging(job_id):
-        
-        slurm_node_id = os.environ["SLURM_NODEID"]
 
-        if Config.logging_method=="logging_to_separate_files":
-            os.makedirs("output/separate", exist_ok=True)
-            logging.basicConfig(filename=f"output/separate/log_{slurm_node_id}_{job_id}.txt", level=logging.DEBUG)
+class BufferedLogWriter:
 
-        i = 0
-        while True:
-            if Config.logging_method=="print":
-                print(f"test_logging slurm_node_id={slurm_node_id}, job_id={job_id}, i={i}")
-            elif Config.logging_method=="print_with_flush":
-                print(f"test_logging slurm_node_id={slurm_node_id}, job_id={job_id}, i={i}", flush=True)
-            elif Config.logging_method=="logging_to_separate_files":
-                logging.info(f"test_logging slurm_node_id={slurm_node_id}, job_id={job_id}, i={i}")
-            time.sleep(0.01)
+    """Collects lines in memory and writes them to the file in one call per batch.
 
-            if i>=Config.num_logging_lines_per_process:
-                break
+    The batch is flushed when it reaches batch_lines, or on the first write after
+    flush_interval seconds, so a quiet process may hold lines until close().
+    """
 
-            i+=1
+    def __init__(self, filename, batch_lines, flush_interval):
+        self.fd = open(filename, "w", buffering=1024 * 1024)
+        self.batch_lines = batch_lines
+        self.flush_interval = flush_interval
+        self.batch = []
+        self.last_flush = time.monotonic()
 
-        return i
+    def write(self, line):
+        self.batch.append(line)
+        if len(self.batch) >= self.batch_lines or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
 
+    def flush(self):
+        if self.batch:
+            self.fd.write("".join(self.batch))
+            self.batch = []
+        self.fd.flush()
+        self.last_flush = time.monotonic()
 
-    def main(self):
+    def close(self):
+        self.flush()
+        self.fd.close()
 
-        input_logging = range(Config.num_logging_processes)
 
-        t0 = time.time()
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values)-1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
 
-        pool_executer_logging = concurrent.futures.ProcessPoolExecutor(
-            max_workers=Config.num_logging_processes, 
-            initializer=App.init_worker, 
-            initargs=[]
-        )
+
+class App:
+
+    @staticmethod
+    def init_worker():
+        print("Initializing worker process")
+
+
+    @staticmethod
+    def test_logging(params):
+
+        job_id, logging_method, line_size, lines_per_second = params
+
+        slurm_node_id = os.environ.get("SLURM_NODEID", "0")
+        # One file per test case and process, truncated, so each case's output can be inspected separately
+        log_filename = os.path.join(Config.output_dir, f"log_{logging_method}_{line_size}B_{lines_per_second}lps_{slurm_node_id}_{job_id}.txt")
+
+        # Build the handlers explicitly instead of logging.basicConfig(), because worker
+        # processes are reused across test cases.
+        logger = None
+        listener = None
+        writer = None
+
+        if logging_method=="logging_to_separate_files":
+            logger = logging.getLogger(f"loadtest.{job_id}")
+            logger.addHandler(logging.FileHandler(log_filename, mode="w"))
+        elif logging_method=="logging_queue":
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, logging.FileHandler(log_filename, mode="w"))
+            listener.start()
+            logger = logging.getLogger(f"loadtest.{job_id}")
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        elif logging_method=="buffered_writer":
+            writer = BufferedLogWriter(log_filename, Config.buffered_writer_batch_lines, Config.buffered_writer_flush_interval)
+
+        if logger:
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+
+        prefix = f"test_logging slurm_node_id={slurm_node_id}, job_id={job_id}, i="
+        padding = "x" * max(0, line_size - len(prefix) - 10)
+
+        latencies = []
+        t_start = time.perf_counter()
+
+        for i in range(Config.num_logging_lines_per_process):
+
+            message = f"{prefix}{i:08d} {padding}"
+
+            # Per-line latency is how long the caller (a training rank) is blocked
+            t0 = time.perf_counter()
+            if logging_method=="print":
+                print(message)
+            elif logging_method=="print_with_flush":
+                print(message, flush=True)
+            elif logger:
+                logger.info(message)
+            elif writer:
+                writer.write(message + "\n")
+            latencies.append(time.perf_counter() - t0)
+
+            if lines_per_second:
+                delay = t_start + (i+1) / lines_per_second - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        # Drain whatever is still buffered, so the total time includes it
+        if listener:
+            listener.stop()
+        if logger:
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+            if listener:
+                for handler in listener.handlers:
+                    handler.close()
+        if writer:
+            writer.close()
+        if logging_method=="print":
+            sys.stdout.flush()
+
+        return latencies
+
+
+    def run_test_case(self, pool_executer_logging, logging_method, line_size, lines_per_second):
+
+        input_logging = [ (job_id, logging_method, line_size, lines_per_second) for job_id in range(Config.num_logging_processes) ]
+
+        t0 = time.time()
 
         map_result = pool_executer_logging.map(
             App.test_logging,
@@ -71,14 +180,49 @@ class App:
 
         t1 = time.time()
 
-        total_num_log_lines = sum(map_result)
-        print(f"Num lines wrote : {total_num_log_lines}")
-        print(f"Time spent : {t1-t0}")
-        print(f"Line per second  : {total_num_log_lines /(t1-t0)}")
+        latencies = sorted( latency for latencies in map_result for latency in latencies )
+        total_num_log_lines = len(latencies)
+
+        return {
+            "logging_method": logging_method,
+            "line_size": line_size,
+            "lines_per_second": lines_per_second,
+            "num_lines": total_num_log_lines,
+            "time_spent": t1-t0,
+            "lines_per_sec_total": total_num_log_lines / (t1-t0),
+            "p50_us": percentile(latencies, 50) * 1e6,
+            "p99_us": percentile(latencies, 99) * 1e6,
+            "p999_us": percentile(latencies, 99.9) * 1e6,
+            "max_us": (latencies[-1] if latencies else 0.0) * 1e6,
+        }
+
+
+    def main(self):
+
+        os.makedirs(Config.output_dir, exist_ok=True)
+
+        pool_executer_logging = concurrent.futures.ProcessPoolExecutor(
+            max_workers=Config.num_logging_processes,
+            initializer=App.init_worker,
+            initargs=[]
+        )
+
+        results = []
+        with pool_executer_logging:
+            for logging_method in Config.logging_methods:
+                for line_size in Config.line_sizes:
+                    for lines_per_second in Config.lines_per_second:
+                        result = self.run_test_case(pool_executer_logging, logging_method, line_size, lines_per_second)
+                        results.append(result)
+
+        # Print results at the end, so they are not interleaved with the "print" test output
+        print()
+        print(f"{'method':<26} {'size':>6} {'rate':>6} {'lines':>9} {'time[s]':>9} {'lines/s':>11} {'p50[us]':>9} {'p99[us]':>10} {'p999[us]':>10} {'max[us]':>10}")
+        for r in results:
+            print(f"{r['logging_method']:<26} {r['line_size']:>6} {r['lines_per_second']:>6} {r['num_lines']:>9} {r['time_spent']:>9.2f} {r['lines_per_sec_total']:>11.1f} {r['p50_us']:>9.1f} {r['p99_us']:>10.1f} {r['p999_us']:>10.1f} {r['max_us']:>10.1f}")
 
 
 
 if __name__ == "__main__":
     app = App()
     app.main()
-    
\ No newline at end of file